@@ -0,0 +1,114 @@
+import os
+import copy
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import orjson
+from cron_congress_trading import (
+    build_symbol_index, create_politician_db, save_politician_db, create_search_list, generate_id,
+)
+
+# Politician db build on a synthetic trade set, old list scans and full rewrite
+# against the symbol index with content hashes. Runs in a temporary directory.
+
+
+def synthetic_data(n_trades, n_politicians=800, seed=42):
+    rng = random.Random(seed)
+    stock_raw_data = [{'symbol': f"S{i}", 'name': f"Stock {i}", 'sector': None} for i in range(8000)]
+    etf_raw_data = [{'symbol': f"E{i}", 'name': f"ETF {i}"} for i in range(3000)]
+    crypto_raw_data = [{'symbol': f"C{i}USD", 'name': f"Crypto {i}"} for i in range(300)]
+    symbols = [item['symbol'] for item in stock_raw_data + etf_raw_data + crypto_raw_data] + ['UNKNOWN']
+    screener = {item['symbol']: {'sector': f"Sector {i % 11}", 'industry': f"Industry {i % 67}"}
+                for i, item in enumerate(stock_raw_data)}
+    names = [f"Politician {i}" + (" (Senator)" if i % 5 == 0 else "") for i in range(n_politicians)]
+    trades = []
+    for _ in range(n_trades):
+        name = rng.choice(names)
+        key = 'ticker' if rng.random() < 0.9 else 'symbol'
+        trades.append({
+            key: rng.choice(symbols),
+            'representative': name,
+            'id': generate_id(name),
+            'transactionDate': f"20{rng.randint(15, 25)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            'type': rng.choice(['Bought', 'Sold']),
+            'amount': '$1K-$15K',
+            'district': 'California',
+        })
+    return trades, stock_raw_data, etf_raw_data, crypto_raw_data, screener
+
+
+def baseline_build(data, stock_raw_data, etf_raw_data, crypto_raw_data, screener):
+    # The old builder: list membership tests, a linear name lookup per trade,
+    # every file rewritten and then read back for the search list
+    stock_symbols = [item['symbol'] for item in stock_raw_data]
+    etf_symbols = [item['symbol'] for item in etf_raw_data]
+    crypto_symbols = [item['symbol'] for item in crypto_raw_data]
+    for item in data:
+        for symbols, raw_data, asset_type in ((stock_symbols, stock_raw_data, 'stock'), (etf_symbols, etf_raw_data, 'etf'), (crypto_symbols, crypto_raw_data, 'crypto')):
+            if ('ticker' in item and item['ticker'] in symbols) or ('symbol' in item and item['symbol'] in symbols):
+                for j in raw_data:
+                    if (item.get('ticker') or item.get('symbol')) == j['symbol']:
+                        item['ticker'] = j['symbol']
+                        item['name'] = j['name']
+                        item['assetType'] = asset_type
+                        break
+                break
+
+    # Tickers are resolved already, an empty index leaves them as they are
+    politicians = create_politician_db(data, {}, screener)
+    for politician_id, result in politicians.items():
+        with open(f"json/congress-trading/politician-db/{politician_id}.json", 'wb') as file:
+            file.write(orjson.dumps(result))
+    for filename in os.listdir('json/congress-trading/politician-db'):
+        with open(f"json/congress-trading/politician-db/{filename}", 'rb') as file:
+            orjson.loads(file.read())
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:>8.2f}s")
+    return result, elapsed
+
+
+def run(n_trades):
+    trades, stock_raw_data, etf_raw_data, crypto_raw_data, screener = synthetic_data(n_trades)
+    cwd = os.getcwd()
+    directory = tempfile.mkdtemp()
+    try:
+        os.chdir(directory)
+        os.makedirs('json/congress-trading/politician-db')
+        print(f"Trades: {len(trades)}")
+
+        _, baseline_time = timed("old builder (list scans, full rewrite)", baseline_build,
+                                 copy.deepcopy(trades), stock_raw_data, etf_raw_data, crypto_raw_data, screener)
+        shutil.rmtree('json/congress-trading/politician-db')
+
+        cache = {}
+
+        def indexed_build(data):
+            symbol_index = build_symbol_index(stock_raw_data, etf_raw_data, crypto_raw_data)
+            politicians = create_politician_db(data, symbol_index, screener)
+            written = save_politician_db(politicians, cache)
+            create_search_list(cache)
+            return written
+
+        written, first_time = timed("indexed builder, first run", indexed_build, copy.deepcopy(trades))
+        print(f"  files written: {written}")
+        written, second_time = timed("indexed builder, unchanged trades", indexed_build, copy.deepcopy(trades))
+        print(f"  files written: {written}")
+        print(f"speedup: {baseline_time / max(first_time, 1e-9):.1f}x first run, "
+              f"{baseline_time / max(second_time, 1e-9):.1f}x unchanged")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the congress trading politician db build.')
+    parser.add_argument('--trades', type=int, default=100_000)
+    args = parser.parse_args()
+    run(args.trades)
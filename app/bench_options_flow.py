@@ -0,0 +1,95 @@
+import time
+import argparse
+import orjson
+from datetime import datetime, timedelta
+from cron_unusual_activity import get_total_symbols, get_date_range, get_live_flow, build_activity
+from utils.options_flow_store import connect, get_partitions, group_by_ticker
+
+# Full-universe rebuild time of the unusual activity and options stats inputs,
+# old json scans against the flow store. Nothing is written to json/.
+
+
+def baseline_dataset():
+    # Old cron_unusual_activity.get_dataset: 365 daily files plus the live feed
+    today = datetime.today()
+    start_date = today - timedelta(days=365)
+    date_list = [(start_date + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(365)]
+    unique_data = {}
+    for date in date_list + [None]:
+        path = f"json/options-historical-data/flow-data/{date}.json" if date else "json/options-flow/feed/data.json"
+        try:
+            with open(path, "r") as file:
+                data = orjson.loads(file.read())
+            for item in data:
+                if item['cost_basis'] >= 1E6 and "id" in item:
+                    unique_data[item["id"]] = item
+        except:
+            pass
+    return list(unique_data.values())
+
+
+def baseline_activity(symbol, data):
+    res_list = [item for item in data if item['ticker'] == symbol]
+    return sorted(res_list, key=lambda x: x['date'], reverse=True)
+
+
+def baseline_feed_scan(symbols):
+    # Old cron_options_stats: the feed is parsed again and scanned for every symbol
+    for symbol in symbols:
+        with open("json/options-flow/feed/data.json", "r") as file:
+            all_data = orjson.loads(file.read())
+        [item for item in all_data if item.get('ticker') == symbol]
+
+
+def store_feed_scan(symbols):
+    with open("json/options-flow/feed/data.json", "r") as file:
+        flow_by_ticker = group_by_ticker(orjson.loads(file.read()))
+    for symbol in symbols:
+        flow_by_ticker.get(symbol, [])
+
+
+def timed(label, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:>8.2f}s")
+    return result, elapsed
+
+
+def run(limit=None):
+    symbols = get_total_symbols()[:limit]
+    con = connect()
+    cursor = con.cursor()
+    print(f"Symbols: {len(symbols)}, stored flow dates: {len(get_partitions(cursor))}")
+
+    def baseline_unusual():
+        data = baseline_dataset()
+        return {symbol: len(baseline_activity(symbol, data)) for symbol in symbols}
+
+    def store_unusual():
+        start_date, end_date = get_date_range()
+        live_flow = get_live_flow()
+        return {symbol: len(build_activity(symbol, cursor, live_flow, start_date, end_date)) for symbol in symbols}
+
+    baseline_counts, baseline_time = timed("unusual activity (json scan)", baseline_unusual)
+    store_counts, store_time = timed("unusual activity (flow store)", store_unusual)
+    if baseline_counts != store_counts:
+        mismatched = [symbol for symbol in symbols if baseline_counts[symbol] != store_counts[symbol]]
+        print(f"Row counts differ for {len(mismatched)} symbols, e.g. {mismatched[:10]}")
+    print(f"speedup: {baseline_time / max(store_time, 1e-9):.1f}x")
+
+    try:
+        _, baseline_time = timed("options stats feed (per symbol parse)", baseline_feed_scan, symbols)
+        _, store_time = timed("options stats feed (grouped once)", store_feed_scan, symbols)
+        print(f"speedup: {baseline_time / max(store_time, 1e-9):.1f}x")
+    except FileNotFoundError as e:
+        print(f"Skipping options stats: {e}")
+
+    con.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the options flow rebuilds against the json scans.')
+    parser.add_argument('--limit', type=int, default=None, help='Only use the first N symbols')
+    args = parser.parse_args()
+    run(args.limit)
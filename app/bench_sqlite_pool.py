@@ -0,0 +1,132 @@
+import os
+import time
+import random
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from utils import sqlite_pool
+from utils.sqlite_pool import ReadOnlyDatabase
+
+# Parallel /similar-etfs style queries, the old shared connection queried on the
+# event loop against the read-only pool with a growing number of executor
+# threads, and how long the event loop was blocked meanwhile. Uses a synthetic
+# WAL database in a temporary directory unless --db points at an etf.db.
+
+QUERY = """
+    SELECT symbol, name, totalAssets, numberOfHoldings
+    FROM etfs
+    WHERE symbol <> ? AND ABS(totalAssets - (
+        SELECT totalAssets FROM etfs WHERE symbol = ?
+    )) >= 0.2 * (
+        SELECT totalAssets FROM etfs WHERE symbol = ?
+    )
+    ORDER BY totalAssets DESC
+    LIMIT 15
+"""
+
+
+def synthetic_db(path, n_rows):
+    rng = random.Random(42)
+    con = sqlite3.connect(path)
+    con.execute("PRAGMA journal_mode = wal")
+    con.execute("CREATE TABLE etfs (symbol TEXT PRIMARY KEY, name TEXT, totalAssets REAL, numberOfHoldings INTEGER)")
+    con.executemany("INSERT INTO etfs VALUES (?, ?, ?, ?)", [
+        (f"E{i}", f"ETF {i}", rng.uniform(1e6, 1e11), rng.randint(10, 3000)) for i in range(n_rows)
+    ])
+    con.commit()
+    con.close()
+
+
+def get_symbols(path):
+    con = sqlite3.connect(path)
+    symbols = [row[0] for row in con.execute("SELECT symbol FROM etfs")]
+    con.close()
+    return symbols
+
+
+async def probe_lag(done, interval=0.001):
+    # Longest the event loop was unable to run other requests
+    worst = 0.0
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def with_lag_probe(requests):
+    # requests() starts the gather once the probe is running
+    done = asyncio.Event()
+    probe = asyncio.create_task(probe_lag(done))
+    await asyncio.sleep(0)
+    await requests()
+    done.set()
+    return await probe
+
+
+async def baseline(path, tickers):
+    # Old main.py: one module level connection used inside the async handlers
+    con = sqlite3.connect(path)
+
+    async def handler(ticker):
+        cursor = con.cursor()
+        cursor.execute(QUERY, (ticker, ticker, ticker))
+        rows = cursor.fetchall()
+        cursor.close()
+        return rows
+
+    lag = await with_lag_probe(lambda: asyncio.gather(*[handler(ticker) for ticker in tickers]))
+    con.close()
+    return lag
+
+
+async def pooled(db, tickers):
+    return await with_lag_probe(lambda: asyncio.gather(*[db.fetchall(QUERY, (ticker, ticker, ticker)) for ticker in tickers]))
+
+
+def timed(label, coroutine_func, *args):
+    start = time.perf_counter()
+    lag = asyncio.run(coroutine_func(*args))
+    elapsed = time.perf_counter() - start
+    n_requests = len(args[-1])
+    print(f"{label:<32} {elapsed:>7.2f}s {n_requests / elapsed:>9.0f} req/s, event loop blocked up to {lag * 1000:.0f}ms")
+    return elapsed
+
+
+def run(db_path, n_rows, n_requests, workers):
+    directory = None
+    if db_path is None:
+        directory = tempfile.mkdtemp()
+        db_path = os.path.join(directory, 'etf.db')
+        synthetic_db(db_path, n_rows)
+    try:
+        rng = random.Random(7)
+        symbols = get_symbols(db_path)
+        tickers = [rng.choice(symbols) for _ in range(n_requests)]
+        print(f"Rows: {len(symbols)}, requests: {n_requests}, cpus: {os.cpu_count()}")
+
+        baseline_time = timed("shared connection on the loop", baseline, db_path, tickers)
+        for n_workers in workers:
+            sqlite_pool._executor = ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='sqlite')
+            db = ReadOnlyDatabase(db_path)
+            # Warm up, every thread opens its connection once
+            asyncio.run(pooled(db, tickers[:n_workers * 4]))
+            elapsed = timed(f"pool, {n_workers} threads", pooled, db, tickers)
+            print(f"  speedup: {baseline_time / elapsed:.1f}x")
+            sqlite_pool._executor.shutdown()
+    finally:
+        if directory:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the read-only SQLite pool under parallel requests.')
+    parser.add_argument('--db', default=None, help='Use this etf.db instead of a synthetic one')
+    parser.add_argument('--rows', type=int, default=50_000)
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+    run(args.db, args.rows, args.requests, args.workers)
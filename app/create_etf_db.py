@@ -9,6 +9,7 @@ from tqdm import tqdm
 import re
 import pandas as pd
 from datetime import datetime
+from utils.holdings_index import create_etf_holdings_table, replace_etf_holdings
 
 import warnings
 
@@ -136,6 +137,7 @@ class ETFDatabase:
             type TEXT
         )
         """)
+        create_etf_holdings_table(self.cursor)
 
     def get_column_type(self, value):
         column_type = ""
@@ -192,6 +194,7 @@ class ETFDatabase:
             ]
 
             fundamental_data = {}
+            holdings = None
 
     
             for url in urls:
@@ -230,7 +233,8 @@ class ETFDatabase:
 
                         elif isinstance(parsed_data, list) and "etf-holder" in url:
                             fundamental_data['holding'] = ujson.dumps(parsed_data)
-                            data_dict = {'numberOfHoldings': len(json.loads(fundamental_data['holding']))}
+                            holdings = parsed_data
+                            data_dict = {'numberOfHoldings': len(parsed_data)}
                             fundamental_data.update(data_dict)
                         elif isinstance(parsed_data, list) and "etf-country-weightings" in url:
                             fundamental_data['country_weightings'] = ujson.dumps(parsed_data)
@@ -270,6 +274,9 @@ class ETFDatabase:
 
                 self.cursor.execute(f"UPDATE etfs SET {column} = ? WHERE symbol = ?", (value, symbol))
 
+            if holdings is not None:
+                replace_etf_holdings(self.cursor, symbol, holdings)
+
             self.conn.commit()
 
         except Exception as e:
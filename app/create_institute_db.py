@@ -14,6 +14,7 @@ import warnings
 from dotenv import load_dotenv
 import os
 import re
+from utils.holdings_index import create_institute_holdings_table, replace_institute_holdings
 
 # Filter out the specific RuntimeWarning
 warnings.filterwarnings("ignore", category=RuntimeWarning, message="invalid value encountered in scalar divide")
@@ -64,6 +65,35 @@ load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 quarter_date = '2024-09-30'
 
+MAX_CONCURRENT_INSTITUTES = 20
+PAGES_PER_WAVE = 5
+COMMIT_BATCH_SIZE = 100
+
+# Type of every known symbol, stocks take precedence over crypto and etf
+symbol_types = {symbol: 'etf' for symbol in etf_symbols}
+symbol_types.update({symbol: 'crypto' for symbol in crypto_symbols})
+symbol_types.update({symbol: 'stocks' for symbol in stock_symbols})
+
+
+class RateLimiter:
+    def __init__(self, rate_limit=300, sleep_time=60):
+        self.rate_limit = rate_limit
+        self.sleep_time = sleep_time
+        self.request_count = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            self.request_count += 1
+            if self.request_count >= self.rate_limit:
+                print(f"Processed {self.rate_limit} requests. Sleeping for {self.sleep_time} seconds...")
+                await asyncio.sleep(self.sleep_time)
+                self.request_count = 0
+
+
+# Shared budget for all FMP requests of this job
+rate_limiter = RateLimiter(rate_limit=3000, sleep_time=60)
+
 
 
 if os.path.exists("backup_db/institute.db"):
@@ -85,6 +115,7 @@ class InstituteDatabase:
         self.cursor.execute("PRAGMA journal_mode = wal")
         self.conn.commit()
         self._create_table()
+        self.columns = None
 
     def close_connection(self):
         self.cursor.close()
@@ -97,6 +128,7 @@ class InstituteDatabase:
             name TEXT
         )
         """)
+        create_institute_holdings_table(self.cursor)
 
 
     def get_column_type(self, value):
@@ -130,56 +162,62 @@ class InstituteDatabase:
 
 
 
-    async def save_portfolio_data(self, session, cik):
+    async def fetch_json(self, session, url):
+        await rate_limiter.acquire()
+        async with session.get(url) as response:
+            return get_jsonparsed_data(await response.text())
+
+    async def fetch_holdings(self, session, cik):
+        """
+        Fetch the holdings pages of a CIK, PAGES_PER_WAVE pages concurrently,
+        until the first empty page.
+        """
+        holdings_data = []
+        for first_page in range(0, 100, PAGES_PER_WAVE):
+            urls = [
+                f"https://financialmodelingprep.com/api/v4/institutional-ownership/portfolio-holdings?cik={cik}&date={quarter_date}&page={page}&apikey={api_key}"
+                for page in range(first_page, min(first_page + PAGES_PER_WAVE, 100))
+            ]
+            pages = await asyncio.gather(*[self.fetch_json(session, url) for url in urls])
+            for parsed_data in pages:
+                if not parsed_data:  # Stop if no more data
+                    return holdings_data
+                if isinstance(parsed_data, list):
+                    holdings_data.extend(parsed_data)
+        return holdings_data
+
+    def classify_holdings(self, holdings_data):
+        for item in holdings_data:
+            if item['symbol'] is None:
+                normalized_security_name = normalize_name(item['securityName'])
+                if normalized_security_name in stock_dict:
+                    item['symbol'] = stock_dict[normalized_security_name]
+                elif normalized_security_name in etf_dict:
+                    item['symbol'] = etf_dict[normalized_security_name]
+
+        return [
+            {**item, 'type': symbol_types[item['symbol']]}
+            for item in holdings_data
+            if item.get('symbol') in symbol_types
+        ]
+
+    async def get_portfolio_data(self, session, cik):
         try:
             # Fetch summary data
             summary_url = f"https://financialmodelingprep.com/api/v4/institutional-ownership/portfolio-holdings-summary?cik={cik}&page=0&apikey={api_key}"
-            async with session.get(summary_url) as response:
-                summary_data = await response.text()
-                summary_parsed_data = get_jsonparsed_data(summary_data)
-
-            portfolio_data = {}
-            holdings_data = []
-
-            # Fetch paginated holdings data
-            for page in range(0,100):
-                holdings_url = f"https://financialmodelingprep.com/api/v4/institutional-ownership/portfolio-holdings?cik={cik}&date={quarter_date}&page={page}&apikey={api_key}"
-                async with session.get(holdings_url) as response:
-                    data = await response.text()
-                    parsed_data = get_jsonparsed_data(data)
-
-                    if not parsed_data:  # Stop if no more data
-                        break
-
-                    if isinstance(parsed_data, list):
-                        for item in parsed_data:
-                            if item['symbol'] is None:
-                                normalized_security_name = normalize_name(item['securityName'])
-                                if normalized_security_name in stock_dict:
-                                    item['symbol'] = stock_dict[normalized_security_name]
-                                elif normalized_security_name in etf_dict:
-                                    item['symbol'] = etf_dict[normalized_security_name]
-
-                        parsed_data = [
-                            {**item, 'type': ('stocks' if item['symbol'] in stock_symbols else
-                                              'crypto' if item['symbol'] in crypto_symbols else
-                                              'etf' if item['symbol'] in etf_symbols else None)}
-                            for item in parsed_data
-                            if 'symbol' in item and item['symbol'] is not None and item['symbol'] in total_symbols
-                        ]
-
-                        holdings_data.extend(parsed_data)
-                        portfolio_data['holdings'] = json.dumps(holdings_data)
+            summary_parsed_data, holdings_data = await asyncio.gather(
+                self.fetch_json(session, summary_url),
+                self.fetch_holdings(session, cik),
+            )
 
+            holdings_data = self.classify_holdings(holdings_data)
             if not holdings_data:
-                self.cursor.execute("DELETE FROM institutes WHERE cik = ?", (cik,))
-                self.conn.commit()
-                return
+                return cik, None, []
 
-            performance_percentages = [item.get("performancePercentage", 0) for item in holdings_data]
+            # Serialize once per CIK instead of once per page
+            portfolio_data = {'holdings': json.dumps(holdings_data)}
 
-            #Filter information out that is not needed (yet)!
-            holdings_data = [{"symbol": item["symbol"], "securityName": item["securityName"], 'weight': item['weight'], 'sharesNumber': item['sharesNumber'], 'changeInSharesNumberPercentage': item['changeInSharesNumberPercentage'], 'putCallShare': item['putCallShare'], "marketValue": item["marketValue"], 'avgPricePaid': item['avgPricePaid']} for item in holdings_data]
+            performance_percentages = [item.get("performancePercentage", 0) for item in holdings_data]
 
             number_of_stocks = len(holdings_data)
             positive_performance_count = sum(1 for percentage in performance_percentages if percentage > 0)
@@ -204,24 +242,44 @@ class InstituteDatabase:
                 }
                 portfolio_data.update(data_dict)
 
-            self.cursor.execute("PRAGMA table_info(institutes)")
-            columns = {column[1]: column[2] for column in self.cursor.fetchall()}
-
-            column_definitions = {
-                key: (self.get_column_type(portfolio_data.get(key, None)), self.remove_null(portfolio_data.get(key, None)))
-                for key in portfolio_data
-            }
-
-            for column, (column_type, value) in column_definitions.items():
-                if column not in columns and column_type:
-                    self.cursor.execute(f"ALTER TABLE institutes ADD COLUMN {column} {column_type}")
-
-                self.cursor.execute(f"UPDATE institutes SET {column} = ? WHERE cik = ?", (value, cik))
-
-            self.conn.commit()
+            return cik, portfolio_data, holdings_data
 
         except Exception as e:
             print(f"Failed to fetch portfolio data for cik {cik}: {str(e)}")
+            return cik, False, []
+
+    def save_portfolio_data(self, cik, portfolio_data, holdings_data):
+        """
+        Write all columns of an institution with a single upsert and
+        refresh its rows in institute_holdings. The caller commits in batches.
+        """
+        if portfolio_data is None:
+            self.cursor.execute("DELETE FROM institutes WHERE cik = ?", (cik,))
+            self.cursor.execute("DELETE FROM institute_holdings WHERE cik = ?", (cik,))
+            return
+
+        if self.columns is None:
+            self.cursor.execute("PRAGMA table_info(institutes)")
+            self.columns = {column[1] for column in self.cursor.fetchall()}
+
+        column_definitions = {
+            key: (self.get_column_type(value), self.remove_null(value))
+            for key, value in portfolio_data.items()
+        }
+
+        for column, (column_type, _) in column_definitions.items():
+            if column not in self.columns and column_type:
+                self.cursor.execute(f"ALTER TABLE institutes ADD COLUMN {column} {column_type}")
+                self.columns.add(column)
+
+        columns = list(column_definitions)
+        assignments = ', '.join(f"{column} = excluded.{column}" for column in columns)
+        self.cursor.execute(
+            f"INSERT INTO institutes (cik, {', '.join(columns)}) VALUES (?, {', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT(cik) DO UPDATE SET {assignments}",
+            (cik, *[value for _, value in column_definitions.values()])
+        )
+        replace_institute_holdings(self.cursor, cik, holdings_data)
 
 
     async def save_insitute(self, institutes):
@@ -252,27 +310,35 @@ class InstituteDatabase:
         self.cursor.execute("COMMIT")  # Commit the transaction
         self.conn.commit()
 
-       
+        # Fetch portfolios concurrently, writes stay on this thread and are committed in batches
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_INSTITUTES)
+
+        async def fetch(session, cik):
+            async with semaphore:
+                return await self.get_portfolio_data(session, cik)
+
+        start_time = time.time()
+        total_holdings = 0
+        pending_writes = 0
 
-        # Save OHLC data for each ticker using aiohttp
-        
         async with aiohttp.ClientSession() as session:
-            tasks = []
-            i = 0
-            for item in tqdm(institute_data):
-                cik, name = item
-                tasks.append(self.save_portfolio_data(session, cik))
-
-                i += 1
-                if i % 300 == 0:
-                    await asyncio.gather(*tasks)
-                    tasks = []
-                    print('sleeping mode: ', i)
-                    await asyncio.sleep(60)  # Pause for 60 seconds
-
-            
-            if tasks:
-                await asyncio.gather(*tasks)
+            tasks = [fetch(session, cik) for cik, _ in institute_data]
+            for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+                cik, portfolio_data, holdings_data = await task
+                if portfolio_data is False:
+                    continue
+                self.save_portfolio_data(cik, portfolio_data, holdings_data)
+                total_holdings += len(holdings_data)
+                pending_writes += 1
+                if pending_writes >= COMMIT_BATCH_SIZE:
+                    self.conn.commit()
+                    pending_writes = 0
+
+        self.conn.commit()
+
+        elapsed = time.time() - start_time
+        print(f"Saved {len(institute_data)} institutes with {total_holdings} holdings in {elapsed:.2f}s "
+              f"({len(institute_data) / elapsed if elapsed > 0 else 0:.1f} institutes/s, {total_holdings / elapsed if elapsed > 0 else 0:.1f} holdings/s)")
 
         
 url = f"https://financialmodelingprep.com/api/v4/institutional-ownership/list?apikey={api_key}"
@@ -9,7 +9,8 @@ import os
 from dotenv import load_dotenv
 from tqdm import tqdm 
 import pandas as pd
-from collections import Counter
+from collections import Counter, defaultdict
+from functools import lru_cache
 import aiohttp
 import asyncio
 import statistics
@@ -34,7 +35,10 @@ buy_ratings = ['Outperform', 'Overweight', 'Market Outperform', 'Buy', 'Positive
 
 sell_ratings = ['Negative', 'Underperform', 'Underweight', 'Reduce', 'Sell']
 
-ticker_price_cache = {} # Dictionary to store cached price data for tickers
+buy_ratings_set = set(buy_ratings)
+sell_ratings_set = set(sell_ratings)
+
+PRICE_CACHE_SIZE = 2000 # Number of tickers whose close prices are kept in memory
 
 # Define a function to remove duplicates based on a key
 def remove_duplicates(data, key):
@@ -367,6 +371,88 @@ async def get_all_analyst_stats():
 
     return final_list
 
+@lru_cache(maxsize=PRICE_CACHE_SIZE)
+def get_price_series(con, ticker, start_date, end_date):
+    """
+    Date-sorted close prices of a ticker for as-of lookups, plus the close of the last row.
+    Returns None if there is no price data for the ticker.
+    """
+    try:
+        query = query_template.format(ticker=ticker)
+        df = pd.read_sql_query(query, con, params=(start_date, end_date))
+    except:
+        return None
+    if df.empty:
+        return None
+
+    dates = df['date'].to_numpy(dtype=str)
+    closes = df['close'].to_numpy(dtype=np.float64)
+    # Duplicate dates resolve to their first row, like the masked lookups did
+    price_dates, first_index = np.unique(dates, return_index=True)
+    return price_dates, closes[first_index], closes[-1]
+
+
+def score_ratings(data, con, start_date, end_date):
+    """
+    Evaluate all buy/sell ratings of an analyst at once.
+    Entry price is the close on the rating date or up to 4 days before it,
+    exit price the close exactly 12 months later or else the latest close.
+    Returns (avgReturn, successRate).
+    """
+    ratings = [stock for stock in data if stock.get('rating_current') in buy_ratings_set or stock.get('rating_current') in sell_ratings_set]
+    if not ratings:
+        return 0, 0
+
+    rating_dates = np.array([str(stock.get('date')) for stock in ratings])
+    is_buy = np.array([stock['rating_current'] in buy_ratings_set for stock in ratings])
+
+    parsed_dates = pd.to_datetime(pd.Series(rating_dates), errors='coerce')
+    lower_dates = (parsed_dates - pd.Timedelta(days=4)).dt.strftime('%Y-%m-%d').fillna('').to_numpy(dtype=str)
+    future_dates = (parsed_dates + pd.DateOffset(months=12)).dt.strftime('%Y-%m-%d').fillna('').to_numpy(dtype=str)
+    parsed = parsed_dates.notna().to_numpy()
+
+    entry_price = np.full(len(ratings), np.nan)
+    future_price = np.full(len(ratings), np.nan)
+    valid = np.zeros(len(ratings), dtype=bool)
+
+    ticker_index = defaultdict(list)
+    for i, stock in enumerate(ratings):
+        ticker_index[stock.get('ticker')].append(i)
+
+    for ticker, index in ticker_index.items():
+        series = get_price_series(con, ticker, start_date, end_date)
+        if series is None:
+            continue
+        price_dates, closes, last_close = series
+        index = np.asarray(index)
+
+        # As-of lookup: latest trading day on or before the rating date, at most 4 days back
+        pos = np.searchsorted(price_dates, rating_dates[index], side='right') - 1
+        found = pos >= 0
+        pos = np.clip(pos, 0, None)
+        found &= parsed[index] & (price_dates[pos] >= lower_dates[index])
+
+        future_pos = np.clip(np.searchsorted(price_dates, future_dates[index]), 0, len(price_dates) - 1)
+        exact_future = price_dates[future_pos] == future_dates[index]
+
+        entry_price[index] = closes[pos]
+        future_price[index] = np.where(exact_future, closes[future_pos], last_close)
+        valid[index] = found
+
+    valid_ratings_count = int(valid.sum())
+    if valid_ratings_count == 0:
+        return 0, 0
+
+    stock_return = (future_price[valid] - entry_price[valid]) / entry_price[valid]
+    success = np.where(is_buy[valid], future_price[valid] > entry_price[valid], future_price[valid] < entry_price[valid])
+
+    # Sum in rating order so the result is identical to the previous running total
+    total_return = sum(stock_return.tolist())
+    avg_return = round(total_return / valid_ratings_count * 100, 2)  # Percentage format
+    success_rate = round((int(success.sum()) / valid_ratings_count) * 100, 2)  # Success rate in percentage
+    return avg_return, success_rate
+
+
 async def process_analyst(item, con, session, start_date, end_date):
     # Fetch analyst ratings
     data = await get_analyst_ratings(item['analystId'], session)
@@ -375,85 +461,7 @@ async def process_analyst(item, con, session, start_date, end_date):
     item['lastRating'] = data[0]['date'] if data else None
     item['numOfStocks'] = len({d['ticker'] for d in data})
 
-    total_return = 0
-    valid_ratings_count = 0
-    success_count = 0  # To track successful ratings for success rate calculation
-
-    for stock in data:
-        try:
-            ticker = stock['ticker']
-            rating_date = stock['date']
-            rating_current = stock['rating_current']
-
-            # Skip neutral or undefined ratings
-            if rating_current not in buy_ratings and rating_current not in sell_ratings:
-                continue
-
-            # Check if the ticker data is already cached
-            if ticker not in ticker_price_cache:
-                # If not cached, query the stock data and cache it
-                query = query_template.format(ticker=ticker)
-                df = pd.read_sql_query(query, con, params=(start_date, end_date))
-                ticker_price_cache[ticker] = df
-            else:
-                # Use cached data
-                df = ticker_price_cache[ticker]
-
-            # Ensure we have data for the rating date
-            rating_date_data = df[df['date'] == rating_date]
-            if rating_date_data.empty:
-                # Try finding the closest date within a few days if exact date is missing
-                for days_offset in range(1, 5):
-                    closest_date = (pd.to_datetime(rating_date) - pd.Timedelta(days=days_offset)).strftime('%Y-%m-%d')
-                    rating_date_data = df[df['date'] == closest_date]
-                    if not rating_date_data.empty:
-                        break
-
-            if rating_date_data.empty:
-                continue  # Skip if no close price data found
-
-            # Get close price on rating date
-            close_price_on_rating = rating_date_data['close'].values[0]
-
-            # Calculate the date 12 months later
-            future_date = (pd.to_datetime(rating_date) + pd.DateOffset(months=12)).strftime('%Y-%m-%d')
-
-            # Try to find the close price 12 months later
-            future_date_data = df[df['date'] == future_date]
-            if future_date_data.empty:
-                # If 12 months price isn't available, use the latest available price
-                future_date_data = df.iloc[-1]  # Use the last available price
-                if future_date_data.empty:
-                    continue  # If no future data, skip this rating
-
-            close_price_in_future = future_date_data['close'] if isinstance(future_date_data, pd.Series) else future_date_data['close'].values[0]
-
-            # Calculate return
-            stock_return = (close_price_in_future - close_price_on_rating) / close_price_on_rating
-            total_return += stock_return
-            valid_ratings_count += 1
-
-            # Determine if the rating was successful
-            if rating_current in buy_ratings:
-                if close_price_in_future > close_price_on_rating:
-                    success_count += 1  # Success for buy ratings
-            elif rating_current in sell_ratings:
-                if close_price_in_future < close_price_on_rating:
-                    success_count += 1  # Success for sell ratings
-        except:
-            pass
-
-    # Calculate average return if there are valid ratings
-    if valid_ratings_count > 0:
-        item['avgReturn'] = round(total_return / valid_ratings_count * 100, 2)  # Percentage format
-    else:
-        item['avgReturn'] = 0
-
-    # Calculate success rate
-    if valid_ratings_count > 0:
-        item['successRate'] = round((success_count / valid_ratings_count) * 100, 2)  # Success rate in percentage
-    else:
-        item['successRate'] = 0
+    item['avgReturn'], item['successRate'] = score_ratings(data, con, start_date, end_date)
 
     # Populate other stats and score
     stats_dict = {
@@ -6,6 +6,8 @@ import numpy as np
 import pandas as pd
 from scipy.stats import norm
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import sqlite3
 import ujson
 import math
@@ -199,75 +201,138 @@ def get_summary(res_list):
     res = {**stats, **categorical_ratings}
     return res
 
-def run(chunk, analyst_list, con):
+def always(item):
+    return True
+
+# Rating normalization rules in priority order: (rating_current or None for any, condition, new rating, new action_company).
+# A new rating of None keeps the rating as it is and stops the lookup.
+RATING_RULES = [
+    ('Strong Sell', always, None, None),
+    ('Strong Buy', always, None, None),
+    ('Accumulate', lambda item: item['rating_prior'] == 'Buy', 'Buy', None),
+    ('Neutral', always, 'Hold', None),
+    ('Equal-Weight', always, 'Hold', None),
+    ('Sector Weight', always, 'Hold', None),
+    ('Sector Perform', always, 'Hold', None),
+    ('In-Line', always, 'Hold', None),
+    ('Outperform', lambda item: item['action_company'] == 'Downgrades', 'Hold', None),
+    ('Negative', always, 'Sell', None),
+    ('Outperform', lambda item: item['action_company'] in ('Reiterates', 'Initiates Coverage On'), 'Buy', 'Initiates'),
+    ('Overweight', lambda item: item['action_company'] in ('Reiterates', 'Initiates Coverage On'), 'Buy', 'Initiates'),
+    ('Market Outperform', lambda item: item['action_company'] in ('Maintains', 'Reiterates'), 'Buy', None),
+    ('Outperform', lambda item: item['action_company'] == 'Maintains' or item['action_pt'] == 'Announces' or item['action_company'] == 'Upgrades', 'Buy', None),
+    ('Buy', lambda item: item['action_company'] == 'Raises' or item['action_pt'] == 'Raises', 'Strong Buy', None),
+    ('Buy', lambda item: item.get("rating_prior",None) == "Buy" and float(item.get("adjusted_pt_prior", 0)) < float(item.get('adjusted_pt_current', 0)), 'Strong Buy', None),
+    ('Overweight', lambda item: item['action_company'] in ('Maintains', 'Upgrades', 'Reiterates') or item['action_pt'] == 'Raises', 'Buy', None),
+    ('Positive', always, 'Buy', None),
+    ('Sector Outperform', always, 'Buy', None),
+    ('Underperform', always, 'Sell', None),
+    ('Underweight', always, 'Sell', None),
+    ('Reduce', lambda item: item['action_company'] == 'Downgrades' or item['action_pt'] == 'Lowers', 'Sell', None),
+    ('Sell', lambda item: item['action_pt'] == 'Announces', 'Strong Sell', None),
+    ('Market Perform', always, 'Hold', None),
+    (None, lambda item: item['rating_prior'] == 'Outperform' and item['action_company'] == 'Downgrades', 'Hold', None),
+    ('Peer Perform', lambda item: item['rating_prior'] == 'Peer Perform', 'Hold', None),
+    ('Peer Perform', lambda item: item['action_pt'] == 'Announces', 'Hold', 'Initiates'),
+]
+
+# Compiled lookup: rating_current -> only the rules that can match it, still in priority order
+RATING_RULE_TABLE = {
+    rating: tuple(rule[1:] for rule in RATING_RULES if rule[0] in (rating, None))
+    for rating in {rule[0] for rule in RATING_RULES if rule[0]}
+}
+DEFAULT_RATING_RULES = tuple(rule[1:] for rule in RATING_RULES if rule[0] is None)
+
+
+def normalize_rating(item):
+    try:
+        for condition, rating, action in RATING_RULE_TABLE.get(item['rating_current'], DEFAULT_RATING_RULES):
+            if condition(item):
+                if rating:
+                    item['rating_current'] = rating
+                if action:
+                    item['action_company'] = action
+                return
+    except:
+        pass
+
+
+def build_analyst_index(analyst_list):
+    """
+    Hash indexes for joining ratings with analysts: (company, name) -> analyst
+    and a name-only fallback that keeps the first analyst of the list.
+    """
+    by_company_and_name = {}
+    by_name = {}
+    for analyst in analyst_list:
+        by_company_and_name.setdefault((analyst['companyName'], analyst['analystName']), analyst)
+        by_name.setdefault(analyst['analystName'], analyst)
+    return by_company_and_name, by_name
+
+
+class RateLimiter:
+    def __init__(self, rate_limit=500, sleep_time=60):
+        self.rate_limit = rate_limit
+        self.sleep_time = sleep_time
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.request_count += 1
+            if self.request_count >= self.rate_limit:
+                print(f"Processed {self.rate_limit} requests. Sleeping for {self.sleep_time} seconds...")
+                time.sleep(self.sleep_time)
+                self.request_count = 0
+
+
+def get_ratings_page(company_tickers, page, start_date_str, end_date_str):
+    rate_limiter.acquire()
+    try:
+        data = fin.ratings(company_tickers=company_tickers, page=page, pagesize=1000, date_from=start_date_str, date_to=end_date_str)
+        return ujson.loads(fin.output(data))['ratings']
+    except:
+        return None
+
+
+def get_ratings(chunk):
+    """
+    Fetch all rating pages of a chunk, PAGES_PER_WAVE pages at a time,
+    until the first page that is empty or fails.
+    """
     start_date = datetime(2015, 1, 1)
     end_date_str = end_date.strftime('%Y-%m-%d')
     start_date_str = start_date.strftime('%Y-%m-%d')
 
     company_tickers = ','.join(chunk)
     res_list = []
-    
-    for page in range(0, 500):
-        try:
-            data = fin.ratings(company_tickers=company_tickers, page=page, pagesize=1000, date_from=start_date_str, date_to=end_date_str)
-            data = ujson.loads(fin.output(data))['ratings']
+
+    for first_page in range(0, 500, PAGES_PER_WAVE):
+        pages = range(first_page, min(first_page + PAGES_PER_WAVE, 500))
+        results = list(page_executor.map(lambda page: get_ratings_page(company_tickers, page, start_date_str, end_date_str), pages))
+        for data in results:
+            if not data:
+                return res_list
             res_list += data
-        except:
-            break
 
-    res_list = [item for item in res_list if item.get('analyst_name')]
+    return res_list
+
+
+def run(chunk, res_list, analyst_index, con):
+    by_company_and_name, by_name = analyst_index
+
+    # Group the ratings by ticker in one pass
+    ratings_by_ticker = defaultdict(list)
+    for item in res_list:
+        if item.get('analyst_name'):
+            ratings_by_ticker[item.get('ticker')].append(item)
+
     for ticker in chunk:
         try:
-            ticker_filtered_data = [item for item in res_list if item['ticker'] == ticker]
+            ticker_filtered_data = ratings_by_ticker.get(ticker, [])
             if len(ticker_filtered_data) != 0:
                 for item in ticker_filtered_data:
-                    try:
-                        if item['rating_current'] == 'Strong Sell' or item['rating_current'] == 'Strong Buy':
-                            pass
-                        elif item['rating_current'] == 'Accumulate' and item['rating_prior'] == 'Buy':
-                            item['rating_current'] = 'Buy'
-                        elif item['rating_current'] == 'Neutral':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_current'] == 'Equal-Weight' or item['rating_current'] == 'Sector Weight' or item['rating_current'] == 'Sector Perform':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_current'] == 'In-Line':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_current'] == 'Outperform' and item['action_company'] == 'Downgrades':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_current'] == 'Negative':
-                            item['rating_current'] = 'Sell'
-                        elif (item['rating_current'] == 'Outperform' or item['rating_current'] == 'Overweight') and (item['action_company'] == 'Reiterates' or item['action_company'] == 'Initiates Coverage On'):
-                            item['rating_current'] = 'Buy'
-                            item['action_company'] = 'Initiates'
-                        elif item['rating_current'] == 'Market Outperform' and (item['action_company'] == 'Maintains' or item['action_company'] == 'Reiterates'):
-                            item['rating_current'] = 'Buy'
-                        elif item['rating_current'] == 'Outperform' and (item['action_company'] == 'Maintains' or item['action_pt'] == 'Announces' or item['action_company'] == 'Upgrades'):
-                            item['rating_current'] = 'Buy'
-                        elif item['rating_current'] == 'Buy' and (item['action_company'] == 'Raises' or item['action_pt'] == 'Raises'):
-                            item['rating_current'] = 'Strong Buy'
-                        elif item.get("rating_prior",None) == "Buy" and item.get("rating_current",None) == "Buy" and (float(item.get("adjusted_pt_prior", 0)) < float(item.get('adjusted_pt_current', 0))):
-                            item["rating_current"] = "Strong Buy"
-                        elif item['rating_current'] == 'Overweight' and (item['action_company'] == 'Maintains' or item['action_company'] == 'Upgrades' or item['action_company'] == 'Reiterates' or item['action_pt'] == 'Raises'):
-                            item['rating_current'] = 'Buy'
-                        elif item['rating_current'] == 'Positive' or item['rating_current'] == 'Sector Outperform':
-                            item['rating_current'] = 'Buy'
-                        elif item['rating_current'] == 'Underperform' or item['rating_current'] == 'Underweight':
-                            item['rating_current'] = 'Sell'
-                        elif item['rating_current'] == 'Reduce' and (item['action_company'] == 'Downgrades' or item['action_pt'] == 'Lowers'):
-                            item['rating_current'] = 'Sell'
-                        elif item['rating_current'] == 'Sell' and item['action_pt'] == 'Announces':
-                            item['rating_current'] = 'Strong Sell'
-                        elif item['rating_current'] == 'Market Perform':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_prior'] == 'Outperform' and item['action_company'] == 'Downgrades':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_current'] == 'Peer Perform' and item['rating_prior'] == 'Peer Perform':
-                            item['rating_current'] = 'Hold'
-                        elif item['rating_current'] == 'Peer Perform' and item['action_pt'] == 'Announces':
-                            item['rating_current'] = 'Hold'
-                            item['action_company'] = 'Initiates'
-                    except:
-                        pass
+                    normalize_rating(item)
 
                 summary = get_summary(ticker_filtered_data)
                 
@@ -287,16 +352,11 @@ def run(chunk, analyst_list, con):
                 with open(f"json/analyst/summary/{ticker}.json", 'w') as file:
                     ujson.dump(summary, file)
 
-                for item1 in ticker_filtered_data:
-                    for item2 in analyst_stats_list:
-                        if item1['analyst'] == item2['companyName'] and item1['analyst_name'] == item2['analystName']:
-                            item1['analystId'] = item2['analystId']
-                            item1['analystScore'] = item2['analystScore']
-                            break
-                        elif item1['analyst_name'] == item2['analystName']:
-                            item1['analystId'] = item2['analystId']
-                            item1['analystScore'] = item2['analystScore']
-                            break
+                for item in ticker_filtered_data:
+                    analyst = by_company_and_name.get((item.get('analyst'), item['analyst_name'])) or by_name.get(item['analyst_name'])
+                    if analyst:
+                        item['analystId'] = analyst['analystId']
+                        item['analystScore'] = analyst['analystScore']
 
                 desired_keys = ['date', 'action_company', 'rating_current', 'adjusted_pt_current', 'adjusted_pt_prior', 'analystId', 'analystScore', 'analyst', 'analyst_name']
 
@@ -311,6 +371,11 @@ def run(chunk, analyst_list, con):
             print(e)
 
 
+MAX_CHUNK_WORKERS = 4
+PAGES_PER_WAVE = 4
+
+rate_limiter = RateLimiter(rate_limit=500, sleep_time=60)
+page_executor = ThreadPoolExecutor(max_workers=MAX_CHUNK_WORKERS * PAGES_PER_WAVE)
 
 try:
     con = sqlite3.connect('stocks.db')
@@ -323,14 +388,21 @@ try:
     with open(f"json/analyst/all-analyst-data.json", 'r') as file:
     	analyst_stats_list = ujson.load(file)
 
+    analyst_index = build_analyst_index(analyst_stats_list)
+
     chunk_size = len(stock_symbols) // 300  # Divide the list into N chunks
     chunks = [stock_symbols[i:i + chunk_size] for i in range(0, len(stock_symbols), chunk_size)]
     #chunks = [['NVDA']]
-    for chunk in chunks:
-        run(chunk, analyst_stats_list, con)
+
+    # Chunks are fetched concurrently and written from this thread as soon as their ratings arrive
+    with ThreadPoolExecutor(max_workers=MAX_CHUNK_WORKERS) as chunk_executor:
+        futures = {chunk_executor.submit(get_ratings, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            run(futures[future], future.result(), analyst_index, con)
 
 except Exception as e:
     print(e)
 
 finally:
-	con.close()
\ No newline at end of file
+	con.close()
+	page_executor.shutdown()
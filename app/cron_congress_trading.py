@@ -12,14 +12,31 @@ from dotenv import load_dotenv
 import os
 
 
-with open(f"json/stock-screener/data.json", 'rb') as file:
-    stock_screener_data = orjson.loads(file.read())
-stock_screener_data_dict = {item['symbol']: item for item in stock_screener_data}
-
-
 load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 
+POLITICIAN_DIR = "json/congress-trading/politician-db"
+# Content hash and search entry of every politician file written so far
+POLITICIAN_CACHE_PATH = "json/congress-trading/cache/politicians.json"
+
+
+def load_stock_screener_data():
+    with open(f"json/stock-screener/data.json", 'rb') as file:
+        stock_screener_data = orjson.loads(file.read())
+    return {item['symbol']: item for item in stock_screener_data}
+
+def load_politician_cache():
+    try:
+        with open(POLITICIAN_CACHE_PATH, 'rb') as file:
+            return orjson.loads(file.read())
+    except:
+        return {}
+
+def save_politician_cache(cache):
+    os.makedirs(os.path.dirname(POLITICIAN_CACHE_PATH), exist_ok=True)
+    with open(POLITICIAN_CACHE_PATH, 'wb') as file:
+        file.write(orjson.dumps(cache))
+
 
 async def save_json_data(symbol, data):
     async with aiofiles.open(f"json/congress-trading/company/{symbol}.json", 'w') as file:
@@ -210,43 +227,31 @@ async def get_endpoints(symbol, session):
     return res_list
 
 
-def create_politician_db(data, stock_symbols, stock_raw_data, etf_symbols, etf_raw_data, crypto_symbols, crypto_raw_data):
+def build_symbol_index(stock_raw_data, etf_raw_data, crypto_raw_data):
+    # symbol -> (name, assetType), stocks win over etfs over cryptos
+    symbol_index = {}
+    for raw_data, asset_type in ((stock_raw_data, 'stock'), (etf_raw_data, 'etf'), (crypto_raw_data, 'crypto')):
+        for j in raw_data:
+            symbol_index.setdefault(j['symbol'], (j['name'], asset_type))
+    return symbol_index
+
+
+def create_politician_db(data, symbol_index, stock_screener_data_dict):
+    """Group the trades by politician -> {id: politician file content}."""
     grouped_data = defaultdict(list)
     # Group elements by id
     for item in data:
         #Bug: Data provider does offer not always ticker but in edge cases symbol (Suck my ass FMP!)
-        if ('ticker' in item and item['ticker'] in stock_symbols) or ('symbol' in item and item['symbol'] in stock_symbols):
-            for j in stock_raw_data:
-                if (item.get('ticker') or (item.get('symbol'))) == j['symbol']:
-                    item['ticker'] = j['symbol']
-                    item['name'] = j['name']
-                    item['assetType'] = 'stock'
-                    break
-        elif ('ticker' in item and item['ticker'] in etf_symbols) or ('symbol' in item and item['symbol'] in etf_symbols):
-            for j in etf_raw_data:
-                if (item.get('ticker') or (item.get('symbol'))) == j['symbol']:
-                    item['ticker'] = j['symbol']
-                    item['name'] = j['name']
-                    item['assetType'] = 'etf'
-                    break
-        elif ('ticker' in item and item['ticker'] in crypto_symbols) or ('symbol' in item and item['symbol'] in crypto_symbols):
-            for j in crypto_raw_data:
-                if (item.get('ticker') or (item.get('symbol'))) == j['symbol']:
-                    item['ticker'] = j['symbol']
-                    item['name'] = j['name']
-                    item['assetType'] = 'crypto'
-                    break
+        symbol = item.get('ticker') or item.get('symbol')
+        if symbol in symbol_index:
+            item['ticker'] = symbol
+            item['name'], item['assetType'] = symbol_index[symbol]
 
         grouped_data[item['id']].append(item)
 
-    # Convert defaultdict to list
-    grouped_data_list = list(grouped_data.values())
-
-    #keys_to_keep = {'dateRecieved', 'id', 'transactionDate', 'representative', 'assetType', 'type', 'disclosureDate', 'symbol', 'name', 'amount'}
-
-    for item in tqdm(grouped_data_list):
+    politicians = {}
+    for politician_id, item in grouped_data.items():
         try:
-            #item = [{key: entry[key] for key in entry if key in keys_to_keep} for entry in item]
             # Sort items by 'transactionDate'
             item = sorted(item, key=lambda x: x['transactionDate'], reverse=True)
 
@@ -254,84 +259,79 @@ def create_politician_db(data, stock_symbols, stock_raw_data, etf_symbols, etf_r
             sector_list = []
             industry_list = []
             for item2 in item:
-                try:
-                    # Try to get 'symbol' first; if it doesn't exist, use 'ticker'
-                    symbol = item2.get('symbol') or item2.get('ticker')
-                    if not symbol:
-                        continue  # Skip if neither 'symbol' nor 'ticker' is present
-
-                    ticker_data = stock_screener_data_dict.get(symbol, {})
-
-                    # Extract specified columns data for each ticker
-                    sector = ticker_data.get('sector', None)
-                    industry = ticker_data.get('industry', None)
-                except:
-                    sector = None
-                    industry = None
-
+                # Try to get 'symbol' first; if it doesn't exist, use 'ticker'
+                symbol = item2.get('symbol') or item2.get('ticker')
+                if not symbol:
+                    continue  # Skip if neither 'symbol' nor 'ticker' is present
+
+                ticker_data = stock_screener_data_dict.get(symbol, {})
+                sector = ticker_data.get('sector', None)
+                industry = ticker_data.get('industry', None)
                 if sector:
                     sector_list.append(sector)
                 if industry:
                     industry_list.append(industry)
 
-
             # Get the top 3 most common sectors and industries
             sector_counts = Counter(sector_list)
             industry_counts = Counter(industry_list)
             main_sectors = [item2[0] for item2 in sector_counts.most_common(3)]
             main_industries = [item2[0] for item2 in industry_counts.most_common(3)]
 
- 
-            # Prepare the data to save in the file
-            result = {
+            politicians[politician_id] = {
                 'mainSectors': main_sectors,
                 'mainIndustries': main_industries,
                 'history': item
             }
-
-            # Save to JSON file
-            if result:
-                with open(f"json/congress-trading/politician-db/{item[0]['id']}.json", 'w') as file:
-                    file.write(orjson.dumps(result).decode("utf-8"))
         except Exception as e:
             print(e)
 
+    return politicians
 
-def create_search_list():
-    folder_path = 'json/congress-trading/politician-db/'
-    # Initialize the list that will hold the search data
-    search_politician_list = []
 
-    # Loop through all files in the folder
-    for filename in os.listdir(folder_path):
-        # Check if the file is a JSON file
-        if filename.endswith('.json'):
-            file_path = os.path.join(folder_path, filename)
-            # Open and read the JSON file
-            with open(file_path, 'rb') as file:
-                data = orjson.loads(file.read())
+def search_entry(history):
+    # Entry of the search list, None for senators (only non-senators are listed)
+    first_item = history[0]
+    if 'Senator' in first_item['representative']:
+        return None
+    return {
+        'representative': first_item['representative'],
+        'id': first_item['id'],
+        'totalTrades': len(history),
+        'district': first_item.get('district', ''),
+        'lastTrade': first_item['transactionDate'],
+    }
 
 
-                # Access the history, which is a list of transactions
-                history = data.get('history', [])
-                if not history:
-                    continue  # Skip if there is no history
-                
-                # Get the first item in the history list
-                first_item = history[0]
-
-                # Filter out senators (assuming you only want to process non-senators)
-                if 'Senator' in first_item['representative']:
-                    continue
-
-                # Create the politician search entry
-                search_politician_list.append({
-                    'representative': first_item['representative'],
-                    'id': first_item['id'],
-                    'totalTrades': len(history),
-                    'district': first_item.get('district', ''),
-                    'lastTrade': first_item['transactionDate'],
-                })
+def save_politician_db(politicians, cache):
+    """
+    Write the politician files whose content hash changed (or whose file is
+    missing) and refresh their cache entries. Returns the number of files written.
+    """
+    os.makedirs(POLITICIAN_DIR, exist_ok=True)
+    written = 0
+    for politician_id, result in tqdm(politicians.items()):
+        try:
+            content = orjson.dumps(result)
+            digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+            path = f"{POLITICIAN_DIR}/{politician_id}.json"
+            if cache.get(politician_id, {}).get('hash') == digest and os.path.exists(path):
+                continue
+            with open(path, 'wb') as file:
+                file.write(content)
+            cache[politician_id] = {
+                'hash': digest,
+                'search': search_entry(result['history']) if result['history'] else None,
+            }
+            written += 1
+        except Exception as e:
+            print(e)
+    return written
+
+
+def create_search_list(cache):
+    # Built from the cached entries instead of re-reading every politician file
+    search_politician_list = [entry['search'] for entry in cache.values() if entry.get('search')]
 
     # Sort the list by the 'lastTrade' date in descending order
     search_politician_list = sorted(search_politician_list, key=lambda x: x['lastTrade'], reverse=True)
@@ -354,8 +354,6 @@ async def run():
             'sector': row[2],
         } for row in stock_raw_data]
 
-        stock_symbols = [item['symbol'] for item in stock_raw_data]
-
         con.close()
 
 
@@ -369,7 +367,6 @@ async def run():
             'symbol': row[0],
             'name': row[1],
         } for row in etf_raw_data]
-        etf_symbols = [item['symbol'] for item in etf_raw_data]
         etf_con.close()
 
         crypto_con = sqlite3.connect('crypto.db')
@@ -381,10 +378,11 @@ async def run():
             'symbol': row[0],
             'name': row[1],
         } for row in crypto_raw_data]
-        crypto_symbols = [item['symbol'] for item in crypto_raw_data]
         crypto_con.close()
 
-        total_symbols = crypto_symbols +etf_symbols + stock_symbols
+        total_symbols = [item['symbol'] for item in crypto_raw_data + etf_raw_data + stock_raw_data]
+        symbol_index = build_symbol_index(stock_raw_data, etf_raw_data, crypto_raw_data)
+        stock_screener_data_dict = load_stock_screener_data()
         chunk_size = 100
         politician_list = []
 
@@ -408,13 +406,18 @@ async def run():
                     pass
         
         
-        create_politician_db(politician_list, stock_symbols, stock_raw_data, etf_symbols, etf_raw_data, crypto_symbols, crypto_raw_data)
-        create_search_list()
+        politicians = create_politician_db(politician_list, symbol_index, stock_screener_data_dict)
+        cache = load_politician_cache()
+        written = save_politician_db(politicians, cache)
+        save_politician_cache(cache)
+        print(f"Updated {written} of {len(politicians)} politicians")
+        create_search_list(cache)
 
     except Exception as e:
         print(f"Failed to run fetch and save data: {e}")
 
-try:
-    asyncio.run(run())
-except Exception as e:
-    print(e)
+if __name__ == "__main__":
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        print(e)
@@ -1,10 +1,11 @@
 import ujson
 import asyncio
-import aiohttp
+import pandas as pd
 import sqlite3
 from tqdm import tqdm
 from datetime import datetime,timedelta
 import os
+import requests
 from dotenv import load_dotenv
 from concurrent.futures import ThreadPoolExecutor
 from finra_api_queries import finra_api_queries
@@ -20,59 +21,140 @@ end_date = datetime.today()
 start_date = start_date.strftime("%Y-%m-%d")
 end_date = end_date.strftime("%Y-%m-%d")
 
-dataset_name = "regsho_daily_shorts_volume"
+# retrieve_dataset returns a single page of at most rows_returned rows, a whole trade
+# date is tens of thousands of symbol x facility rows, so the dataset is paged here
+DATASET_URL = "https://api.finra.org/data/group/otcMarket/name/regShoDaily"
+# Largest page FINRA serves for a synchronous request
+PAGE_SIZE = 5000
 filtered_columns_input = ['tradeReportDate', 'securitiesInformationProcessorSymbolIdentifier', 'shortParQuantity', 'shortExemptParQuantity', 'totalParQuantity']
-date_filter_inputs = [{'startDate': start_date, 'endDate': end_date, 'fieldName': 'tradeReportDate'}]
 
-
-
-
-async def get_data(ticker):
-    try:
-        filters_input = {'securitiesInformationProcessorSymbolIdentifier': [ticker]}
-
-        df = finra_api_queries.retrieve_dataset(
-            dataset_name,
-            api_token,
-            filtered_columns=filtered_columns_input,
-            filters = filters_input,
-            date_filter=date_filter_inputs)
-
-        df = df.rename(columns={"tradeReportDate": "date","totalParQuantity": "totalVolume", "shortParQuantity": "shortVolume", "securitiesInformationProcessorSymbolIdentifier": "symbol", "shortExemptParQuantity": "shortExemptVolume"})
-        summed_df = df.drop('symbol', axis=1).groupby('date').sum().reset_index()
-        data = summed_df.to_dict('records')
-
-        # Iterate through the list and calculate the percentages
-        for record in data:
-            total_volume = record["totalVolume"]
-            short_volume = record["shortVolume"]
-            short_exempt_volume = record["shortExemptVolume"]
-            
-            # Calculate percentages
-            short_percent = round((short_volume / total_volume) * 100,2)
-            short_exempt_percent = round((short_exempt_volume / total_volume) * 100,2)
-            
-            # Add new elements to the dictionary
-            record["shortPercent"] = short_percent
-            record["shortExemptPercent"] = short_exempt_percent
-
-        return data
-
-    except Exception as e:
-        print(f"Error fetching data for {ticker}: {e}")
+# One file per trade date with the volumes of every symbol, summed over the reporting facilities
+CACHE_DIR = "json/dark-pool/finra-daily"
+# retrieve_dataset is blocking, at most this many dates are fetched at the same time
+MAX_WORKERS = 4
+# FINRA publishes a day's file in the evening, empty recent dates are retried next run
+SETTLE_DAYS = 3
+
+
+def get_trade_dates():
+    # Weekdays of the window, holidays come back empty and get cached as such
+    dates = []
+    current = datetime.strptime(start_date, "%Y-%m-%d")
+    while current.strftime("%Y-%m-%d") <= end_date:
+        if current.weekday() < 5:
+            dates.append(current.strftime("%Y-%m-%d"))
+        current += timedelta(days=1)
+    return dates
+
+def fetch_page(date, offset):
+    response = requests.post(
+        DATASET_URL,
+        headers={'Authorization': 'Bearer ' + api_token, 'Accept': 'application/json'},
+        json={
+            'fields': filtered_columns_input,
+            'limit': PAGE_SIZE,
+            'offset': offset,
+            'dateRangeFilters': [{'startDate': date, 'endDate': date, 'fieldName': 'tradeReportDate'}],
+        },
+        timeout=60)
+    if response.status_code == 204 or not response.content:
         return []
-
-async def save_json(symbol, data):
-    # Use async file writing to avoid blocking the event loop
-    loop = asyncio.get_event_loop()
+    if response.status_code != 200:
+        raise Exception(f"FINRA returned {response.status_code} at offset {offset}")
+    return response.json()
+
+def fetch_date(date):
+    """Short volumes of the whole universe for one trade date as {symbol: [short, shortExempt, total]}."""
+    rows = []
+    while True:
+        page = fetch_page(date, len(rows))
+        rows += page
+        # A short page is the last one, an error raises so a partial day is never cached
+        if len(page) < PAGE_SIZE:
+            break
+
+    res = {}
+    if not rows:
+        return res
+    df = pd.DataFrame(rows)
+    volume_columns = ['shortParQuantity', 'shortExemptParQuantity', 'totalParQuantity']
+    df[volume_columns] = df[volume_columns].apply(pd.to_numeric, errors='coerce').fillna(0)
+    summed_df = df.groupby('securitiesInformationProcessorSymbolIdentifier')[volume_columns].sum()
+    for symbol, row in zip(summed_df.index, summed_df.itertuples(index=False)):
+        res[symbol] = [int(value) for value in row]
+    return res
+
+def load_cached_dates():
+    try:
+        return {name[:-5] for name in os.listdir(CACHE_DIR) if name.endswith('.json')}
+    except FileNotFoundError:
+        return set()
+
+def save_cache(date, data):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = f"{CACHE_DIR}/{date}.json"
+    with open(f"{path}.tmp", 'w') as file:
+        ujson.dump(data, file)
+    os.replace(f"{path}.tmp", path)
+
+def load_cache(date):
+    with open(f"{CACHE_DIR}/{date}.json", 'r') as file:
+        return ujson.load(file)
+
+def prune_cache(dates):
+    # Drop dates that fell out of the window
+    keep = set(dates)
+    for date in load_cached_dates() - keep:
+        os.remove(f"{CACHE_DIR}/{date}.json")
+
+async def update_cache(dates):
+    """Fetch every date of `dates` that is not cached yet, off the event loop."""
+    missing = sorted(set(dates) - load_cached_dates())
+    if not missing:
+        return
+    settled = (datetime.today() - timedelta(SETTLE_DAYS)).strftime("%Y-%m-%d")
+    loop = asyncio.get_running_loop()
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        async def process_date(date):
+            try:
+                data = await loop.run_in_executor(executor, fetch_date, date)
+                if data or date < settled:
+                    save_cache(date, data)
+            except Exception as e:
+                print(f"Error fetching data for {date}: {e}")
+
+        tasks = [process_date(date) for date in missing]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+            await task
+
+def build_companies(dates, symbols):
+    """Per company records in date order, derived from the per date cache."""
+    symbols = set(symbols)
+    res = {}
+    for date in dates:
+        try:
+            data = load_cache(date)
+        except FileNotFoundError:
+            continue
+        for symbol, (short_volume, short_exempt_volume, total_volume) in data.items():
+            if symbol not in symbols:
+                continue
+            res.setdefault(symbol, []).append({
+                'date': date,
+                'shortVolume': short_volume,
+                'shortExemptVolume': short_exempt_volume,
+                'totalVolume': total_volume,
+                'shortPercent': round((short_volume / total_volume) * 100, 2) if total_volume else 0,
+                'shortExemptPercent': round((short_exempt_volume / total_volume) * 100, 2) if total_volume else 0,
+            })
+    return res
+
+def save_json(symbol, data):
     path = f"json/dark-pool/companies/{symbol}.json"
     os.makedirs(os.path.dirname(path), exist_ok=True)
-    await loop.run_in_executor(None, ujson.dump, data, open(path, 'w'))
-
-async def process_ticker(ticker):
-    data = await get_data(ticker)
-    if len(data)>0:
-        await save_json(ticker, data)
+    with open(path, 'w') as file:
+        ujson.dump(data, file)
 
 async def run():
     con = sqlite3.connect('stocks.db')
@@ -93,20 +175,20 @@ async def run():
 
     total_symbols = stocks_symbols+ etf_symbols
 
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for ticker in total_symbols:
-            tasks.append(process_ticker(ticker))
-        
-        # Run tasks concurrently in batches to avoid too many open connections
-        batch_size = 10  # Adjust based on your system's capacity
-        for i in tqdm(range(0, len(tasks), batch_size)):
-            batch = tasks[i:i + batch_size]
-            await asyncio.gather(*batch)
+    dates = get_trade_dates()
+    await update_cache(dates)
+    prune_cache(dates)
+
+    companies = build_companies(dates, total_symbols)
+    for symbol, data in tqdm(companies.items()):
+        try:
+            save_json(symbol, data)
+        except Exception as e:
+            print(f"Error saving data for {symbol}: {e}")
 
 
 if __name__ == "__main__":
     try:
         asyncio.run(run())
     except Exception as e:
-        print(f"An error occurred: {e}")
\ No newline at end of file
+        print(f"An error occurred: {e}")
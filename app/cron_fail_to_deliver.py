@@ -1,7 +1,7 @@
-from datetime import timedelta
 import os
+import concurrent.futures
+import numpy as np
 import pandas as pd
-import json
 from pathlib import Path
 import time
 import ujson
@@ -13,66 +13,98 @@ def save_json(symbol, data):
     with open(f"json/fail-to-deliver/companies/{symbol}.json", 'w') as file:
         ujson.dump(data, file)
 
-def get_total_data(files_available, limit=24):
+FTD_COLUMNS = ["SETTLEMENT DATE", "SYMBOL", "QUANTITY (FAILS)", "PRICE"]
+FTD_DTYPES = {"SETTLEMENT DATE": str, "SYMBOL": str, "QUANTITY (FAILS)": str, "PRICE": str}
+CACHE_DIR = 'json/fail-to-deliver/cache'
+
+
+def cache_path(file):
+    # Size and mtime are part of the key so a re-downloaded csv is parsed again
+    stat = os.stat(file)
+    return f"{CACHE_DIR}/{Path(file).name}-{stat.st_size}-{int(stat.st_mtime)}.npz"
+
+
+def parse_file(file):
     """
-    Combine all the 1/2 monthly csv into 1 large csv file.
+    Parse one SEC FTD file with the C parser and cache the typed columns as npz.
     """
-    combined_df = pd.DataFrame(columns=["SETTLEMENT DATE", "SYMBOL", "QUANTITY (FAILS)", "PRICE"])
-    for file in files_available[:limit]:
-        print(f"Processing file: {file}")
+    df = pd.read_csv(file, sep='|', quotechar='"', usecols=lambda col: col in FTD_COLUMNS,
+                     dtype=FTD_DTYPES, on_bad_lines='skip', encoding_errors='replace')
+    df = df.dropna(subset=["SYMBOL"])
+
+    date = pd.to_datetime(df["SETTLEMENT DATE"], format='%Y%m%d', errors='coerce')
+    fails = pd.to_numeric(df["QUANTITY (FAILS)"], errors='coerce').fillna(0).astype(np.int64)
+    price = pd.to_numeric(df["PRICE"], errors='coerce').astype(np.float64)
+
+    np.savez(cache_path(file),
+             date=date.to_numpy(dtype='datetime64[D]'),
+             symbol=df["SYMBOL"].to_numpy(dtype=str),
+             fails=fails.to_numpy(),
+             price=price.to_numpy())
+    return file
+
+
+def load_cached(file):
+    with np.load(cache_path(file)) as data:
+        return pd.DataFrame({
+            "date": data["date"],
+            "Ticker": data["symbol"],
+            "failToDeliver": data["fails"],
+            "price": data["price"],
+        })
+
+
+def get_total_data(files_available, limit=24, max_workers=4):
+    """
+    Combine all the 1/2 monthly csv into 1 large DataFrame.
+    Only files without a cached npz are parsed (in parallel), the rest is loaded from cache.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    files = files_available[:limit]
+    new_files = [file for file in files if not os.path.exists(cache_path(file))]
+    print(f"Parsing {len(new_files)} new files, {len(files) - len(new_files)} cached")
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(parse_file, file): file for file in new_files}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                print(f"Processed file: {future.result()}")
+            except Exception as e:
+                print(f"Error reading {futures[future]}: {e}")
+
+    frames = []
+    for file in files:
         try:
-            # Read the CSV file with appropriate parameters
-            df = pd.read_csv(file, sep='|', quotechar='"', engine='python')
-            
-            # Safely remove columns if they exist
-            if 'CUSIP' in df.columns:
-                del df['CUSIP']
-            if 'DESCRIPTION' in df.columns:
-                del df['DESCRIPTION']
-            
-            # Safely convert SETTLEMENT DATE
-            if 'SETTLEMENT DATE' in df.columns:
-                df['SETTLEMENT DATE'] = pd.to_datetime(df['SETTLEMENT DATE'], format='%Y%m%d', errors='coerce')
-            
-            combined_df = pd.concat([combined_df, df]).drop_duplicates()
-        
-        except pd.errors.ParserError as e:
-            print(f"Error reading {file}: {e}")
+            frames.append(load_cached(file))
         except Exception as e:
             print(f"Unexpected error with {file}: {e}")
-    
-    combined_df["SETTLEMENT DATE"] = combined_df["SETTLEMENT DATE"].astype(str)
-    combined_df.rename(columns={
-        "SETTLEMENT DATE": "date",
-        "SYMBOL": "Ticker",
-        "QUANTITY (FAILS)": "failToDeliver",
-        "PRICE": "price"
-    }, inplace=True)
-    
-    combined_df["T+35 Date"] = pd.to_datetime(combined_df['date'], format='%Y-%m-%d', errors="coerce") + timedelta(days=35)
-    combined_df["T+35 Date"] = combined_df["T+35 Date"].astype(str)
 
-    combined_df["failToDeliver"] = pd.to_numeric(combined_df["failToDeliver"], errors='coerce')
-    combined_df["failToDeliver"] = combined_df["failToDeliver"].fillna(0).astype(int)
-    
-    combined_df = combined_df[~combined_df["Ticker"].isna()]
-    combined_df.sort_values(by="date", inplace=True)
-    
+    if not frames:
+        return pd.DataFrame(columns=["date", "Ticker", "failToDeliver", "price"])
+
+    # Concatenate once and dedup once instead of on every file
+    combined_df = pd.concat(frames, ignore_index=True)
+    combined_df = combined_df.drop_duplicates(subset=["date", "Ticker", "failToDeliver", "price"])
+
+    combined_df["date"] = combined_df["date"].dt.strftime('%Y-%m-%d').fillna('NaT')
+    combined_df.sort_values(by="date", kind="stable", inplace=True)
+
     print(combined_df)
     return combined_df
 
-def filter_by_ticker(combined_df):
-    # Group by 'Ticker' column
-    grouped = combined_df.groupby('Ticker')
-    
-    # Dictionary to store DataFrames for each ticker
+def filter_by_ticker(combined_df, symbols):
+    """
+    Group the rows by ticker in one pass, keeping only the symbols we track.
+    """
+    combined_df = combined_df[combined_df["Ticker"].isin(symbols)]
     ticker_dfs = {}
-    
-    # Iterate over groups
-    for ticker, group in grouped:
-        # Store each group (DataFrame) in the dictionary
-        ticker_dfs[ticker] = group.copy()  # Use .copy() to avoid modifying original DataFrame
-    
+    for ticker, group in combined_df.groupby('Ticker', sort=False):
+        data = group[["date", "failToDeliver", "price"]].to_dict('records')
+        for item in data:
+            if item["price"] != item["price"]:
+                item["price"] = None
+        ticker_dfs[ticker] = data
+
     return ticker_dfs
 
 if __name__ == '__main__':
@@ -93,7 +125,7 @@ if __name__ == '__main__':
     con.close()
     etf_con.close()
 
-    total_symbols = stock_symbols + etf_symbols
+    total_symbols = set(stock_symbols + etf_symbols)
 
     # Specify your directory path
     directory_path = 'json/fail-to-deliver/csv'
@@ -103,11 +135,8 @@ if __name__ == '__main__':
     combined_df = get_total_data(files_available, limit=1000)
 
     
-    ticker_dataframes = filter_by_ticker(combined_df)
-    
-    # Example usage: print or access dataframes for each ticker
-    for ticker, df in ticker_dataframes.items():
-        if ticker in total_symbols:
-            data= [{k: v for k, v in d.items() if k not in ['Ticker', 'T+35 Date']} for d in df.to_dict('records')]
-            save_json(ticker, data)
+    ticker_data = filter_by_ticker(combined_df, total_symbols)
+
+    for ticker, data in ticker_data.items():
+        save_json(ticker, data)
     
\ No newline at end of file
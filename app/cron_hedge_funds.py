@@ -5,6 +5,7 @@ import time
 from datetime import datetime
 from collections import Counter
 from tqdm import tqdm
+from utils.holdings_index import get_institute_holdings
 
 
 # Load stock screener data
@@ -103,7 +104,7 @@ def all_hedge_funds(con):
 
 
 def get_data(cik, stock_sectors):
-    cursor.execute("SELECT cik, name, numberOfStocks, performancePercentage3year, averageHoldingPeriod, marketValue, winRate, holdings FROM institutes WHERE cik = ?", (cik,))
+    cursor.execute("SELECT cik, name, numberOfStocks, performancePercentage3year, averageHoldingPeriod, marketValue, winRate FROM institutes WHERE cik = ?", (cik,))
     cik_data = cursor.fetchall()
     res = [{
         'cik': row[0],
@@ -113,44 +114,25 @@ def get_data(cik, stock_sectors):
         'averageHoldingPeriod': row[4],
         'marketValue': row[5],
         'winRate': row[6],
-        'holdings': orjson.loads(row[7]),
     } for row in cik_data]
 
     if not res:
         return None  # Exit if no data is found
 
-    '''
-    filtered_data = []
-    for item in res:
-        try:
-            filtered_data+=item['holdings']
-        except:
-            pass
-    filtered_data = [item for item in filtered_data if datetime.strptime(item['date'], "%Y-%m-%d") >= cutoff_date]
-    print(filtered_data)
-    '''
-
     res = res[0] #latest data
 
-    filtered_holdings = [
-        {key: holding[key] for key in keys_to_keep}
-        for holding in res['holdings']
-    ]
+    # Share positions only, filtered in SQL on the normalized institute_holdings rows
+    holdings = get_institute_holdings(
+        cursor, cik,
+        "AND putCallShare = 'Share' AND avgPricePaid > 0 AND marketValue > 0 AND sharesNumber > 0 AND weight > 0"
+    )
 
-    
     filtered_holdings = [
         {
-            **{k: v for k, v in item.items() if k not in ['putCallShare', 'securityName']}, 
+            **{key: item[key] for key in keys_to_keep if key not in ['putCallShare', 'securityName']},
             'name': item['securityName'].title()
         }
-        for item in filtered_holdings 
-        if (
-            item['putCallShare'] == 'Share' and 
-            item['avgPricePaid'] > 0 and 
-            item['marketValue'] > 0 and 
-            item['sharesNumber'] > 0 and
-            item['weight'] > 0
-        )
+        for item in holdings
     ]
 
     filtered_holdings = remove_stock_duplicates(filtered_holdings)
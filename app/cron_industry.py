@@ -14,6 +14,12 @@ from dotenv import load_dotenv
 load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 
+# Daily P/E rows per class type, one file per date
+PE_CACHE_DIR = "json/industry/cache/pe"
+MAX_CONCURRENT_REQUESTS = 20
+# Empty recent dates are retried until FMP has published them
+SETTLE_DAYS = 3
+
 with open(f"json/stock-screener/data.json", 'rb') as file:
     stock_screener_data = orjson.loads(file.read())
 
@@ -36,36 +42,101 @@ def save_as_json(data, filename):
     with open(f"json/industry/{filename}.json", 'w') as file:
         ujson.dump(data, file)
 
-def remove_duplicates(data, key):
-    seen = set()
-    new_data = []
-    for item in data:
-        if item[key] not in seen:
-            seen.add(item[key])
-            new_data.append(item)
-    return new_data
-
-async def historical_pe_ratio(session, class_type='sector'):
-    # List to store the data
-    historical_data = []
-    
-    # Starting point: today minus 180 days
+def get_pe_dates():
+    # Weekdays of the last 180 days, holidays come back empty and get cached as such
     end_date = datetime.now()
-    start_date = end_date - timedelta(days=180)
-
-    # Iterate through each day
-    current_date = start_date
+    current_date = end_date - timedelta(days=180)
+    dates = []
     while current_date <= end_date:
-        if current_date.weekday() < 5:  # Only fetch data for weekdays (Monday to Friday)
-            date_str = current_date.strftime('%Y-%m-%d')
-            data = await get_data(session, date_str, class_type)
-            if data:
-                historical_data+=data
-        
-        # Move to the next day
+        if current_date.weekday() < 5:
+            dates.append(current_date.strftime('%Y-%m-%d'))
         current_date += timedelta(days=1)
-
-    return historical_data
+    return dates
+
+def get_pe_cache_dir(class_type):
+    return f"{PE_CACHE_DIR}/{class_type}"
+
+def load_pe_cache(class_type, date):
+    try:
+        with open(f"{get_pe_cache_dir(class_type)}/{date}.json", 'rb') as file:
+            return orjson.loads(file.read())
+    except FileNotFoundError:
+        return None
+
+def save_pe_cache(class_type, date, data):
+    os.makedirs(get_pe_cache_dir(class_type), exist_ok=True)
+    path = f"{get_pe_cache_dir(class_type)}/{date}.json"
+    with open(f"{path}.tmp", 'wb') as file:
+        file.write(orjson.dumps(data))
+    os.replace(f"{path}.tmp", path)
+
+def prune_pe_cache(class_type, dates):
+    # Drop dates that fell out of the window
+    keep = {f"{date}.json" for date in dates}
+    if not os.path.isdir(get_pe_cache_dir(class_type)):
+        return
+    for filename in os.listdir(get_pe_cache_dir(class_type)):
+        if filename not in keep:
+            os.remove(f"{get_pe_cache_dir(class_type)}/{filename}")
+
+async def get_pe_ratios(session, dates, class_type='sector'):
+    """
+    P/E rows of every date in `dates` -> {date: rows}. Past dates come from the
+    cache, missing ones are fetched concurrently. Today is always fetched and
+    empty recent dates are retried until they are SETTLE_DAYS old.
+    """
+    today = datetime.now().strftime('%Y-%m-%d')
+    settled = (datetime.now() - timedelta(days=SETTLE_DAYS)).strftime('%Y-%m-%d')
+    res = {}
+    missing = []
+    for date in dates:
+        data = load_pe_cache(class_type, date) if date < today else None
+        if data is None:
+            missing.append(date)
+        else:
+            res[date] = data
+
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def fetch(date):
+        async with semaphore:
+            try:
+                data = await get_data(session, date, class_type)
+            except Exception as e:
+                print(f"Error fetching {class_type} P/E for {date}: {e}")
+                return
+        data = data if isinstance(data, list) else []
+        res[date] = data
+        if date < today and (data or date < settled):
+            save_pe_cache(class_type, date, data)
+
+    await asyncio.gather(*[fetch(date) for date in missing])
+    return res
+
+def group_pe_history(pe_by_date, class_type='sector'):
+    """
+    One pass over all P/E rows -> {name: [{'date', 'pe'}]} sorted by date,
+    the first row of a date wins.
+    """
+    rows = [item for date in sorted(pe_by_date) for item in pe_by_date[date]]
+    if not rows:
+        return {}
+    df = pd.DataFrame(rows, columns=['date', class_type, 'pe'])
+    df['pe'] = pd.to_numeric(df['pe'], errors='coerce')
+    df = df.dropna(subset=['date', class_type, 'pe'])
+    df = df.sort_values('date', kind='stable').drop_duplicates(subset=[class_type, 'date'])
+    return {
+        name: [{'date': date, 'pe': round(float(pe), 2)} for date, pe in zip(group['date'], group['pe'])]
+        for name, group in df.groupby(class_type, sort=False)
+    }
+
+def first_pe(rows, class_type='sector'):
+    # name -> P/E of its first row
+    res = {}
+    for item in rows:
+        if class_type in item:
+            res.setdefault(item[class_type], item.get('pe'))
+    return res
 
 # Function to fetch data from the API
 async def get_data(session, date, class_type='sector'):
@@ -98,9 +169,11 @@ def get_each_industry_data():
 
 async def run():
 
+    pe_dates = get_pe_dates()
     async with aiohttp.ClientSession() as session:
-        historical_pe_list = await historical_pe_ratio(session, class_type = 'industry')
-
+        pe_by_date = await get_pe_ratios(session, pe_dates, class_type='industry')
+        prune_pe_cache('industry', pe_dates)
+        pe_history = group_pe_history(pe_by_date, class_type='industry')
 
         full_industry_list = get_each_industry_data()
         for industry, stocks in full_industry_list.items():
@@ -109,16 +182,7 @@ async def run():
             stocks = sorted(stocks, key=lambda x: x['marketCap'], reverse=True)
             for rank, item in enumerate(stocks, 1):
                 item['rank'] = rank
-            history_list = []
-            for item in historical_pe_list:
-                try:
-                    if item['industry'] == industry:
-                        history_list.append({'date': item['date'], 'pe': round(float(item['pe']),2)})
-                except:
-                    pass
-            history_list = sorted(history_list, key=lambda x: datetime.strptime(x['date'], '%Y-%m-%d'), reverse=False)
-            history_list = remove_duplicates(history_list, 'date')
-            res = {'name': industry, 'stocks': stocks, 'history': history_list}
+            res = {'name': industry, 'stocks': stocks, 'history': pe_history.get(industry, [])}
             save_as_json(res, filename)
 
 
@@ -209,14 +273,16 @@ async def run():
             pass
 
     # Assign the P/E values from pe_industry to the overview
-    async with aiohttp.ClientSession() as session:
-        pe_industry = await get_data(session, date, class_type='industry')
+    if date not in pe_by_date:
+        async with aiohttp.ClientSession() as session:
+            pe_by_date.update(await get_pe_ratios(session, [date], class_type='industry'))
+    pe_industry = first_pe(pe_by_date.get(date, []), class_type='industry')
     for sector, industries in overview.items():
         for industry_data in industries:
             industry_name = industry_data['industry']
 
             # Look for a matching industry in pe_industry to assign the P/E ratio
-            matching_pe = next((item['pe'] for item in pe_industry if item['industry'] == industry_name), None)
+            matching_pe = pe_industry.get(industry_name)
             
             if matching_pe is not None:
                 industry_data['pe'] = round(float(matching_pe), 2)
@@ -276,13 +342,15 @@ async def run():
 
     # Assign the P/E values from pe_industry to the overview
     async with aiohttp.ClientSession() as session:
+        # Only the latest date is needed here, it is fetched directly instead of going through the P/E cache
         pe_sector = await get_data(session, date, class_type='sector')
+    pe_sector = first_pe(pe_sector if isinstance(pe_sector, list) else [], class_type='sector')
     # Loop through sector_overview to update P/E ratios from pe_sector
     for sector_data in sector_overview:
         sector_name = sector_data['sector']
 
         # Find the matching sector in pe_sector and assign the P/E ratio
-        matching_pe = next((item['pe'] for item in pe_sector if item['sector'] == sector_name), None)
+        matching_pe = pe_sector.get(sector_name)
 
         if matching_pe is not None:
             sector_data['pe'] = round(float(matching_pe), 2)
@@ -2,6 +2,7 @@ import ujson
 import asyncio
 import aiohttp
 import sqlite3
+import argparse
 from datetime import datetime
 from aiofiles import open as async_open
 from tqdm import tqdm
@@ -10,44 +11,141 @@ import os
 
 load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
+# Point at fmp_stub_server.py to run against recorded responses
+base_url = os.getenv('FMP_BASE_URL', "https://financialmodelingprep.com")
 
 
 keys_to_remove_insider_history = {"symbol", "link", "filingDate", "reportingCik"}
 keys_to_remove_insider_statistics = {"symbol", "cik", "purchases", "sales", "pPurchases", "sSales"}
 
+# Newest filingDate stored per symbol and of the last market wide sweep, plus the
+# symbols whose last fetch failed part way (fetched again regardless of the sweep)
+STATE_PATH = "json/insider-trading/cache/state.json"
+MAX_PAGES = 101
+MAX_SWEEP_PAGES = 100
+CHUNK_SIZE = 100  # symbols per minute, FMP rate limit
+
 
 # Function to check if the year is at least 2015
 def is_at_least_2015(date_string):
     year = datetime.strptime(date_string, "%Y-%m-%d").year
     return year >= 2015
 
+def record_key(item):
+    # Identity of a transaction from the fields kept in the history files
+    return (item.get("transactionDate"), item.get("reportingName"), item.get("transactionType"),
+            item.get("securitiesTransacted"), item.get("price"), item.get("securitiesOwned"), item.get("formType"))
+
+def load_state():
+    try:
+        with open(STATE_PATH, 'r') as file:
+            return ujson.load(file)
+    except:
+        return {'symbols': {}, 'sweep': None, 'pending': []}
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    with open(f"{STATE_PATH}.tmp", 'w') as file:
+        ujson.dump(state, file)
+    os.replace(f"{STATE_PATH}.tmp", STATE_PATH)
+
+def load_history(symbol):
+    try:
+        with open(f"json/insider-trading/history/{symbol}.json", 'r') as file:
+            return ujson.load(file)
+    except:
+        return None
+
 async def get_statistics_endpoints(session, symbol):
-    url = f"https://financialmodelingprep.com/api/v4/insider-roaster-statistic?symbol={symbol}&apikey={api_key}"
+    url = f"{base_url}/api/v4/insider-roaster-statistic?symbol={symbol}&apikey={api_key}"
     async with session.get(url) as response:
         if response.status == 200:
             return symbol, await response.json()
         else:
             return symbol, []
 
-async def get_insider_trading_endpoints(session, symbol):
+async def get_latest_filings(session, since):
+    """
+    Symbols with filings at or after `since` from the market wide feed (newest
+    first). Returns (symbols, newest filingDate) or (None, newest) if the sweep
+    ran out of pages before reaching `since`. Without `since` only the newest
+    filingDate is read.
+    """
+    symbols = set()
+    newest = None
+    for page in range(MAX_SWEEP_PAGES):
+        url = f"{base_url}/stable/insider-trading/latest?page={page}&apikey={api_key}"
+        async with session.get(url) as response:
+            if response.status != 200:
+                return None, newest
+            data = await response.json()
+        if not data:
+            return symbols, newest
+        for item in data:
+            filing_date = item.get("filingDate") or ""
+            newest = max(newest or filing_date, filing_date)
+            if since is None or filing_date < since:
+                return symbols, newest
+            if item.get("symbol"):
+                symbols.add(item["symbol"])
+    return None, newest
+
+async def get_insider_trading_endpoints(session, symbol, state):
+    """
+    Page through the filings of `symbol` (newest first). With a stored
+    history, paging stops at the first filing older than the high-water mark
+    and only unknown rows are merged in front of the history.
+    Returns True if the history changed.
+    """
+    mark = state['symbols'].get(symbol)
+    history = load_history(symbol) if mark else None
+    if history is None:
+        mark = None
+    known = {record_key(item) for item in history} if history else set()
+
     aggregated_data = []
-    for page in range(101):  # Pages from 0 to 100
-        url = f"https://financialmodelingprep.com/api/v4/insider-trading?symbol={symbol}&page={page}&apikey={api_key}"
+    reached_mark = False
+    complete = True
+    for page in range(MAX_PAGES):  # Pages from 0 to 100
+        url = f"{base_url}/api/v4/insider-trading?symbol={symbol}&page={page}&apikey={api_key}"
         async with session.get(url) as response:
             if response.status == 200:
                 data = await response.json()
                 if not data:
                     break  # Break if the result is empty
-                aggregated_data.extend(data)
+                for item in data:
+                    if mark and (item.get("filingDate") or "") < mark:
+                        reached_mark = True
+                        break
+                    aggregated_data.append(item)
+                if reached_mark:
+                    break
             else:
+                complete = False
                 break  # Break if response status is not 200
+
+    pending = state.setdefault('pending', [])
+    if complete:
+        # An empty mark still records that the symbol has been fetched
+        state['symbols'][symbol] = max([item.get("filingDate") or "" for item in aggregated_data] + [mark or ""])
+        if symbol in pending:
+            pending.remove(symbol)
+    elif symbol not in pending:
+        # Its new filings may be older than the next sweep mark, keep it until a fetch completes
+        pending.append(symbol)
+
     filtered_data = [item for item in aggregated_data if is_at_least_2015(item["transactionDate"][:10])]
+    filtered_data = [{k: v for k, v in item.items() if k not in keys_to_remove_insider_history} for item in filtered_data]
+    if history is not None:
+        filtered_data = [item for item in filtered_data if record_key(item) not in known]
+        if not filtered_data:
+            return False
+        filtered_data = filtered_data + history
 
     if len(filtered_data) > 0:
-        filtered_data = [{k: v for k, v in item.items() if k not in keys_to_remove_insider_history} for item in filtered_data]
-        
         await save_insider_trading_as_json(symbol, filtered_data)
-
+        return True
+    return False
 
 
 async def save_statistics_as_json(symbol, data):
@@ -59,22 +157,24 @@ async def save_insider_trading_as_json(symbol, data):
         await file.write(ujson.dumps(data))
 
 
-async def process_symbols(session, symbols):
+async def process_symbols(session, symbols, state):
     #History
-    tasks = [get_insider_trading_endpoints(session, symbol) for symbol in symbols]
-    await asyncio.gather(*tasks)
-    
-    #Statistics
+    tasks = [get_insider_trading_endpoints(session, symbol, state) for symbol in symbols]
+    changed = await asyncio.gather(*tasks)
     
+    #Statistics, only where the history changed or none is stored yet
+    symbols = [symbol for symbol, updated in zip(symbols, changed)
+               if updated or not os.path.exists(f"json/insider-trading/statistics/{symbol}.json")]
     tasks = [get_statistics_endpoints(session, symbol) for symbol in symbols]
     results = await asyncio.gather(*tasks)
     for symbol, data in results:
         if data:
             filtered_data = [{k: v for k, v in item.items() if k not in keys_to_remove_insider_statistics} for item in data]
             await save_statistics_as_json(symbol, filtered_data)
+    return sum(changed)
     
 
-async def run():
+async def run(incremental=False):
     con = sqlite3.connect('stocks.db')
     cursor = con.cursor()
     cursor.execute("PRAGMA journal_mode = wal")
@@ -82,15 +182,44 @@ async def run():
     stock_symbols = [row[0] for row in cursor.fetchall()]
     con.close()
 
-    chunk_size = len(stock_symbols) // 70  # Divide the list into N chunks
-    chunks = [stock_symbols[i:i + chunk_size] for i in range(0, len(stock_symbols), chunk_size)]
+    os.makedirs("json/insider-trading/history", exist_ok=True)
+    os.makedirs("json/insider-trading/statistics", exist_ok=True)
+
+    state = load_state() if incremental else {'symbols': {}, 'sweep': None, 'pending': []}
 
     async with aiohttp.ClientSession() as session:
-        for chunk in tqdm(chunks):
-            await process_symbols(session, chunk)
-            await asyncio.sleep(60)
-           
-try:
-    asyncio.run(run())
-except Exception as e:
-    print(e)
+        symbols = stock_symbols
+        if incremental and state.get('sweep'):
+            # Only symbols with new filings since the last sweep, without a stored history
+            # or whose last fetch did not complete
+            active, newest = await get_latest_filings(session, state['sweep'])
+            if active is not None:
+                active |= set(state.get('pending', []))
+                symbols = [symbol for symbol in stock_symbols if symbol in active or symbol not in state['symbols']]
+        else:
+            _, newest = await get_latest_filings(session, None)
+        print(f"Fetching insider trades of {len(symbols)} symbols")
+
+        chunks = [symbols[i:i + CHUNK_SIZE] for i in range(0, len(symbols), CHUNK_SIZE)]
+        updated = 0
+        for i, chunk in enumerate(tqdm(chunks)):
+            updated += await process_symbols(session, chunk, state)
+            save_state(state)
+            if i < len(chunks) - 1:
+                await asyncio.sleep(60)
+
+    if newest:
+        # Symbols that failed are in state['pending'], so the sweep mark can move past their filings
+        state['sweep'] = newest
+    save_state(state)
+    print(f"Updated insider history of {updated} symbols")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fetch the insider trading history and statistics of all stocks.')
+    parser.add_argument('--incremental', action='store_true', help='Only fetch filings newer than the stored history')
+    args = parser.parse_args()
+    try:
+        asyncio.run(run(incremental=args.incremental))
+    except Exception as e:
+        print(e)
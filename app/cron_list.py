@@ -3,9 +3,12 @@ import sqlite3
 import asyncio
 import aiohttp
 import pandas as pd
+import hashlib
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 import os
+from utils.holdings_index import migrate_etf_holdings
 
 load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
@@ -17,9 +20,12 @@ with open(f"json/stock-screener/data.json", 'rb') as file:
 stock_screener_data_dict = {item['symbol']: item for item in stock_screener_data}
 
 
-query_etf_holding = f"SELECT holding from etfs WHERE symbol = ?"
 quote_cache = {}
 
+QUOTE_SNAPSHOT_PATH = "json/quote-snapshot/data.json"
+# Input hash per ETF of the last run, unchanged ETFs are not rewritten
+ETF_HOLDING_HASHES_PATH = "json/etf/holding-hashes/data.json"
+
 async def save_json(category, data, category_type='market-cap'):
     with open(f"json/{category_type}/list/{category}.json", 'wb') as file:
         file.write(orjson.dumps(data))
@@ -84,66 +90,120 @@ async def process_category(cursor, category, condition, category_type='market-ca
 
 
 
+def load_quote_snapshot():
+    """All quotes written by cron_quote in one read, {} if the snapshot is missing"""
+    try:
+        with open(QUOTE_SNAPSHOT_PATH, 'rb') as file:
+            return orjson.loads(file.read())
+    except:
+        return {}
+
+def load_etf_holding_hashes():
+    try:
+        with open(ETF_HOLDING_HASHES_PATH, 'rb') as file:
+            return orjson.loads(file.read())
+    except:
+        return {}
+
+def save_etf_holding_hashes(hashes):
+    os.makedirs(os.path.dirname(ETF_HOLDING_HASHES_PATH), exist_ok=True)
+    with open(ETF_HOLDING_HASHES_PATH, 'wb') as file:
+        file.write(orjson.dumps(hashes))
+
+def write_etf_holding(ticker, final_res):
+    with open(f"json/etf/holding/{ticker}.json", 'wb') as file:
+        file.write(orjson.dumps(final_res))
+
+def build_etf_holding(ticker, rows, quotes):
+    # rows: (symbol, name, weightPercentage, sharesNumber, marketValue) in the order of etfs.holding
+    res = []
+    for symbol, name, weight_percentage, shares_number, market_value in rows:
+        if (market_value or 0) < 0 or not (weight_percentage or 0) > 0:
+            continue
+        item = {
+            'symbol': symbol,
+            'name': name.capitalize() if name else None,
+            'weightPercentage': weight_percentage,
+            'sharesNumber': market_value if not symbol and shares_number == 0 else shares_number
+        }
+        try:
+            # Adjustments for ticker = 'IBIT'
+            if ticker == 'IBIT' and symbol == 'BTC':
+                item['symbol'] = 'BTCUSD'
+                item['name'] = 'Bitcoin'
+
+            quote_data = quotes.get(item['symbol'])
+            item['price'] = round(quote_data.get('price'), 2) if quote_data else None
+            item['changesPercentage'] = round(quote_data.get('changesPercentage'), 2) if quote_data else None
+            item['name'] = quote_data.get('name') if quote_data else item['name']
+        except:
+            pass
+
+        item['weightPercentage'] = round(item.get('weightPercentage'), 2) if item['weightPercentage'] else None
+        res.append(item)
+
+    for rank, item in enumerate(res, 1):
+        item['rank'] = rank
+    return res
+
 async def get_etf_holding():
     # Create a connection to the ETF database
     etf_con = sqlite3.connect('etf.db')
     etf_cursor = etf_con.cursor()
     etf_cursor.execute("PRAGMA journal_mode = wal")
-    
-    # Fetch distinct ETF symbols
-    etf_cursor.execute("SELECT DISTINCT symbol FROM etfs")
-    etf_symbols = [row[0] for row in etf_cursor.fetchall()]
-    
-    for ticker in etf_symbols:
-        res = []
-        df = pd.read_sql_query(query_etf_holding, etf_con, params=(ticker,))
-        try:
-            # Load holdings data from the SQL query result
-            data = orjson.loads(df['holding'].iloc[0])
-            last_update = data[0]['updated'][0:10]
-            # Rename 'asset' to 'symbol' and keep other keys the same
-            res = [
-                {
-                    'symbol': item.get('asset', None),
-                    'name': item.get('name', None).capitalize() if item.get('name') else None,
-                    'weightPercentage': item.get('weightPercentage', None),
-                    'sharesNumber': item.get('marketValue', None) if not item.get('asset') and item.get('sharesNumber') == 0 else item.get('sharesNumber', None)
-                }
-                for item in data if item.get('marketValue', 0) >= 0 and item.get('weightPercentage', 0) > 0]
 
-            for item in res:
-                try:
-                    symbol = item['symbol']
-
-                    # Adjustments for ticker = 'IBIT'
-                    if ticker == 'IBIT' and symbol == 'BTC':
-                        item['symbol'] = 'BTCUSD'
-                        item['name'] = 'Bitcoin'
+    etf_cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='etf_holdings'")
+    if not etf_cursor.fetchone():
+        migrate_etf_holdings(etf_con)
+
+    # All holdings of all ETFs in one query, grouped by ETF in blob order
+    etf_cursor.execute("SELECT etf, symbol, name, weightPercentage, sharesNumber, marketValue, date FROM etf_holdings ORDER BY etf, position")
+    holdings_by_etf = {}
+    last_update_by_etf = {}
+    for etf, symbol, name, weight_percentage, shares_number, market_value, date in etf_cursor.fetchall():
+        if etf not in holdings_by_etf:
+            holdings_by_etf[etf] = []
+            last_update_by_etf[etf] = date[0:10] if date else None
+        holdings_by_etf[etf].append((symbol, name, weight_percentage, shares_number, market_value))
+    etf_con.close()
 
-                    quote_data = await get_quote_data(item['symbol'])
-                    item['price'] = round(quote_data.get('price'), 2) if quote_data else None
-                    item['changesPercentage'] = round(quote_data.get('changesPercentage'), 2) if quote_data else None
-                    item['name'] = quote_data.get('name') if quote_data else item['name']
+    quotes = load_quote_snapshot()
+    quote_fields = ('price', 'changesPercentage', 'name')
 
-                except:
-                    pass
-                
-                # Assign price and changesPercentage if available, otherwise set to None
-                item['weightPercentage'] = round(item.get('weightPercentage'), 2) if item['weightPercentage'] else None
+    def get_quote(symbol):
+        # Symbols missing from the snapshot (e.g. crypto) still come from their quote file
+        if symbol not in quotes:
+            try:
+                with open(f"json/quote/{symbol}.json", 'rb') as file:
+                    quotes[symbol] = orjson.loads(file.read())
+            except:
+                quotes[symbol] = None
+        return quotes[symbol]
+
+    previous_hashes = load_etf_holding_hashes()
+    hashes = {}
+    pending = []
+    for ticker, rows in holdings_by_etf.items():
+        constituents = ['BTCUSD' if ticker == 'IBIT' and row[0] == 'BTC' else row[0] for row in rows]
+        constituent_quotes = [
+            [quote.get(field) for field in quote_fields] if (quote := get_quote(symbol)) else None
+            for symbol in constituents
+        ]
+        digest = hashlib.blake2b(orjson.dumps([last_update_by_etf[ticker], rows, constituent_quotes]), digest_size=16).hexdigest()
+        hashes[ticker] = digest
+        if digest == previous_hashes.get(ticker) and os.path.exists(f"json/etf/holding/{ticker}.json"):
+            continue
 
-        except Exception as e:
-            last_update = None
-            res = []
+        res = build_etf_holding(ticker, rows, quotes)
         # Save results to a file if there's data to write
         if res:
-            for rank, item in enumerate(res, 1):
-                item['rank'] = rank
-            with open(f"json/etf/holding/{ticker}.json", 'wb') as file:
-                final_res = {'lastUpdate': last_update, 'holdings': res}
-                file.write(orjson.dumps(final_res))
-    
-    # Close the database connection
-    etf_con.close()
+            pending.append((ticker, {'lastUpdate': last_update_by_etf[ticker], 'holdings': res}))
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda args: write_etf_holding(*args), pending))
+
+    save_etf_holding_hashes(hashes)
+    print(f"ETF holdings: wrote {len(pending)} of {len(holdings_by_etf)} ETFs")
 
 
 
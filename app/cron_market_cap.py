@@ -1,83 +1,171 @@
 from datetime import datetime, timedelta
 import ujson
+import orjson
 import time
 import sqlite3
 import asyncio
 import aiohttp
 import random
+import argparse
 from tqdm import tqdm
 from dotenv import load_dotenv
 import os
+from utils.rate_limiter import RateLimiter
 
 load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 
+MARKET_CAP_DIR = "json/market-cap/companies"
+BACKFILL_START = datetime(1990, 1, 1)
+WINDOW_YEARS = 5
+CHUNK_SIZE = 100
+# Shared by every request of the run
+MAX_REQUESTS_PER_MINUTE = 500
+MAX_CONCURRENT_REQUESTS = 50
+# Symbols whose derived points are checked against FMP in --derive mode
+VALIDATION_SAMPLE = 50
+
+
 async def save_json(symbol, data):
-    with open(f"json/market-cap/companies/{symbol}.json", 'w') as file:
+    with open(f"{MARKET_CAP_DIR}/{symbol}.json", 'w') as file:
         ujson.dump(data, file)
 
+def load_series(symbol):
+    try:
+        with open(f"{MARKET_CAP_DIR}/{symbol}.json", 'rb') as file:
+            return orjson.loads(file.read())
+    except:
+        return []
 
-async def get_data(session, symbol):
-    res_list = []
-    start_date = '1990-01-01'
-    dates = [
-        '1995-01-01',
-        '2000-01-01',
-        '2005-01-01',
-        '2010-01-01',
-        '2015-01-01',
-        '2020-01-01',
-        '2025-01-01'
-    ]
-
-    for end_date in dates:
-
-        # Construct the API URL
-        url = f"https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?from={start_date}&to={end_date}&limit=2000&apikey={api_key}"
-        
+def get_windows(start_date, end_date):
+    # WINDOW_YEARS windows from start_date up to and including end_date
+    windows = []
+    while True:
+        window_end = min(start_date + timedelta(days=365 * WINDOW_YEARS), end_date)
+        windows.append((start_date.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+        if window_end >= end_date:
+            return windows
+        start_date = window_end
+
+async def fetch_window(session, symbol, start_date, end_date, rate_limiter, semaphore):
+    # Construct the API URL
+    url = f"https://financialmodelingprep.com/api/v3/historical-market-capitalization/{symbol}?from={start_date}&to={end_date}&limit=2000&apikey={api_key}"
+    await rate_limiter.acquire()
+    async with semaphore:
         try:
             async with session.get(url) as response:
                 if response.status == 200:
                     data = await response.json()
-                    if len(data) > 0:
-                        res_list.extend(data)
+                    if isinstance(data, list):
+                        return data
         except Exception as e:
             print(f"Error fetching data for {symbol}: {e}")
-        
-        start_date = end_date
+    return []
+
+async def fetch_range(session, symbol, start_date, rate_limiter, semaphore):
+    # All windows from start_date to today, requested concurrently
+    results = await asyncio.gather(*[
+        fetch_window(session, symbol, window_start, window_end, rate_limiter, semaphore)
+        for window_start, window_end in get_windows(start_date, datetime.today())
+    ])
+    return [item for data in results for item in data]
+
+def merge_points(existing, new_items, since=''):
+    """
+    Add the points of `new_items` dated `since` or later to `existing`, a date
+    is stored once. Returns the series sorted by date without 'symbol'.
+    """
+    by_date = {item['date']: item for item in existing}
+    for item in new_items:
+        if item['date'] >= since:
+            # Filter out 'symbol' from each item
+            by_date[item['date']] = {k: v for k, v in item.items() if k != 'symbol'}
+    return [by_date[date] for date in sorted(by_date)]
+
+def derive_points(symbol, con, since):
+    """
+    Market cap from the stored close prices times the outstanding shares as of
+    each date, for the dates from `since` on.
+    """
+    try:
+        with open(f"json/historical-price/max/{symbol}.json", 'rb') as file:
+            prices = [(item['time'], item['close']) for item in orjson.loads(file.read()) if item['time'] >= since]
+        cursor = con.cursor()
+        cursor.execute("SELECT historicalShares FROM stocks WHERE symbol = ?", (symbol,))
+        shares = sorted((item['date'], item['outstandingShares']) for item in ujson.loads(cursor.fetchone()[0]) if item.get('outstandingShares'))
+    except Exception as e:
+        print(f"Cannot derive market cap for {symbol}: {e}")
+        return []
+
+    res = []
+    idx = -1
+    for date, close in sorted(prices):
+        while idx + 1 < len(shares) and shares[idx + 1][0] <= date:
+            idx += 1
+        if idx >= 0 and close is not None:
+            res.append({'date': date, 'marketCap': int(round(close * shares[idx][1]))})
+    return res
 
-    if len(res_list) > 0:
-        # Remove duplicates based on the 'date' field
-        unique_res_list = {item['date']: item for item in res_list}.values()
-        unique_res_list = sorted(unique_res_list, key=lambda x: x['date'])
+def relative_deviation(derived, provider):
+    # Relative difference of the derived points to FMP on the shared dates
+    provider_by_date = {item['date']: item['marketCap'] for item in provider if item.get('marketCap')}
+    return [abs(item['marketCap'] / provider_by_date[item['date']] - 1) for item in derived if item['date'] in provider_by_date]
 
-        # Filter out 'symbol' from each item
-        filtered_data = [{k: v for k, v in item.items() if k != 'symbol'} for item in unique_res_list]
-        
-        # Save the filtered data
-        await save_json(symbol, filtered_data)
+async def get_data(session, symbol, rate_limiter, semaphore, stats, con=None, validate=False):
+    existing = load_series(symbol)
+    if not existing:
+        # New symbol, full backfill
+        res_list = await fetch_range(session, symbol, BACKFILL_START, rate_limiter, semaphore)
+        if len(res_list) > 0:
+            await save_json(symbol, merge_points([], res_list))
+            stats['backfilled'] += 1
+        return
 
-async def run():
+    # History before the last stored point never changes, that point itself is refreshed
+    since = existing[-1]['date']
+    if con is not None:
+        new_items = derive_points(symbol, con, since)
+        if validate:
+            provider = await fetch_range(session, symbol, datetime.strptime(since, '%Y-%m-%d'), rate_limiter, semaphore)
+            stats['deviations'] += relative_deviation(new_items, provider)
+    else:
+        new_items = await fetch_range(session, symbol, datetime.strptime(since, '%Y-%m-%d'), rate_limiter, semaphore)
+
+    res_list = merge_points(existing, new_items, since)
+    if res_list != existing:
+        await save_json(symbol, res_list)
+        stats['updated'] += 1
+
+async def run(derive=False):
     con = sqlite3.connect('stocks.db')
     cursor = con.cursor()
     cursor.execute("PRAGMA journal_mode = wal")
     cursor.execute("SELECT DISTINCT symbol FROM stocks WHERE symbol NOT LIKE '%.%'")
     symbols = [row[0] for row in cursor.fetchall()]
-    con.close()
-    
+
+    os.makedirs(MARKET_CAP_DIR, exist_ok=True)
+    validation_sample = set(random.sample(symbols, min(VALIDATION_SAMPLE, len(symbols)))) if derive else set()
+    stats = {'backfilled': 0, 'updated': 0, 'deviations': []}
+    rate_limiter = RateLimiter(MAX_REQUESTS_PER_MINUTE)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    start_time = time.time()
+
     async with aiohttp.ClientSession() as session:
-        tasks = []
-        for i, symbol in enumerate(tqdm(symbols), 1):
-            tasks.append(get_data(session, symbol))
-            if i % 100 == 0:
-                await asyncio.gather(*tasks)
-                tasks = []
-                print(f'sleeping mode: {i}')
-                await asyncio.sleep(60)  # Pause for 60 seconds
-        
-        if tasks:
-            await asyncio.gather(*tasks)
+        for i in tqdm(range(0, len(symbols), CHUNK_SIZE)):
+            chunk = symbols[i:i + CHUNK_SIZE]
+            await asyncio.gather(*[
+                get_data(session, symbol, rate_limiter, semaphore, stats, con if derive else None, symbol in validation_sample)
+                for symbol in chunk
+            ])
+    con.close()
+
+    print(f"Backfilled {stats['backfilled']}, updated {stats['updated']} of {len(symbols)} symbols in {time.time() - start_time:.0f}s")
+    deviations = sorted(stats['deviations'])
+    if deviations:
+        print(f"Derived vs FMP over {len(deviations)} points: median {deviations[len(deviations) // 2]:.2%}, max {deviations[-1]:.2%}")
 
 if __name__ == "__main__":
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(run())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Update the historical market cap series.')
+    parser.add_argument('--derive', action='store_true', help='Derive new points from stored closes x outstanding shares, FMP only validates a sample')
+    args = parser.parse_args()
+    asyncio.run(run(args.derive))
\ No newline at end of file
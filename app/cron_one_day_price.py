@@ -3,8 +3,9 @@ import asyncio
 import aiohttp
 import sqlite3
 from datetime import datetime, timedelta, time
-import pandas as pd
+import numpy as np
 from GetStartEndDate import GetStartEndDate
+from utils.intraday_store import load_store, save_store, empty_bars, append_bars, to_records
 from dotenv import load_dotenv
 import os
 
@@ -18,21 +19,22 @@ async def save_price_data(symbol, data):
 
 
 async def fetch_and_save_symbols_data(symbols):
-    tasks = []
-    for symbol in symbols:
-        task = asyncio.create_task(get_todays_data(symbol))
-        tasks.append(task)
-    responses = await asyncio.gather(*tasks)
-    
+    async with aiohttp.ClientSession() as session:
+        tasks = []
+        for symbol in symbols:
+            task = asyncio.create_task(get_todays_data(session, symbol))
+            tasks.append(task)
+        responses = await asyncio.gather(*tasks)
+
     for symbol, response in zip(symbols, responses):
-        if len(response) > 0:
+        # None means no new bars since the last run, keep the existing export
+        if response:
             await save_price_data(symbol, response)
 
-async def get_todays_data(ticker):
+async def get_todays_data(session, ticker):
 
     start_date_1d, end_date_1d = GetStartEndDate().run()
 
-
     current_weekday = end_date_1d.weekday()
 
     start_date = start_date_1d.strftime("%Y-%m-%d")
@@ -40,52 +42,41 @@ async def get_todays_data(ticker):
 
     url = f"https://financialmodelingprep.com/api/v3/historical-chart/1min/{ticker}?from={start_date}&to={end_date}&apikey={api_key}"
 
-    df_1d = pd.DataFrame()
-
     current_date = start_date_1d
     target_time = time(9,30)
 
     extract_date = current_date.strftime('%Y-%m-%d')
 
-    async with aiohttp.ClientSession() as session:
-        responses = await asyncio.gather(session.get(url))
-
-        for response in responses:
-            try:
-                json_data = await response.json()
-                df_1d = pd.DataFrame(json_data).iloc[::-1].reset_index(drop=True)
-                df_1d = df_1d.drop(['volume'], axis=1)
-                df_1d = df_1d.round(2).rename(columns={"date": "time"})
-                try:
-                    with open(f"json/quote/{ticker}.json", 'r') as file:
-                        res = ujson.load(file)
-                        df_1d.loc[df_1d.index[0], 'close'] = res['previousClose']
-                except:
-                    pass
-
-                if current_weekday == 5 or current_weekday == 6:
-                    pass
-                else:
-                    if current_date.time() < target_time:
-                        pass                    
-                    else:
-                        end_time = pd.to_datetime(f'{extract_date} 16:00:00')
-                        new_index = pd.date_range(start=df_1d['time'].iloc[-1], end=end_time, freq='1min')
-                        
-                        remaining_df = pd.DataFrame(index=new_index, columns=['open', 'high', 'low','close'])
-                        remaining_df = remaining_df.reset_index().rename(columns={"index": "time"})
-                        remaining_df['time'] = remaining_df['time'].dt.strftime('%Y-%m-%d %H:%M:%S')
-                        remainind_df = remaining_df.set_index('time')
-
-                        df_1d = pd.concat([df_1d, remaining_df[1::]], ignore_index=True)
-                        #To-do FutureWarning: The behavior of DataFrame concatenation with empty or all-NA entries is deprecated. In a future version, this will no longer exclude empty or all-NA columns when determining the result dtypes. To retain the old behavior, exclude the relevant entries before the concat operation.
-    
-                df_1d = ujson.loads(df_1d.to_json(orient="records"))
-            except Exception as e:
-                print(e)
-                df_1d = []
-
-    res = df_1d
+    # Start from the stored session, a new trading day resets all 390 slots
+    stored_date, bars = load_store(ticker)
+    if stored_date != extract_date:
+        bars = empty_bars()
+
+    try:
+        async with session.get(url) as response:
+            json_data = await response.json()
+
+        # FMP returns the rows newest first, only the minutes after our cursor are applied
+        changed = append_bars(bars, json_data, extract_date)
+        if changed == 0:
+            return None
+
+        try:
+            with open(f"json/quote/{ticker}.json", 'r') as file:
+                res = ujson.load(file)
+                first_slot = int(np.flatnonzero(~np.isnan(bars[:, 3]))[0])
+                bars[first_slot, 3] = res['previousClose']
+        except:
+            pass
+
+        save_store(ticker, extract_date, bars)
+
+        # Pad the remaining session up to 16:00 while the market is open
+        pad = current_weekday not in (5, 6) and current_date.time() >= target_time
+        res = to_records(extract_date, bars, pad=pad)
+    except Exception as e:
+        print(e)
+        res = []
 
     return res
 
@@ -9,6 +9,7 @@ import concurrent.futures
 import os
 from GetStartEndDate import GetStartEndDate
 from dotenv import load_dotenv
+from utils.options_flow_store import connect, get_partitions, replace_partition
 
 # Load API key from .env
 load_dotenv()
@@ -41,6 +42,10 @@ output_dir = "json/options-historical-data/flow-data/"
 # Ensure the output directory exists
 os.makedirs(output_dir, exist_ok=True)
 
+# Date partitioned flow store read by cron_unusual_activity
+flow_con = connect()
+stored_dates = get_partitions(flow_con.cursor())
+
 # Function to fetch options activity data for a specific day
 def process_page(page, date):
     try:
@@ -57,6 +62,13 @@ def process_day(date_str):
     file_path = os.path.join(output_dir, f"{date_str}.json")
     if os.path.exists(file_path):
         #print(f"File for {date_str} already exists. Skipping...")
+        if date_str not in stored_dates:
+            # Backfill the store from files written before it existed
+            try:
+                with open(file_path, 'r') as file:
+                    replace_partition(flow_con, date_str, ujson.load(file))
+            except Exception as e:
+                print(f"Error loading {date_str} into the flow store: {e}")
         return
 
     res_list = []
@@ -115,6 +127,7 @@ def process_day(date_str):
     if len(filtered_list) > 0:
         with open(file_path, 'w') as file:
             ujson.dump(filtered_list, file)
+        replace_partition(flow_con, date_str, filtered_list)
 
     #print(f"Data saved for {date_str}")
 
@@ -129,3 +142,5 @@ while current_date <= end_date:
     # Move to the next day
     current_date += timedelta(days=1)
 
+flow_con.close()
+
@@ -10,6 +10,7 @@ import os
 import re
 from statistics import mean
 from collections import defaultdict
+from utils.options_flow_store import group_by_ticker
 
 
 # Database connection and symbol retrieval
@@ -53,13 +54,9 @@ def add_close_to_data(price_list, data):
     return data
 
 
-def get_market_flow_data(ticker,interval_1m=True):
+def get_market_flow_data(ticker, ticker_data, interval_1m=True):
     res_list = []
     
-    # Load the options flow data.
-    with open("json/options-flow/feed/data.json", "r") as file:
-        all_data = orjson.loads(file.read())
-    
     # Load ETF holdings data and extract ticker weights.
     # Use a common dictionary to accumulate flows across all tickers.
     delta_data = defaultdict(lambda: {
@@ -74,9 +71,8 @@ def get_market_flow_data(ticker,interval_1m=True):
     # Process each ticker's data using its weight.
     # Convert the weight percentage to a fraction.
     weight = 1 #ticker_weights[ticker] / 100.0 #ignore weights of sector
-    # Filter data for the current ticker.
-    ticker_data = [item for item in all_data if item.get('ticker') == ticker]
-    ticker_data.sort(key=lambda x: x['time'])
+    # Flow items of the current ticker, grouped once in main().
+    ticker_data = sorted(ticker_data, key=lambda x: x['time'])
 
     for item in ticker_data:
         try:
@@ -176,6 +172,8 @@ async def main():
     with open(f"json/options-flow/feed/data.json", "r") as file:
         data = orjson.loads(file.read())
 
+    # One pass over the feed instead of a full scan per symbol
+    flow_by_ticker = group_by_ticker(data)
     total_symbols = get_total_symbols()
     
     for symbol in tqdm(total_symbols):
@@ -195,33 +193,33 @@ async def main():
             net_put_premium = 0
             net_premium = 0
             
-            for item in data:
-                if item['ticker'] == symbol:
+            ticker_data = flow_by_ticker.get(symbol, [])
+            for item in ticker_data:
+                if item['put_call'] == 'Calls':
+                    call_premium += item['cost_basis']
+                    call_open_interest += int(item['open_interest'])
+                    call_volume += int(item['volume'])
+                elif item['put_call'] == 'Puts':
+                    put_premium += item['cost_basis']
+                    put_open_interest += int(item['open_interest'])
+                    put_volume += int(item['volume'])
+
+                if item['sentiment'] == 'Bullish':
+                    bullish_premium +=item['cost_basis']
                     if item['put_call'] == 'Calls':
-                        call_premium += item['cost_basis']
-                        call_open_interest += int(item['open_interest'])
-                        call_volume += int(item['volume'])
+                        net_call_premium +=item['cost_basis']
                     elif item['put_call'] == 'Puts':
-                        put_premium += item['cost_basis']
-                        put_open_interest += int(item['open_interest'])
-                        put_volume += int(item['volume'])
-
-                    if item['sentiment'] == 'Bullish':
-                        bullish_premium +=item['cost_basis']
-                        if item['put_call'] == 'Calls':
-                            net_call_premium +=item['cost_basis']
-                        elif item['put_call'] == 'Puts':
-                            net_put_premium +=item['cost_basis']
-                    
-                    if item['sentiment'] == 'Bearish':
-                        bearish_premium +=item['cost_basis']
-                        if item['put_call'] == 'Calls':
-                            net_call_premium -=item['cost_basis']
-                        elif item['put_call'] == 'Puts':
-                            net_put_premium -=item['cost_basis']
+                        net_put_premium +=item['cost_basis']
+                
+                if item['sentiment'] == 'Bearish':
+                    bearish_premium +=item['cost_basis']
+                    if item['put_call'] == 'Calls':
+                        net_call_premium -=item['cost_basis']
+                    elif item['put_call'] == 'Puts':
+                        net_put_premium -=item['cost_basis']
 
-                    if item['sentiment'] == 'Neutral':
-                        neutral_premium +=item['cost_basis']
+                if item['sentiment'] == 'Neutral':
+                    neutral_premium +=item['cost_basis']
 
             with open(f"json/options-historical-data/companies/{symbol}.json", "r") as file:
                 past_data = orjson.loads(file.read())[0]
@@ -265,7 +263,7 @@ async def main():
                 os.remove(f"json/options-stats/companies/{symbol}.json")
 
             #End of daily stats
-            flow_data = get_market_flow_data(symbol)
+            flow_data = get_market_flow_data(symbol, ticker_data)
             if flow_data:
                 save_json(flow_data, symbol,"json/market-flow/companies")
             else:
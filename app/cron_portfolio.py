@@ -4,9 +4,10 @@ from urllib.request import urlopen
 import certifi
 import json
 import ujson
+import orjson
+import hashlib
 import schedule
 import time
-import subprocess
 from pocketbase import PocketBase  # Client also works the same
 import asyncio
 import aiohttp
@@ -20,82 +21,171 @@ load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 pb_admin_email = os.getenv('POCKETBASE_ADMIN_EMAIL')
 pb_password = os.getenv('POCKETBASE_PASSWORD')
+# Point at pocketbase_stub_server.py / fmp_stub_server.py to run against local stand-ins
+pb_url = os.getenv('POCKETBASE_URL', 'http://127.0.0.1:8090')
+base_url = os.getenv('FMP_BASE_URL', "https://financialmodelingprep.com")
 
 #berlin_tz = pytz.timezone('Europe/Berlin')
 new_york_tz = pytz.timezone('America/New_York')
-pb = PocketBase('http://127.0.0.1:8090')
-admin_data = pb.admins.auth_with_password(pb_admin_email, pb_password)
 
-# Set the system's timezone to Berlin at the beginning
-subprocess.run(["timedatectl", "set-timezone", "Europe/Berlin"])
+INITIAL_BUDGET = 100000
+# Cash and share count per portfolio after the first `trades` transactions of its history
+LEDGER_PATH = "json/portfolio/cache/ledger.json"
+BATCH_SIZE = 50  # PocketBase default of batch.maxRequests
+
+
+def connect_pocketbase():
+    pb = PocketBase(pb_url)
+    pb.collection('_superusers').auth_with_password(pb_admin_email, pb_password)
+    return pb
 
 async def get_quote_of_stocks(ticker_list):
     ticker_str = ','.join(ticker_list)
     async with aiohttp.ClientSession() as session:
-        url = f"https://financialmodelingprep.com/api/v3/quote/{ticker_str}?apikey={api_key}" 
+        url = f"{base_url}/api/v3/quote/{ticker_str}?apikey={api_key}"
         async with session.get(url) as response:
             df = await response.json()
     return df
 
-def check_number_of_shares(holdings, trading_history):
-    # Create a dictionary to track the current number of shares for each symbol
-    share_count = {}
-    # Update share count based on history
-    for transaction in trading_history:
+def load_ledger():
+    try:
+        with open(LEDGER_PATH, 'rb') as file:
+            return orjson.loads(file.read())
+    except:
+        return {}
+
+def save_ledger(ledger):
+    os.makedirs(os.path.dirname(LEDGER_PATH), exist_ok=True)
+    with open(f"{LEDGER_PATH}.tmp", 'wb') as file:
+        file.write(orjson.dumps(ledger))
+    os.replace(f"{LEDGER_PATH}.tmp", LEDGER_PATH)
+
+def transaction_hash(transaction):
+    return hashlib.blake2b(orjson.dumps(transaction, option=orjson.OPT_SORT_KEYS), digest_size=16).hexdigest()
+
+def update_ledger(entry, trading_history):
+    """
+    Apply the transactions after entry['trades'] to the cash and share count.
+    The history is append only, only the last applied transaction is checked
+    and the ledger is rebuilt from the start when it changed (history reset).
+    """
+    trades = entry.get('trades', 0) if entry else 0
+    if trades == 0 or trades > len(trading_history) or transaction_hash(trading_history[trades - 1]) != entry.get('last'):
+        entry = {'trades': 0, 'last': None, 'cash': INITIAL_BUDGET, 'shares': {}}
+        trades = 0
+
+    cash = entry['cash']
+    shares = entry['shares']
+    for transaction in trading_history[trades:]:
         symbol = transaction["symbol"]
         num_shares = transaction["numberOfShares"]
         if transaction["type"] == "buy":
-            # Increment the share count for the symbol
-            share_count[symbol] = share_count.get(symbol, 0) + num_shares
+            cash -= num_shares * transaction["price"]
+            shares[symbol] = shares.get(symbol, 0) + num_shares
         elif transaction["type"] == "sell":
-            # Decrement the share count for the symbol
-            share_count[symbol] = share_count.get(symbol, 0) - num_shares
-
-    # Update the holdings list based on the share count
-    for holding in holdings:
-        symbol = holding["symbol"]
-        if symbol in share_count:
-            holding["numberOfShares"] = share_count[symbol]
-
-    return holdings
-
-def compute_available_cash(transactions):
-    available_cash = 100000  # Initial available cash
-    for transaction in transactions:
-        if transaction['type'] == 'buy':
-            shares_bought = transaction['numberOfShares']
-            price_per_share = transaction['price']
-            total_cost = shares_bought * price_per_share
-            available_cash -= total_cost
-        elif transaction['type'] == 'sell':
-            shares_sold = transaction['numberOfShares']
-            price_per_share = transaction['price']
-            total_gain = shares_sold * price_per_share
-            available_cash += total_gain
-
-    return available_cash
-
-
-def compute_overall_return(initial_budget, transactions):
-    current_budget = initial_budget
-
-    for transaction in transactions:
-        if transaction["type"] == "buy":
-            current_budget -= transaction["numberOfShares"] * transaction["price"]
-        elif transaction["type"] == "sell":
-            current_budget += transaction["numberOfShares"] * transaction["price"]
-
-    overall_return = (current_budget - initial_budget) / initial_budget * 100
-    #print('overall return: ', overall_return)
-    return overall_return
+            cash += num_shares * transaction["price"]
+            shares[symbol] = shares.get(symbol, 0) - num_shares
+
+    if len(trading_history) > trades:
+        entry['trades'] = len(trading_history)
+        entry['last'] = transaction_hash(trading_history[-1])
+    entry['cash'] = cash
+    return entry
+
+
+def value_portfolios(portfolios, ledger, quote_data_dict):
+    """
+    Value every portfolio against one quote map. Returns {id: fields to write}
+    with accountValue, overallReturn, availableCash (and holdings), in the
+    order of `portfolios`.
+    """
+    results = {}
+    rows = []  # (portfolio position, holding) of every holding with a quote
+    cash = np.zeros(len(portfolios))
+    for pos, x in enumerate(portfolios):
+        entry = ledger[x.id]
+        cash[pos] = entry['cash']
+        if len(x.holdings) != 0:
+            for item in x.holdings:
+                # Share count from the ledger to avoid bugs
+                if item['symbol'] in entry['shares']:
+                    item['numberOfShares'] = entry['shares'][item['symbol']]
+                if item['symbol'] in quote_data_dict:
+                    rows.append((pos, item))
+
+    positions = np.array([pos for pos, _ in rows], dtype=np.int64)
+    prices = np.array([quote_data_dict[item['symbol']]['price'] for _, item in rows], dtype=float)
+    number_of_shares = np.array([item['numberOfShares'] for _, item in rows], dtype=float)
+    bought_prices = np.array([item['boughtPrice'] for _, item in rows], dtype=float)
+
+    # np.add.at adds in row order, the same sum as holding by holding
+    account_values = cash.copy()
+    np.add.at(account_values, positions, prices * number_of_shares)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        since_bought_change = (prices / bought_prices - 1) * 100
+    invalid = set(positions[~np.isfinite(since_bought_change)].tolist())
+
+    for (pos, item), current_price, change in zip(rows, prices.tolist(), since_bought_change.tolist()):
+        item['currentPrice'] = current_price
+        item['sinceBoughtChange'] = round(change, 2)
+
+    for pos, x in enumerate(portfolios):
+        if pos in invalid:
+            print(f"Skipping portfolio {x.id}: holding with a zero bought price")
+            continue
+        account_value = float(account_values[pos])
+        available_cash = float(cash[pos])
+        if len(x.holdings) != 0:
+            results[x.id] = {
+                "accountValue": account_value,
+                "overallReturn": round((account_value / INITIAL_BUDGET - 1) * 100, 2),
+                "availableCash": available_cash,
+                "holdings": x.holdings,
+            }
+        else:
+            overall_return = (available_cash - INITIAL_BUDGET) / INITIAL_BUDGET * 100
+            account_value = round(INITIAL_BUDGET * (1 + overall_return / 100), 2)
+            results[x.id] = {
+                "accountValue": account_value,
+                "overallReturn": overall_return,
+                "availableCash": account_value,
+            }
+    return results
+
+
+def rank_portfolios(results):
+    # Highest overall return first, ties keep the portfolio order
+    ids = list(results)
+    returns = np.array([results[portfolio_id]['overallReturn'] for portfolio_id in ids], dtype=float)
+    for rank, idx in enumerate(np.argsort(-returns, kind='stable')):
+        results[ids[idx]]['rank'] = rank + 1
+    return results
+
+
+def write_portfolios(pb, results):
+    # One batch request per BATCH_SIZE portfolios, a failed batch (batch api
+    # disabled or a rejected record) falls back to single updates
+    items = list(results.items())
+    for start in range(0, len(items), BATCH_SIZE):
+        chunk = items[start:start + BATCH_SIZE]
+        try:
+            batch = pb.create_batch()
+            for portfolio_id, fields in chunk:
+                batch.collection("portfolios").update(portfolio_id, fields)
+            batch.send()
+        except Exception as e:
+            print(f"Batch update failed, updating one by one: {e}")
+            for portfolio_id, fields in chunk:
+                try:
+                    pb.collection("portfolios").update(portfolio_id, fields)
+                except Exception as e:
+                    print(e)
 
 
 async def update_portfolio():
     current_time = datetime.now(new_york_tz)
     current_weekday = current_time.weekday()
 
-    initial_budget = 100000
-
     opening_hour = 9
     opening_minute = 30
     closing_hour = 17
@@ -109,81 +199,31 @@ async def update_portfolio():
         # Format it as a string if needed
         formatted_date = beginning_of_month.strftime("%Y-%m-%d")
 
+        pb = connect_pocketbase()
         result =  pb.collection("portfolios").get_full_list(query_params = {"filter": f'created >= "{formatted_date}"'})
+        # Portfolios without trades are left untouched
+        result = [x for x in result if len(x.trading_history) > 0]
 
-        ranking_list = []
-        ticker_list = []
         if len(result) != 0:
-            #get all tickers from all portfolios
-            for port in result:
-                if len(port.holdings) != 0:
-                    ticker_list += [i['symbol'] for i in port.holdings]
-            ticker_list = list(set(ticker_list))
-            #unique ticker_list
-            data = await get_quote_of_stocks(ticker_list)
             #Get all quotes in bulks to save api calls
-            
+            ticker_list = list(set(i['symbol'] for port in result for i in port.holdings))
+            data = await get_quote_of_stocks(ticker_list) if ticker_list else []
+            quote_data_dict = {dd['symbol']: dd for dd in data}
+
+            ledger = load_ledger()
             for x in result:
-                if len(x.trading_history) > 0:
-                    try:
-                        if len(x.holdings) != 0:
-
-                            #compute the correct available cash to avoid bugs
-                            x.available_cash = compute_available_cash(x.trading_history)
-
-                            account_value = x.available_cash
-                            quote_data_dict = {dd['symbol']: dd for dd in data}
-                            #compute the correct number of shares to avoid bugs
-                            x.holdings = check_number_of_shares(x.holdings, x.trading_history)
-                            
-                            for item in x.holdings:
-                                dd = quote_data_dict.get(item['symbol'])
-                                if dd:
-                                    current_price = dd['price']
-                                    since_bought_change = round((current_price/ item['boughtPrice']  - 1) * 100, 2)
-                                    account_value += current_price * item['numberOfShares']
-
-                                    # Update holdings_list
-                                    item['currentPrice'] = current_price
-                                    item['sinceBoughtChange'] = since_bought_change
-
-                            overall_return = round( ( account_value/initial_budget -1) * 100 ,2)
-                            #Update Pocketbase with new values
-
-                            pb.collection("portfolios").update(x.id, {
-                              "accountValue": account_value,
-                              "overallReturn": overall_return,
-                              "availableCash": x.available_cash,
-                              "holdings": x.holdings,
-                            })
-                        else:
-                            #overall_return = x.overall_return
-                            overall_return = compute_overall_return(initial_budget, x.trading_history)
-                            account_value = round(initial_budget*(1+overall_return/100),2)
-                            available_cash = account_value
-
-                            pb.collection("portfolios").update(x.id, {
-                              "accountValue": account_value,
-                              "overallReturn": overall_return,
-                              "availableCash": available_cash,
-                            })
-                        
-                        ranking_list.append({'userId': x.id, 'overallReturn': overall_return})
-
-                    except Exception as e:
-                        print(e)
-                else:
-                    pass
-
-            #Apply ranking to each user
-            sorted_ranking_list = sorted(ranking_list, key=lambda x: x['overallReturn'], reverse=True)
-            for rank, item in enumerate(sorted_ranking_list):
-                pb.collection("portfolios").update(item['userId'], {
-                      "rank": rank+1,
-                    })
-            print('Done')
-        else:
-            print('Market Closed')
+                ledger[x.id] = update_ledger(ledger.get(x.id), x.trading_history)
+            # Drop portfolios outside of the current month
+            ledger = {x.id: ledger[x.id] for x in result}
+            save_ledger(ledger)
+
+            results = rank_portfolios(value_portfolios(result, ledger, quote_data_dict))
+            write_portfolios(pb, results)
+            print(f"Updated {len(results)} portfolios")
+        print('Done')
+    else:
+        print('Market Closed')
 
 
-asyncio.run(update_portfolio())
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(update_portfolio())
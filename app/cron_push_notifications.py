@@ -4,8 +4,9 @@ from urllib.request import urlopen
 import json
 from pocketbase import PocketBase  # Client also works the same
 import asyncio
-import pytz
-import requests
+import aiohttp
+import time
+from collections import defaultdict
 import hashlib
 import orjson
 import sqlite3
@@ -50,6 +51,9 @@ with sqlite3.connect('etf.db') as etf_con:
 
 index_symbols =["^SPX","^VIX"]
 
+stocks_symbols_set = set(stocks_symbols)
+etf_symbols_set = set(etf_symbols)
+
 
 def generate_unique_id(date, text):
     # Concatenate the title and date to form a string
@@ -75,7 +79,126 @@ def format_number(num, decimal=False):
             return f"{num / 1_000_000:,.2f}M"
         return f"{num:,.0f}"  # Format smaller numbers with commas
 
-async def push_notification(title, text, user_id):
+MAX_CONCURRENT_CREATES = 10
+MAX_CONCURRENT_PUSHES = 20
+BOT_USER_ID = '9ncz4wunmhk0k52' #stocknear bot id
+
+# notificationChannels flag -> notifyType of the events it subscribes to
+CHANNEL_TYPES = {
+    'wiim': 'wiim',
+    'earnings_surprise': 'earningsSurprise',
+    'top_analyst': 'topAnalyst',
+}
+
+
+def get_asset_type(symbol):
+    if symbol in stocks_symbols_set:
+        return 'stock'
+    elif symbol in etf_symbols_set:
+        return 'etf'
+    else:
+        return 'index'
+
+
+def get_wiim_events(symbol):
+    """Latest WIIM news of today for a symbol."""
+    with open(f"json/wiim/company/{symbol}.json","r") as file:
+        data = orjson.loads(file.read())[0]
+        date_string = datetime.strptime(data['date'], "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
+    if date_string != today:
+        return []
+    return [{
+        'notifyType': 'wiim',
+        'pushHash': generate_unique_id(date_string, data['text']),
+        'liveResults': {'symbol': symbol, 'assetType': get_asset_type(symbol)},
+        'title': f'Why Priced Moved for {symbol}',
+        'text': data['text'],
+    }]
+
+
+def get_earnings_events(symbol):
+    """Earnings release of today for a symbol."""
+    with open(f"json/earnings/surprise/{symbol}.json","r") as file:
+        data = orjson.loads(file.read())
+    if data['revenue'] == None or data['eps'] == None or data['date'] != today:
+        return []
+    sorted_data = json.dumps(data, sort_keys=True)
+    return [{
+        'notifyType': 'earningsSurprise',
+        'pushHash': hashlib.md5(sorted_data.encode()).hexdigest(),
+        'liveResults': {'symbol': symbol, 'assetType': get_asset_type(symbol)},
+        'title': f'Earnings release for {symbol}',
+        'text': f"Revenue of {format_number(data['revenue'])} and EPS of {data['eps']}",
+    }]
+
+
+def get_top_analyst_events(symbol):
+    """New ratings of today from top analysts (score >= 4) for a symbol."""
+    with open(f"json/analyst/history/{symbol}.json","r") as file:
+        data = orjson.loads(file.read())
+        data = [item for item in data if item['analystScore'] >=4 and item['date'] == today and item['rating_current'] != None and item['adjusted_pt_current'] != None]
+
+    events = []
+    for item in data:
+        sorted_data = json.dumps(item, sort_keys=True)
+        events.append({
+            'notifyType': 'topAnalyst',
+            'pushHash': hashlib.md5(sorted_data.encode()).hexdigest(),
+            'liveResults': {'symbol': symbol, 'assetType': 'stock', 'analyst': item['analyst'], 'rating_current': item['rating_current'], 'adjusted_pt_current': item['adjusted_pt_current']},
+            'title': f'New Top Analyst Rating for {symbol}',
+            'text': f"The rating company {item['analyst']} has issued a new rating of „{item['rating_current']}“ with an updated price target of ${item['adjusted_pt_current']}.",
+        })
+    return events
+
+
+def get_symbol_events(symbols):
+    """
+    Compute what happened today once per symbol instead of once per user.
+    """
+    events = {}
+    for symbol in symbols:
+        symbol_events = []
+        for get_events in (get_wiim_events, get_earnings_events, get_top_analyst_events):
+            try:
+                symbol_events += get_events(symbol)
+            except:
+                pass
+        if symbol_events:
+            events[symbol] = symbol_events
+    return events
+
+
+def load_subscriptions():
+    """
+    Load channel settings, watchlists, push subscriptions and the recent push hashes in bulk.
+    """
+    # user -> enabled notifyTypes (a user with several channel records gets the union)
+    user_types = defaultdict(set)
+    for channel in pb.collection('notificationChannels').get_full_list():
+        for flag, notify_type in CHANNEL_TYPES.items():
+            if getattr(channel, flag, False) == True:
+                user_types[channel.user].add(notify_type)
+
+    # symbol -> users watching it, only for users with at least one channel enabled
+    symbol_users = defaultdict(set)
+    for watchlist in pb.collection("watchlist").get_full_list():
+        if watchlist.user in user_types:
+            for symbol in watchlist.ticker or []:
+                symbol_users[symbol].add(watchlist.user)
+
+    subscribed_users = {item.user for item in pb.collection("pushSubscription").get_full_list()}
+
+    # Every push hash contains today's date, so notifications from before yesterday can never collide
+    since = (datetime.today() - timedelta(days=2)).strftime('%Y-%m-%d')
+    sent_hashes = {
+        (item.op_user, item.push_hash)
+        for item in pb.collection("notifications").get_full_list(query_params={"filter": f"created >= '{since}' && pushHash != ''"})
+    }
+
+    return user_types, symbol_users, subscribed_users, sent_hashes
+
+
+async def push_notification(session, semaphore, title, text, user_id):
     data = {
         "title": title,
         "body": text,
@@ -84,242 +207,68 @@ async def push_notification(title, text, user_id):
         "key": stocknear_api_key,
     }
 
-    response = requests.post(url, headers=headers, data=json.dumps(data))
+    async with semaphore:
+        async with session.post(url, headers=headers, data=json.dumps(data)) as response:
+            await response.read()
 
 
-async def push_wiim(user_id):
-    """
-    Pushes the latest WIIM news based on users' watchlists.
-
-    Steps:
-    1. Retrieve the watchlist for each user.
-    2. Iterate through the tickers in the watchlist.
-    3. Load the corresponding WIIM file and verify if its creation date matches today's date.
-    4. If the date matches, check if a notification has already been sent using pushHash.
-    5. If no notification has been sent, create and send one.
-    """
-    try:
-        result = pb.collection("watchlist").get_full_list(query_params={"filter": f"user='{user_id}'"})
-        all_tickers = set()
-        for item in result:
-            all_tickers.update(item.ticker)
-        all_tickers = list(all_tickers)
-
-        if all_tickers:
-            for symbol in all_tickers:
-                try:
-                    with open(f"json/wiim/company/{symbol}.json","r") as file:
-                        data = orjson.loads(file.read())[0]
-                        date_string = datetime.strptime(data['date'], "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")
-                    if date_string == today:
-                        unique_id = generate_unique_id(date_string, data['text'])
-                        #check if push notification already exist
-                        all_notification = pb.collection("notifications").get_full_list(query_params={"filter": f"opUser='{user_id}'"})
-                        exist = any(notify_item.push_hash == unique_id for notify_item in all_notification)
-                        
-
-                        if exist == False:
-                            #check if user is subscribed to pushSubscription to receive push notifications
-                            
-                            if symbol in stocks_symbols:
-                                asset_type = 'stock'
-                            elif symbol in etf_symbols:
-                                asset_type = 'etf'
-                            else:
-                                asset_type = 'index'
-
-                            newNotification = {
-                                'opUser': user_id,
-                                'user': '9ncz4wunmhk0k52', #stocknear bot id
-                                'notifyType': 'wiim',
-                                'sent': True,
-                                'pushHash': unique_id,
-                                'liveResults': {'symbol': symbol, 'assetType': asset_type},
-                            }
-
-                            notify_item = pb.collection('notifications').create(newNotification)
-
-                            #if is_pro == True:
-
-                            check_subscription = pb.collection("pushSubscription").get_full_list(query_params={"filter": f"user='{user_id}'"})
-                            user_subscribed = False
-                            for item in check_subscription:
-                                if item.user == user_id:
-                                    user_subscribed = True
-                                    break
-                            if user_subscribed:
-                                await push_notification(f'Why Priced Moved for {symbol}', data['text'], user_id)
-                except:
-                    pass
-    except Exception as e:
-        print(e)
+async def create_notification(semaphore, user_id, event):
+    newNotification = {
+        'opUser': user_id,
+        'user': BOT_USER_ID,
+        'notifyType': event['notifyType'],
+        'sent': True,
+        'pushHash': event['pushHash'],
+        'liveResults': event['liveResults'],
+    }
+    # The PocketBase client is blocking, run it off the event loop
+    async with semaphore:
+        await asyncio.to_thread(pb.collection('notifications').create, newNotification)
 
-async def push_earnings_release(user_id):
-    """
-    Pushes the latest earnings releases based on users' watchlists.
-
-    Steps:
-    1. Retrieve the watchlist for each user.
-    2. Iterate through the tickers in the watchlist.
-    3. Load the corresponding earnings files and verify if its creation date matches today's date.
-    4. If the date matches, check if a notification has already been sent using pushHash.
-    5. If no notification has been sent, create and send one.
-    """
-    try:
-        result = pb.collection("watchlist").get_full_list(query_params={"filter": f"user='{user_id}'"})
-        all_tickers = set()
-        for item in result:
-            all_tickers.update(item.ticker)
-        all_tickers = list(all_tickers)
-
-        if all_tickers:
-            for symbol in all_tickers:
-                try:
-                    with open(f"json/earnings/surprise/{symbol}.json","r") as file:
-                        data = orjson.loads(file.read())
-                        date_string = data['date']
-
-                    if data['revenue'] != None and data['eps'] != None:
-                        if date_string == today:
-                            sorted_data = json.dumps(data, sort_keys=True)
-                            unique_id = hashlib.md5(sorted_data.encode()).hexdigest()
-                            
-                            #check if push notification already exist
-                            all_notification = pb.collection("notifications").get_full_list(query_params={"filter": f"opUser='{user_id}'"})
-                            exist = any(notify_item.push_hash == unique_id for notify_item in all_notification)
-                            
-
-                            if exist == False:
-                                #check if user is subscribed to pushSubscription to receive push notifications
-                                
-                                if symbol in stocks_symbols:
-                                    asset_type = 'stock'
-                                elif symbol in etf_symbols:
-                                    asset_type = 'etf'
-                                else:
-                                    asset_type = 'index'
-
-                                newNotification = {
-                                    'opUser': user_id,
-                                    'user': '9ncz4wunmhk0k52', #stocknear bot id
-                                    'notifyType': 'earningsSurprise',
-                                    'sent': True,
-                                    'pushHash': unique_id,
-                                    'liveResults': {'symbol': symbol, 'assetType': asset_type},
-                                }
-
-                                notify_item = pb.collection('notifications').create(newNotification)
-
-                                #if is_pro == True:
-
-                                check_subscription = pb.collection("pushSubscription").get_full_list(query_params={"filter": f"user='{user_id}'"})
-                                user_subscribed = False
-                                for item in check_subscription:
-                                    if item.user == user_id:
-                                        user_subscribed = True
-                                        break
-                                if user_subscribed:
-                                    title = f'Earnings release for {symbol}'
-                                    text = f"Revenue of {format_number(data['revenue'])} and EPS of {data['eps']}"
-                                    await push_notification(title, text, user_id)
-                except:
-                    pass
-    except Exception as e:
-        print(e)
 
-async def push_top_analyst(user_id):
-    """
-    Pushes the latest earnings releases based on users' watchlists.
-
-    Steps:
-    1. Retrieve the watchlist for each user.
-    2. Iterate through the tickers in the watchlist.
-    3. Load the corresponding top analyst ratings files and verify if its creation date matches today's date.
-    4. If the date matches, check if a notification has already been sent using pushHash.
-    5. If no notification has been sent, create and send one.
-    """
+async def deliver(session, create_semaphore, push_semaphore, user_id, event, is_subscribed, stats):
     try:
-        result = pb.collection("watchlist").get_full_list(query_params={"filter": f"user='{user_id}'"})
-        all_tickers = set()
-        for item in result:
-            all_tickers.update(item.ticker)
-        all_tickers = list(all_tickers)
-        if all_tickers:
-            for symbol in all_tickers:
-                try:
-                    with open(f"json/analyst/history/{symbol}.json","r") as file:
-                        data = orjson.loads(file.read())
-                        data = [item for item in data if item['analystScore'] >=4 and item['date'] == today and item['rating_current'] != None and item['adjusted_pt_current'] != None]
-
-                    for item in data:
-                        try:
-                            sorted_data = json.dumps(item, sort_keys=True)
-                            unique_id = hashlib.md5(sorted_data.encode()).hexdigest()
-                            
-                            #check if push notification already exist
-                            all_notification = pb.collection("notifications").get_full_list(query_params={"filter": f"opUser='{user_id}'"})
-                            exist = any(notify_item.push_hash == unique_id for notify_item in all_notification)
-                            
-
-                            if exist == False:
-                                #check if user is subscribed to pushSubscription to receive push notifications
-                                asset_type = 'stock'
-                             
-                                newNotification = {
-                                    'opUser': user_id,
-                                    'user': '9ncz4wunmhk0k52', #stocknear bot id
-                                    'notifyType': 'topAnalyst',
-                                    'sent': True,
-                                    'pushHash': unique_id,
-                                    'liveResults': {'symbol': symbol, 'assetType': asset_type, 'analyst': item['analyst'], 'rating_current': item['rating_current'], 'adjusted_pt_current': item['adjusted_pt_current']},
-                                }
-
-                                notify_item = pb.collection('notifications').create(newNotification)
-
-                                #if is_pro == True:
-
-                                check_subscription = pb.collection("pushSubscription").get_full_list(query_params={"filter": f"user='{user_id}'"})
-                                user_subscribed = False
-                                for sub in check_subscription:
-                                    if sub.user == user_id:
-                                        user_subscribed = True
-                                        break
-                                if user_subscribed:
-                                    title = f'New Top Analyst Rating for {symbol}'
-                                    text = f"The rating company {item['analyst']} has issued a new rating of „{item['rating_current']}“ with an updated price target of ${item['adjusted_pt_current']}."
-                                    await push_notification(title, text, user_id)
-                        except Exception as e:
-                            print(e)
-                except:
-                    pass
+        await create_notification(create_semaphore, user_id, event)
+        stats['created'] += 1
+        if is_subscribed:
+            await push_notification(session, push_semaphore, event['title'], event['text'], user_id)
+            stats['pushed'] += 1
     except Exception as e:
+        stats['failed'] += 1
         print(e)
 
 
 async def run():
-    all_users = pb.collection("users").get_full_list()
-    for item in tqdm(all_users):
-        try:
-            user_id = item.id
-            #is_pro = True if item.tier == 'Pro' else False
-            result = pb.collection('notificationChannels').get_list(query_params={"filter": f"user='{user_id}'"})
-            channels = result.items
-            for channel in channels:
-
-                if channel.wiim == True:     
-                    await push_wiim(user_id=user_id)
-
-                if channel.earnings_surprise == True:
-                    await push_earnings_release(user_id=user_id)
-
-                if channel.top_analyst == True:
-                    await push_top_analyst(user_id=user_id)
-        
-        except Exception as e:
-            print(e)
-       
-
-try:
-    asyncio.run(run())
-except Exception as e:
-    print(e)
\ No newline at end of file
+    start_time = time.time()
+    user_types, symbol_users, subscribed_users, sent_hashes = load_subscriptions()
+    symbol_events = get_symbol_events(symbol_users.keys())
+
+    # Join symbol -> events with symbol -> users in memory
+    deliveries = []
+    for symbol, events in symbol_events.items():
+        for event in events:
+            for user_id in symbol_users[symbol]:
+                key = (user_id, event['pushHash'])
+                if event['notifyType'] in user_types[user_id] and key not in sent_hashes:
+                    sent_hashes.add(key)
+                    deliveries.append((user_id, event))
+
+    stats = {'created': 0, 'pushed': 0, 'failed': 0}
+    create_semaphore = asyncio.Semaphore(MAX_CONCURRENT_CREATES)
+    push_semaphore = asyncio.Semaphore(MAX_CONCURRENT_PUSHES)
+
+    async with aiohttp.ClientSession() as session:
+        tasks = [deliver(session, create_semaphore, push_semaphore, user_id, event, user_id in subscribed_users, stats) for user_id, event in deliveries]
+        for task in tqdm(asyncio.as_completed(tasks), total=len(tasks)):
+            await task
+
+    elapsed = time.time() - start_time
+    print(f"Symbols with events: {len(symbol_events)}, watched symbols: {len(symbol_users)}, users: {len(user_types)}")
+    print(f"Fan-out: {stats['created']} notifications, {stats['pushed']} pushes, {stats['failed']} failed in {elapsed:.2f}s ({len(deliveries) / elapsed if elapsed > 0 else 0:.1f} deliveries/s)")
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        print(e)
\ No newline at end of file
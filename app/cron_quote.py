@@ -12,6 +12,10 @@ api_key = os.getenv('FMP_API_KEY')
 
 ny_timezone = pytz.timezone("America/New_York")
 
+# All regular quotes of the last run in one file, so jobs that need many
+# quotes at once (e.g. the ETF holding lists) read one file instead of thousands
+QUOTE_SNAPSHOT_PATH = "json/quote-snapshot/data.json"
+
 
 # Function to delete all files in a directory
 def delete_files_in_directory(directory):
@@ -59,6 +63,18 @@ async def save_quote_as_json(symbol, data):
     with open(f"json/quote/{symbol}.json", 'w') as file:
         file.write(orjson.dumps(data).decode())
 
+def save_quote_snapshot(quotes):
+    try:
+        with open(QUOTE_SNAPSHOT_PATH, 'rb') as file:
+            snapshot = orjson.loads(file.read())
+    except Exception:
+        snapshot = {}
+    snapshot.update(quotes)
+    os.makedirs(os.path.dirname(QUOTE_SNAPSHOT_PATH), exist_ok=True)
+    with open(f"{QUOTE_SNAPSHOT_PATH}.tmp", 'wb') as file:
+        file.write(orjson.dumps(snapshot))
+    os.replace(f"{QUOTE_SNAPSHOT_PATH}.tmp", QUOTE_SNAPSHOT_PATH)
+
 async def save_pre_post_quote_as_json(symbol, data):
     try:
         with open(f"json/quote/{symbol}.json", 'r') as file:
@@ -136,12 +152,14 @@ async def run():
     chunk_size = len(total_symbols) // 20  # Divide the list into N chunks
     chunks = [total_symbols[i:i + chunk_size] for i in range(0, len(total_symbols), chunk_size)]
     delete_files_in_directory("json/pre-post-quote")
+    snapshot_quotes = {}
     for chunk in chunks:
         if is_market_closed == False:
             latest_quote = await get_quote_of_stocks(chunk)
             for item in latest_quote:
                 symbol = item['symbol']
                 await save_quote_as_json(symbol, item)
+                snapshot_quotes[symbol] = item
                 #print(f"Saved data for {symbol}.")
 
         if is_market_closed == True:
@@ -156,6 +174,9 @@ async def run():
             symbol = item['symbol']
             await save_bid_ask_as_json(symbol, item)
 
+    if snapshot_quotes:
+        save_quote_snapshot(snapshot_quotes)
+
 try:
     asyncio.run(run())
 except Exception as e:
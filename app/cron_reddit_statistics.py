@@ -1,5 +1,6 @@
 import json
 import re
+import hashlib
 import requests
 import praw
 from datetime import datetime, timedelta
@@ -30,6 +31,9 @@ etf_cursor.execute("SELECT DISTINCT symbol FROM etfs")
 etf_symbols = [row[0] for row in etf_cursor.fetchall()]
 
 total_symbols = stock_symbols + etf_symbols
+stock_symbols_set = set(stock_symbols)
+etf_symbols_set = set(etf_symbols)
+total_symbols_set = set(total_symbols)
 con.close()
 etf_con.close()
 
@@ -50,70 +54,143 @@ def save_data(data, filename):
     with open(f'json/reddit-tracker/wallstreetbets/{filename}', 'w', encoding='utf-8') as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
 
+# Compile regex patterns for finding tickers, PUT, and CALL
+ticker_pattern = re.compile(r'\$([A-Z]+)')
+put_pattern = re.compile(r'\b(PUT|PUTS)\b', re.IGNORECASE)
+call_pattern = re.compile(r'\b(CALL|CALLS)\b', re.IGNORECASE)
+
+index_path = 'json/reddit-tracker/wallstreetbets/mention-index.json'
+
+def load_index():
+    try:
+        with open(index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except:
+        return {'posts': {}, 'days': {}}
+
+def save_index(index):
+    with open(index_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+
+def extract_mentions(post):
+    """
+    Mentions of a single post as {ticker: [total, put, call, sentiment]}.
+    """
+    # Find ticker mentions in title and selftext
+    text_to_search = post['title'] + ' ' + post['selftext']
+    tickers = ticker_pattern.findall(text_to_search)
+    if not tickers:
+        return {}
+
+    # Check for PUT and CALL mentions
+    put_mentions = len(put_pattern.findall(text_to_search))
+    call_mentions = len(call_pattern.findall(text_to_search))
+
+    # Perform sentiment analysis
+    sentiment = sia.polarity_scores(text_to_search)['compound']
+
+    mentions = {}
+    for ticker in tickers:
+        entry = mentions.setdefault(ticker, [0, 0, 0, sentiment])
+        entry[0] += 1
+        entry[1] += put_mentions
+        entry[2] += call_mentions
+    return mentions
+
+def post_fingerprint(post):
+    return hashlib.md5((post['title'] + ' ' + post['selftext']).encode('utf-8')).hexdigest()
+
+def update_index(index, data):
+    """
+    Apply only the new, edited or removed posts to the mention index and
+    return the set of days whose counters have to be rebuilt.
+    """
+    posts = index['posts']
+    dirty_days = set()
+    seen = set()
+
+    for post in data:
+        post_id = post['id']
+        seen.add(post_id)
+        fingerprint = post_fingerprint(post)
+        entry = posts.get(post_id)
+
+        if entry and entry['hash'] == fingerprint:
+            # Same text, only the comment count can have changed
+            if entry['num_comments'] != post['num_comments']:
+                entry['num_comments'] = post['num_comments']
+                dirty_days.add(entry['date'])
+            continue
+
+        if entry:
+            dirty_days.add(entry['date'])
+
+        # Convert UTC timestamp to date
+        post_date = datetime.utcfromtimestamp(post['created_utc']).date().isoformat()
+        posts[post_id] = {
+            'date': post_date,
+            'hash': fingerprint,
+            'num_comments': post['num_comments'],
+            'mentions': extract_mentions(post),
+        }
+        dirty_days.add(post_date)
+
+    # Posts that dropped out of data.json (deleted, too old or too few comments)
+    for post_id in [post_id for post_id in posts if post_id not in seen]:
+        dirty_days.add(posts.pop(post_id)['date'])
+
+    return dirty_days
+
+def rebuild_days(index, dirty_days):
+    # Per-day counters: post count, comments and {ticker: [total, put, call, sentimentSum, sentimentCount]}
+    days = index['days']
+    for day in dirty_days:
+        days.pop(day, None)
+
+    for entry in index['posts'].values():
+        day = entry['date']
+        if day not in dirty_days:
+            continue
+        stats = days.setdefault(day, {'post_count': 0, 'total_comments': 0, 'ticker_mentions': {}})
+        stats['post_count'] += 1
+        stats['total_comments'] += entry['num_comments']
+        for ticker, (total, put, call, sentiment) in entry['mentions'].items():
+            counts = stats['ticker_mentions'].setdefault(ticker, [0, 0, 0, 0.0, 0])
+            counts[0] += total
+            counts[1] += put
+            counts[2] += call
+            # The sentiment of a post is counted once per mention, like the per-mention list it replaces
+            counts[3] += sentiment * total
+            counts[4] += total
+
 def compute_daily_statistics(file_path):
     # Load the data from the JSON file
     with open(file_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
-    
-    # Initialize a defaultdict to store daily statistics
-    daily_stats = defaultdict(lambda: {
-        'post_count': 0, 
-        'total_comments': 0, 
-        'ticker_mentions': defaultdict(lambda: {'total': 0, 'PUT': 0, 'CALL': 0, 'sentiment': []}),
-        'unique_tickers': set()
-    })
-    
-    # Compile regex patterns for finding tickers, PUT, and CALL
-    ticker_pattern = re.compile(r'\$([A-Z]+)')
-    put_pattern = re.compile(r'\b(PUT|PUTS)\b', re.IGNORECASE)
-    call_pattern = re.compile(r'\b(CALL|CALLS)\b', re.IGNORECASE)
-    
-    # Process each post
-    for post in data:
-        # Convert UTC timestamp to datetime object
-        post_date = datetime.utcfromtimestamp(post['created_utc']).date()
-        
-        # Update statistics for this day
-        daily_stats[post_date]['post_count'] += 1
-        daily_stats[post_date]['total_comments'] += post['num_comments']
-        
-        # Find ticker mentions in title and selftext
-        text_to_search = post['title'] + ' ' + post['selftext']
-        tickers = ticker_pattern.findall(text_to_search)
-        
-        # Check for PUT and CALL mentions
-        put_mentions = len(put_pattern.findall(text_to_search))
-        call_mentions = len(call_pattern.findall(text_to_search))
-        
-        # Perform sentiment analysis
-        sentiment_scores = sia.polarity_scores(text_to_search)
-        
-        for ticker in tickers:
-            daily_stats[post_date]['ticker_mentions'][ticker]['total'] += 1
-            daily_stats[post_date]['unique_tickers'].add(ticker)
-            
-            # Add PUT and CALL counts
-            daily_stats[post_date]['ticker_mentions'][ticker]['PUT'] += put_mentions
-            daily_stats[post_date]['ticker_mentions'][ticker]['CALL'] += call_mentions
-            
-            # Add sentiment score
-            daily_stats[post_date]['ticker_mentions'][ticker]['sentiment'].append(sentiment_scores['compound'])
-    
-    # Calculate averages and format the results
+
+    index = load_index()
+    dirty_days = update_index(index, data)
+    rebuild_days(index, dirty_days)
+    save_index(index)
+    print(f"Updated {len(dirty_days)} days of {len(index['days'])}")
+
+    daily_stats = index['days']
+
+    # Format the results
     formatted_stats = []
     for date, stats in sorted(daily_stats.items(), reverse=True):
         formatted_stats.append({
-            'date': date.isoformat(),
+            'date': date,
             'totalPosts': stats['post_count'],
             'totalComments': stats['total_comments'],
-            'totalMentions': sum(mentions['total'] for mentions in stats['ticker_mentions'].values()),
-            'companySpread': len(stats['unique_tickers']),
+            'totalMentions': sum(mentions[0] for mentions in stats['ticker_mentions'].values()),
+            'companySpread': len(stats['ticker_mentions']),
             'tickerMentions': [
                 {
                     'symbol': ticker,
-                    'count': mentions['total'],
-                    'put': mentions['PUT'],
-                    'call': mentions['CALL']
+                    'count': mentions[0],
+                    'put': mentions[1],
+                    'call': mentions[2]
                 }
                 for ticker, mentions in stats['ticker_mentions'].items()
             ]
@@ -121,58 +198,65 @@ def compute_daily_statistics(file_path):
     
     return formatted_stats, daily_stats
 
+def get_quote(symbol, quote_cache):
+    if symbol not in quote_cache:
+        try:
+            with open(f'json/quote/{symbol}.json') as f:
+                data = json.load(f)
+                quote_cache[symbol] = (data['name'], round(data['price'],2), round(data['changesPercentage'],2))
+        except Exception as e:
+            print(e)
+            quote_cache[symbol] = (None, None, None)
+    return quote_cache[symbol]
+
 def compute_trending_tickers(daily_stats):
     today = datetime.now().date()
     period_list = [2,7,30,90]
+    period_keys = {2: 'oneDay', 7: 'oneWeek', 30: 'oneMonth', 90: 'threeMonths'}
     res_dict = {}
+    quote_cache = {}
 
-    for time_period in period_list:
-        res_list = []
+    # Walk the days newest first once and snapshot the running sums at every period boundary
+    days = sorted(
+        (datetime.strptime(date, '%Y-%m-%d').date(), stats) for date, stats in daily_stats.items()
+    )
+    days = [(date, stats) for date, stats in reversed(days) if date <= today]
+
+    trending = defaultdict(lambda: [0, 0, 0, 0.0, 0])
+    position = 0
 
+    for time_period in period_list:
         N_day_ago = today - timedelta(days=time_period)
-        
-        trending = defaultdict(lambda: {'total': 0, 'PUT': 0, 'CALL': 0, 'sentiment': []})
-        
-        for date, stats in daily_stats.items():
-            if N_day_ago <= date <= today:
-                for ticker, counts in stats['ticker_mentions'].items():
-                    trending[ticker]['total'] += counts['total']
-                    trending[ticker]['PUT'] += counts['PUT']
-                    trending[ticker]['CALL'] += counts['CALL']
-                    trending[ticker]['sentiment'].extend(counts['sentiment'])
-        
+
+        while position < len(days) and days[position][0] >= N_day_ago:
+            for ticker, counts in days[position][1]['ticker_mentions'].items():
+                running = trending[ticker]
+                for i in range(5):
+                    running[i] += counts[i]
+            position += 1
+
         res_list = [
             {
                 'symbol': symbol,
-                'count': counts['total'],
-                'put': counts['PUT'],
-                'call': counts['CALL'],
-                'avgSentiment': round(sum(counts['sentiment']) / len(counts['sentiment']),2) if counts['sentiment'] else 0
+                'count': counts[0],
+                'put': counts[1],
+                'call': counts[2],
+                'avgSentiment': round(counts[3] / counts[4],2) if counts[4] else 0
             }
-            for symbol, counts in trending.items() if symbol in total_symbols
+            for symbol, counts in trending.items() if symbol in total_symbols_set
         ]
         res_list.sort(key=lambda x: x['count'], reverse=True)
 
         for item in res_list:
             symbol = item['symbol']
-            try:
-                with open(f'json/quote/{symbol}.json') as f:
-                    data = json.load(f)
-                    name = data['name']
-                    price = round(data['price'],2)
-                    changes_percentage = round(data['changesPercentage'],2)
-            except Exception as e:
-                print(e)
-                name = None
-                price = None
-                changes_percentage = None
-
-            if symbol in stock_symbols:
+            name, price, changes_percentage = get_quote(symbol, quote_cache)
+
+            if symbol in stock_symbols_set:
                 item['assetType'] = 'stocks'
                 item['name'] = name
                 item['price'] = price
                 item['changesPercentage'] = changes_percentage
-            elif symbol in etf_symbols:
+            elif symbol in etf_symbols_set:
                 item['assetType'] = 'etf'
                 item['name'] = name
                 item['price'] = price
@@ -180,14 +264,7 @@ def compute_trending_tickers(daily_stats):
             else:
                 item['assetType'] = ''
 
-        if time_period == 2:
-            res_dict['oneDay'] = res_list
-        elif time_period == 7:
-            res_dict['oneWeek'] = res_list
-        elif time_period == 30:
-            res_dict['oneMonth'] = res_list
-        elif time_period == 90:
-            res_dict['threeMonths'] = res_list
+        res_dict[period_keys[time_period]] = res_list
     return res_dict
 
 # Usage
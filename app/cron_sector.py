@@ -10,6 +10,11 @@ from collections import defaultdict  # Import defaultdict
 load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 
+# Daily sector performance rows by date, past dates never change
+CACHE_PATH = "json/sector/cache/performance.json"
+# The newest cached days are fetched again in case FMP revised them
+SETTLE_DAYS = 3
+
 
 def get_sector_path(sector):
     sector_paths = {
@@ -40,40 +45,63 @@ async def get_data(session, start_date, end_date):
         data = await response.json()
         return data
 
+def load_cache():
+    try:
+        with open(CACHE_PATH, 'r') as file:
+            return ujson.load(file)
+    except:
+        return {}
+
+def save_cache(cache):
+    os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+    with open(f"{CACHE_PATH}.tmp", 'w') as file:
+        ujson.dump(cache, file)
+    os.replace(f"{CACHE_PATH}.tmp", CACHE_PATH)
+
+def get_windows(start_date, end_date):
+    # 30 day windows from start_date to end_date
+    windows = []
+    while start_date <= end_date:
+        window_end = min(start_date + timedelta(days=30), end_date)
+        windows.append((start_date.strftime('%Y-%m-%d'), window_end.strftime('%Y-%m-%d')))
+        start_date = window_end + timedelta(days=1)
+    return windows
+
 # Main function to manage the date iteration and API calls
 async def run():
     sector_data = defaultdict(list)
-    start_date = datetime.now() - timedelta(days=180)
     today = datetime.now()
+    window_start = (today - timedelta(days=180)).strftime('%Y-%m-%d')
+
+    # Only the days after the cached ones are requested, all windows at once
+    cache = {date: item for date, item in load_cache().items() if date >= window_start}
+    if cache:
+        start_date = datetime.strptime(max(cache), '%Y-%m-%d') - timedelta(days=SETTLE_DAYS)
+    else:
+        start_date = today - timedelta(days=180)
 
     async with aiohttp.ClientSession() as session:
-        while start_date <= today:
-            # Calculate the next end_date, ensuring it doesn't go beyond today
-            end_date = min(start_date + timedelta(days=30), today)
-
-            start_str = start_date.strftime('%Y-%m-%d')
-            end_str = end_date.strftime('%Y-%m-%d')
-
-            data = await get_data(session, start_str, end_str)
-            if data:
-                for item in data:
-                    date = item['date']
-                    for sector_key, sector_value in item.items():
-                        if sector_key == 'date':
-                            continue
-                        sector_name = get_sector_path(sector_key)
-                        if sector_name:
-                            sector_data[sector_name].append({
-                                'date': date,
-                                'changesPercentage': round(sector_value,3)
-                            })
-
-            # Update start_date for the next loop iteration
-            start_date = end_date + timedelta(days=1)
+        results = await asyncio.gather(*[get_data(session, start_str, end_str) for start_str, end_str in get_windows(start_date, today)])
+    for data in results:
+        if isinstance(data, list):
+            for item in data:
+                cache[item['date']] = item
+    save_cache(cache)
+
+    for date in sorted(cache):
+        item = cache[date]
+        for sector_key, sector_value in item.items():
+            if sector_key == 'date':
+                continue
+            sector_name = get_sector_path(sector_key)
+            if sector_name:
+                sector_data[sector_name].append({
+                    'date': date,
+                    'changesPercentage': round(sector_value,3)
+                })
 
     # Save each sector's data as a separate JSON file
     for sector, records in sector_data.items():
-        records = sorted(records, key=lambda x: x['date'])
         await save_json(records, sector)
 
     return sector_data
@@ -2,6 +2,9 @@ from nltk.sentiment.vader import SentimentIntensityAnalyzer
 from textblob import TextBlob
 from tqdm import tqdm
 from datetime import datetime, timedelta
+import concurrent.futures
+import hashlib
+import numpy as np
 import asyncio
 import aiohttp
 import sqlite3
@@ -21,6 +24,9 @@ load_dotenv()
 api_key = os.getenv('FMP_API_KEY')
 sid = SentimentIntensityAnalyzer()
 
+# Scores keyed by a hash of the sentence, shared across runs so each title/text is scored once
+SCORE_CACHE_PATH = "json/sentiment-analysis/cache/scores.json"
+
 
 def convert_symbols(symbol_list):
     """
@@ -91,33 +97,74 @@ def compute_sentiment_score(sentence):
     scaled_score = (sentiment_score + 1) * 5  # Map from [-1, 1] to [0, 10]
     return scaled_score
 
-def get_sentiment(symbol, res_list, is_crypto=False):
+def sentence_key(sentence):
+    return hashlib.blake2b(sentence.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def load_score_cache():
+    try:
+        with open(SCORE_CACHE_PATH, 'r') as file:
+            return ujson.load(file)
+    except:
+        return {}
+
+
+def save_score_cache(score_cache, used_keys):
+    # Only keep the sentences that are still part of a window, so the cache does not grow forever
+    os.makedirs(os.path.dirname(SCORE_CACHE_PATH), exist_ok=True)
+    with open(SCORE_CACHE_PATH, 'w') as file:
+        ujson.dump({key: score_cache[key] for key in used_keys if key in score_cache}, file)
+
+
+def score_sentences(sentences, score_cache, used_keys, executor):
+    """
+    Score every sentence that is not in the cache yet, exactly once, in the process pool.
+    """
+    pending = {}
+    for sentence in sentences:
+        key = sentence_key(sentence)
+        used_keys.add(key)
+        if key not in score_cache:
+            pending[key] = sentence
+    if pending:
+        scores = executor.map(compute_sentiment_score, pending.values(), chunksize=64)
+        score_cache.update(zip(pending.keys(), scores))
+
+
+def get_sentiment(symbol, res_list, score_cache, is_crypto=False):
     if is_crypto == True:
         time_format = '%Y-%m-%dT%H:%M:%S.%fZ'
     else:
         time_format = '%Y-%m-%d %H:%M:%S'
 
     end_date = datetime.now().date()
-    end_date_datetime = datetime.combine(end_date, datetime.min.time())  # Convert end_date to datetime
-    
+
+    # Parse every date once and drop articles dated after today
+    dates, title_scores, text_scores = [], [], []
+    for item in res_list:
+        published = datetime.strptime(item['publishedDate'], time_format).date()
+        if published <= end_date:
+            dates.append(published.toordinal())
+            title_scores.append(score_cache[sentence_key(item['title'])])
+            text_scores.append(score_cache[sentence_key(item['text'])])
+
+    # Newest first, so every window is a prefix and its sum a single cumsum lookup
+    order = np.argsort(dates)[::-1]
+    dates = np.asarray(dates, dtype=np.int64)[order]
+    title_cumsum = np.cumsum(np.asarray(title_scores, dtype=np.float64)[order])
+    text_cumsum = np.cumsum(np.asarray(text_scores, dtype=np.float64)[order])
+
     sentiment_scores_by_period = {}
 
     for time_period, days in {'oneWeek': 10, 'oneMonth': 30, 'threeMonth': 90, 'sixMonth': 180, 'oneYear': 365}.items():
-        start_date = end_date - timedelta(days=days)
-        title_data = [item['title'] for item in res_list if start_date <= datetime.strptime(item['publishedDate'], time_format).date() <= end_date_datetime.date()]
-        text_data = [item['text'] for item in res_list if start_date <= datetime.strptime(item['publishedDate'], time_format).date() <= end_date_datetime.date()]
-        
+        start_date = (end_date - timedelta(days=days)).toordinal()
+        count = int(np.searchsorted(-dates, -start_date, side='right'))
 
-        sentiment_scores_title = [compute_sentiment_score(sentence) for sentence in title_data]
-        if sentiment_scores_title:  # Handle case when sentiment_scores is empty
-            average_sentiment_title_score = round(sum(sentiment_scores_title) / len(sentiment_scores_title))
+        if count > 0:  # Handle case when there are no articles in the window
+            average_sentiment_title_score = round(title_cumsum[count-1] / count)
+            average_sentiment_text_score = round(text_cumsum[count-1] / count)
         else:
             average_sentiment_title_score = 0
-
-        sentiment_scores_text = [compute_sentiment_score(sentence) for sentence in text_data]
-        if sentiment_scores_text:  # Handle case when sentiment_scores is empty
-            average_sentiment_text_score = round(sum(sentiment_scores_text) / len(sentiment_scores_text))
-        else:
             average_sentiment_text_score = 0
 
         sentiment_scores_by_period[time_period] = adjust_scaled_score(round((average_sentiment_title_score+average_sentiment_text_score)/2))
@@ -135,6 +182,27 @@ def get_sentiment(symbol, res_list, is_crypto=False):
             ujson.dump(result, file)
 
 
+def process_news(symbols, res_list, score_cache, used_keys, executor, is_crypto=False):
+    # Group the news by symbol in one pass instead of rescanning res_list per symbol
+    news_by_symbol = {}
+    for item in res_list:
+        news_by_symbol.setdefault(item['symbol'], []).append(item)
+
+    symbol_news = {}
+    for symbol in symbols:
+        symbol_news[symbol] = remove_duplicates(news_by_symbol.get(symbol, []), 'publishedDate')
+
+    sentences = set()
+    for items in symbol_news.values():
+        for item in items:
+            sentences.add(item['title'])
+            sentences.add(item['text'])
+    score_sentences(sentences, score_cache, used_keys, executor)
+
+    for symbol, items in symbol_news.items():
+        get_sentiment(symbol, items, score_cache, is_crypto=is_crypto)
+
+
 async def run():
     con = sqlite3.connect('stocks.db')
     etf_con = sqlite3.connect('etf.db')
@@ -172,10 +240,11 @@ async def run():
 
     crypto_symbols = convert_symbols(crypto_symbols)#The News article has the symbol format BTC-USD
 
-    for symbol in crypto_symbols:
-        filtered_ticker = [item for item in res_list if item['symbol'] == symbol]
-        filtered_ticker = remove_duplicates(filtered_ticker, 'publishedDate')
-        get_sentiment(symbol, filtered_ticker, is_crypto=True)
+    score_cache = load_score_cache()
+    used_keys = set()
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=4)
+
+    process_news(crypto_symbols, res_list, score_cache, used_keys, executor, is_crypto=True)
 
     
     total_symbols = stocks_symbols+etf_symbols
@@ -190,16 +259,16 @@ async def run():
                 break
             else:
                 res_list+=data
-        for symbol in chunk:
-            filtered_ticker = [item for item in res_list if item['symbol'] == symbol]
-            filtered_ticker = remove_duplicates(filtered_ticker, 'publishedDate')
-            get_sentiment(symbol, filtered_ticker, is_crypto=False)
-            
+        process_news(chunk, res_list, score_cache, used_keys, executor, is_crypto=False)
+
+    executor.shutdown()
+    save_score_cache(score_cache, used_keys)
     
 
-try:
-    asyncio.run(run())
-except Exception as e:
-    print(e)
+if __name__ == "__main__":
+    try:
+        asyncio.run(run())
+    except Exception as e:
+        print(e)
 
 
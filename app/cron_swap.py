@@ -1,6 +1,7 @@
 import pandas as pd
 import numpy as np
 import glob
+import io
 import requests
 import os
 import sqlite3
@@ -15,14 +16,26 @@ import shutil
 # Define configuration variables
 OUTPUT_PATH = "./json/swap"
 COMPANIES_PATH = "./json/swap/companies"
+PARTITIONS_PATH = "./json/swap/partitions"
 MAX_WORKERS = 4
 CHUNK_SIZE = 5000  # Adjust based on system RAM
 DAYS_TO_PROCESS = 360
 
 # Ensure directories exist
 # Remove the directory
-shutil.rmtree('json/swap/companies')
+shutil.rmtree('json/swap/companies', ignore_errors=True)
 os.makedirs(COMPANIES_PATH, exist_ok=True)
+os.makedirs(PARTITIONS_PATH, exist_ok=True)
+
+COLUMNS_TO_KEEP = [
+    "Underlying Asset ID", "Underlier ID-Leg 1",
+    "Effective Date", "Notional amount-Leg 1",
+    "Expiration Date", "Total notional quantity-Leg 1",
+    "Dissemination Identifier", "Original Dissemination Identifier",
+    "Dissemintation ID", "Original Dissemintation ID",
+    "Primary Asset Class", "Action Type"
+]
+RECORD_COLUMNS = ["Effective Date", "Notional amount-Leg 1", "Expiration Date", "Total notional quantity-Leg 1"]
 
 
 def get_stock_symbols():
@@ -34,6 +47,7 @@ def get_stock_symbols():
         return total_symbols
 
 stock_symbols = get_stock_symbols()
+stock_symbols_set = set(stock_symbols)
 
 
 # Function to clean and convert to numeric values
@@ -47,149 +61,144 @@ def generate_filenames():
     dates = [start + timedelta(days=i) for i in range((end - start).days + 1)]
     return [f"SEC_CUMULATIVE_EQUITIES_{date.strftime('%Y_%m_%d')}.zip" for date in dates]
 
+
+def partition_path(filename):
+    # SEC_CUMULATIVE_EQUITIES_YYYY_MM_DD.zip -> partitions/YYYY_MM_DD.npz
+    day = "_".join(os.path.splitext(os.path.basename(filename))[0].split('_')[3:])
+    return os.path.join(PARTITIONS_PATH, f"{day}.npz")
+
+
+def filter_chunks(reader):
+    """
+    Reduce the raw report chunks to our symbol set while parsing,
+    so only the matching rows are ever held in memory.
+    """
+    filtered = []
+    for chunk in reader:
+        if chunk.empty:
+            continue
+
+        # Rename columns if necessary
+        if "Dissemination Identifier" not in chunk.columns:
+            chunk.rename(columns={
+                "Dissemintation ID": "Dissemination Identifier",
+                "Original Dissemintation ID": "Original Dissemination Identifier"
+            }, inplace=True)
+
+        # Determine which column to use for filtering
+        filter_column = "Underlying Asset ID" if "Primary Asset Class" in chunk.columns or "Action Type" in chunk.columns else "Underlier ID-Leg 1"
+        symbol = chunk[filter_column].astype(str).str.split('.').str[0]
+        chunk = chunk[symbol.isin(stock_symbols_set)].assign(symbol=symbol)
+
+        if not chunk.empty:
+            filtered.append(chunk.reindex(columns=["symbol"] + RECORD_COLUMNS))
+
+    if not filtered:
+        return pd.DataFrame(columns=["symbol"] + RECORD_COLUMNS)
+    return pd.concat(filtered, ignore_index=True)
+
+
+def save_partition(path, df):
+    """
+    Store one report day as a compact columnar npz partition.
+    """
+    np.savez_compressed(
+        path,
+        symbol=df["symbol"].to_numpy(dtype=str),
+        effective_date=df["Effective Date"].fillna('').to_numpy(dtype=str),
+        notional_amount=clean_and_convert(df["Notional amount-Leg 1"].astype(str)).to_numpy(dtype=np.int64),
+        expiration_date=df["Expiration Date"].fillna('').to_numpy(dtype=str),
+        notional_quantity=clean_and_convert(df["Total notional quantity-Leg 1"].astype(str)).to_numpy(dtype=np.int64),
+    )
+
+
+def load_partition(path):
+    with np.load(path) as data:
+        return pd.DataFrame({
+            "symbol": data["symbol"],
+            "Effective Date": data["effective_date"],
+            "Notional amount-Leg 1": data["notional_amount"],
+            "Expiration Date": data["expiration_date"],
+            "Total notional quantity-Leg 1": data["notional_quantity"],
+        })
+
+
 def download_and_process(filename):
-    csv_output_filename = os.path.join(OUTPUT_PATH, filename.replace('.zip', '.csv'))
-    if os.path.exists(csv_output_filename):
-        print(f"{csv_output_filename} already exists. Skipping.")
+    output_filename = partition_path(filename)
+    if os.path.exists(output_filename):
+        print(f"{output_filename} already exists. Skipping.")
+        return
+
+    # Reports downloaded before the partition layout are converted instead of refetched
+    legacy_csv = os.path.join(OUTPUT_PATH, filename.replace('.zip', '.csv'))
+    if os.path.exists(legacy_csv):
+        reader = pd.read_csv(legacy_csv, chunksize=CHUNK_SIZE, low_memory=False, on_bad_lines="skip", usecols=lambda x: x in COLUMNS_TO_KEEP)
+        save_partition(output_filename, filter_chunks(reader))
+        os.remove(legacy_csv)
+        print(f"Converted {legacy_csv} to {output_filename}")
         return
 
     url = f"https://pddata.dtcc.com/ppd/api/report/cumulative/sec/{filename}"
-    req = requests.get(url)
+    req = requests.get(url, timeout=120)
     if req.status_code != 200:
         print(f"Failed to download {url}")
         return
-    
-    with open(filename, "wb") as f:
-        f.write(req.content)
-    
-    with ZipFile(filename, "r") as zip_ref:
+
+    # Read the csv member straight out of the in-memory zip, nothing is extracted to disk
+    with ZipFile(io.BytesIO(req.content), "r") as zip_ref:
         csv_filename = zip_ref.namelist()[0]
-        zip_ref.extractall()
-    
-    output_filename = os.path.join(OUTPUT_PATH, csv_filename)
-    
-    columns_to_keep = [
-        "Underlying Asset ID", "Underlier ID-Leg 1",
-        "Effective Date", "Notional amount-Leg 1",
-        "Expiration Date", "Total notional quantity-Leg 1",
-        "Dissemination Identifier", "Original Dissemination Identifier",
-        "Dissemintation ID", "Original Dissemintation ID",
-        "Primary Asset Class", "Action Type"
-    ]
-    
-    chunk_list = []
-    for chunk in pd.read_csv(csv_filename, chunksize=CHUNK_SIZE, low_memory=False, on_bad_lines="skip", usecols=lambda x: x in columns_to_keep):
-        # Rename columns if necessary
-        if "Dissemination Identifier" not in chunk.columns:
-            chunk.rename(columns={
-                "Dissemintation ID": "Dissemination Identifier",
-                "Original Dissemintation ID": "Original Dissemination Identifier"
-            }, inplace=True)
-        
-        chunk_list.append(chunk)
-    
-    pd.concat(chunk_list, ignore_index=True).to_csv(output_filename, index=False)
-    
-    os.remove(filename)
-    os.remove(csv_filename)
-    
+        with zip_ref.open(csv_filename) as csv_file:
+            reader = pd.read_csv(csv_file, chunksize=CHUNK_SIZE, low_memory=False, on_bad_lines="skip", usecols=lambda x: x in COLUMNS_TO_KEEP)
+            df = filter_chunks(reader)
+
+    save_partition(output_filename, df)
     print(f"Processed and saved {output_filename}")
 
 
+def group_partition(file):
+    df = load_partition(file)
+    return {symbol: group.drop(columns=['symbol']) for symbol, group in df.groupby('symbol', sort=False)}
+
+
 def process_and_save_by_ticker():
-    csv_files = glob.glob(os.path.join(OUTPUT_PATH, "*.csv"))
-    
-    # Sort CSV files by date (assuming filename format is "SEC_CUMULATIVE_EQUITIES_YYYY_MM_DD.csv")
-    sorted_csv_files = sorted(csv_files, key=lambda x: datetime.strptime("_".join(os.path.splitext(os.path.basename(x))[0].split('_')[3:]), "%Y_%m_%d"), reverse=True)
-    
-    # Select only the N latest files
-    latest_csv_files = sorted_csv_files[:100]
-
-    # Create a set of stock symbols for faster lookup
-    stock_symbols_set = set(stock_symbols)
-    
-    for file in tqdm(latest_csv_files, desc="Processing files"):
-        if not os.path.isfile(file):  # Skip if not a file
-            continue
-        try:
-            # Read the CSV file in chunks
-            for chunk in pd.read_csv(file, chunksize=CHUNK_SIZE, low_memory=False, on_bad_lines="skip"):
-                if chunk.empty:
-                    continue
-                
-                # Rename columns if necessary
-                if "Dissemination Identifier" not in chunk.columns:
-                    chunk.rename(columns={
-                        "Dissemintation ID": "Dissemination Identifier",
-                        "Original Dissemintation ID": "Original Dissemination Identifier"
-                    }, inplace=True)
-                
-                # Determine which column to use for filtering
-                filter_column = "Underlying Asset ID" if "Primary Asset Class" in chunk.columns or "Action Type" in chunk.columns else "Underlier ID-Leg 1"
-                
-                # Extract the symbol from the filter column
-                chunk['symbol'] = chunk[filter_column].str.split('.').str[0]
-                
-                # Filter the chunk to include only rows with symbols in our list
-                filtered_chunk = chunk[chunk['symbol'].isin(stock_symbols_set)]
-                
-                # If the filtered chunk is not empty, process and save it
-                if not filtered_chunk.empty:
-                    columns_to_keep = ["symbol", "Effective Date", "Notional amount-Leg 1", "Expiration Date", "Total notional quantity-Leg 1"]
-                    filtered_chunk = filtered_chunk[columns_to_keep]
-                    
-                    # Convert 'Notional amount-Leg 1' and 'Total notional quantity-Leg 1' to integers
-                    filtered_chunk['Notional amount-Leg 1'] = clean_and_convert(filtered_chunk['Notional amount-Leg 1'])
-                    filtered_chunk['Total notional quantity-Leg 1'] = clean_and_convert(filtered_chunk['Total notional quantity-Leg 1'])
-
-                    # Group by symbol and append to respective files
-                    for symbol, group in filtered_chunk.groupby('symbol'):
-                        output_file = os.path.join(COMPANIES_PATH, f"{symbol}.json")
-                        group = group.drop(columns=['symbol'])
-                        
-                        # Convert DataFrame to list of dictionaries
-                        records = group.to_dict('records')
-                        
-                        if os.path.exists(output_file):
-                            with open(output_file, 'r+') as f:
-                                data = ujson.load(f)
-                                data.extend(records)
-                                f.seek(0)
-                                ujson.dump(data, f)
-                        else:
-                            with open(output_file, 'w') as f:
-                                ujson.dump(records, f)
-        
-        except pd.errors.EmptyDataError:
-            print(f"Skipping empty file: {file}")
-        except Exception as e:
-            print(f"Error processing file {file}: {str(e)}")
-    
-    # Final processing of each symbol's file
-    for symbol in tqdm(stock_symbols, desc="Final processing"):
-        file_path = os.path.join(COMPANIES_PATH, f"{symbol}.json")
-        if os.path.exists(file_path):
+    partition_files = glob.glob(os.path.join(PARTITIONS_PATH, "*.npz"))
+
+    # Partition names are YYYY_MM_DD and sort chronologically, the reverse sort keeps the newest 100 days
+    latest_partition_files = sorted(partition_files, reverse=True)[:100]
+
+    # Load and group the partitions in parallel, each worker returns {symbol: DataFrame}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {executor.submit(group_partition, file): file for file in latest_partition_files}
+        results = {}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Processing files"):
             try:
-                with open(file_path, 'r') as f:
-                    data = ujson.load(f)
-                
-                # Convert to DataFrame for processing
-                df = pd.DataFrame(data)
-                df["Original Dissemination Identifier"] = df["Original Dissemination Identifier"].astype("Int64")
-                df["Dissemination Identifier"] = df["Dissemination Identifier"].astype("Int64")
-                
-                # Convert back to list of dictionaries and save
-                processed_data = df.to_dict('records')
-                with open(file_path, 'w') as f:
-                    ujson.dump(processed_data, f)
-                
-                print(f"Processed and saved data for {symbol}")
+                results[futures[future]] = future.result()
             except Exception as e:
-                print(f"Error processing {symbol}: {str(e)}")
+                print(f"Error processing file {futures[future]}: {str(e)}")
+        # Keep the newest-first file order of the previous per-file appends
+        grouped_partitions = [results[file] for file in latest_partition_files if file in results]
+
+    res_dict = {}
+    for groups in grouped_partitions:
+        for symbol, group in groups.items():
+            res_dict.setdefault(symbol, []).append(group)
+
+    def save_symbol(symbol):
+        records = pd.concat(res_dict[symbol], ignore_index=True).to_dict('records')
+        for item in records:
+            for key in ("Effective Date", "Expiration Date"):
+                if item[key] == '':
+                    item[key] = None
+        with open(os.path.join(COMPANIES_PATH, f"{symbol}.json"), 'w') as f:
+            ujson.dump(records, f)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(tqdm(executor.map(save_symbol, res_dict.keys()), total=len(res_dict), desc="Final processing"))
 
 
 if __name__ == "__main__":
     filenames = generate_filenames()
+    # Bounded parallel downloads, each worker streams one report into its partition
     with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
         list(tqdm(executor.map(download_and_process, filenames), total=len(filenames)))
     process_and_save_by_ticker()
\ No newline at end of file
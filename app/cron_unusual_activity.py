@@ -9,7 +9,9 @@ from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 import re
 import os
+from utils.options_flow_store import connect, get_ticker_flow, group_by_ticker
 
+MIN_PREMIUM = 1E6
 
 
 # Database connection and symbol retrieval
@@ -36,65 +38,53 @@ async def save_json(data, symbol):
         file.write(orjson.dumps(data))
 
 
-async def get_dataset():
+def get_date_range():
+    # Same window as the old 365 daily files: the last year up to yesterday
     today = datetime.today()
-    start_date = today - timedelta(days=365)
-    date_list = [(start_date + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(365)]
+    return (today - timedelta(days=365)).strftime("%Y-%m-%d"), today.strftime("%Y-%m-%d")
 
-    unique_data = {}
-    
-    for date in tqdm(date_list):
-        try:
-            with open(f"json/options-historical-data/flow-data/{date}.json", "r") as file:
-                data = orjson.loads(file.read())
-                data = [item for item in data if item['cost_basis'] >=1E6]
-                for item in data:
-                    if "id" in item:
-                        unique_data[item["id"]] = item  # Store unique items based on "id"
-        except:
-            pass
 
+def get_live_flow():
+    # Today's feed grouped by ticker once, history comes from the flow store
     try:
         with open(f"json/options-flow/feed/data.json", "r") as file:
             data = orjson.loads(file.read())
-            data = [item for item in data if item['cost_basis'] >=1E6]
-            for item in data:
-                if "id" in item:
-                    unique_data[item["id"]] = item
+        return group_by_ticker([item for item in data if "id" in item], min_cost_basis=MIN_PREMIUM)
     except:
-        pass
+        return {}
 
-    all_data = list(unique_data.values())  # Convert back to a list
 
-    return all_data
+def build_activity(symbol, cursor, live_flow, start_date, end_date):
+    # Unique items by "id", the live feed overrides the history
+    unique_data = {item["id"]: item for item in get_ticker_flow(cursor, symbol, start_date, end_date, min_cost_basis=MIN_PREMIUM)}
+    for item in live_flow.get(symbol, []):
+        unique_data[item["id"]] = item
 
+    res_list = []
+    for item in unique_data.values():
+        try:
+            res_list.append({
+                'date': item['date'],
+                'premium': item['cost_basis'],
+                'sentiment': item['sentiment'],
+                'executionEst': item['execution_estimate'],
+                'price': item['underlying_price'],
+                'unusualType': item['option_activity_type'],
+                'size': item['size'],
+                'oi': item['open_interest'],
+                'optionSymbol': item['option_symbol'],
+                'strike': item['strike_price'],
+                'expiry': item['date_expiration'],
+                'optionType': item['put_call'],
+                })
+        except Exception as e:
+                print(e)
 
-async def get_data(symbol, data):
+    return sorted(res_list, key=lambda x: x['date'], reverse=True)
 
-    res_list = []
-    if len(data) > 0:
-        for item in data:
-            try:
-                if item['ticker'] == symbol:
-                    res_list.append({
-                        'date': item['date'],
-                        'premium': item['cost_basis'],
-                        'sentiment': item['sentiment'],
-                        'executionEst': item['execution_estimate'],
-                        'price': item['underlying_price'],
-                        'unusualType': item['option_activity_type'],
-                        'size': item['size'],
-                        'oi': item['open_interest'],
-                        'optionSymbol': item['option_symbol'],
-                        'strike': item['strike_price'],
-                        'expiry': item['date_expiration'],
-                        'optionType': item['put_call'],
-                        })
-            except Exception as e:
-                    print(e)
-
-    res_list = sorted(res_list, key=lambda x: x['date'], reverse=True)
 
+async def get_data(symbol, cursor, live_flow, start_date, end_date):
+    res_list = build_activity(symbol, cursor, live_flow, start_date, end_date)
     if res_list:
         await save_json(res_list, symbol)
 
@@ -102,14 +92,21 @@ async def get_data(symbol, data):
 
 async def main():
     total_symbols = get_total_symbols()
-    data = await get_dataset()
+
+    start_date, end_date = get_date_range()
+
+    live_flow = get_live_flow()
+    con = connect()
+    cursor = con.cursor()
 
     for symbol in tqdm(total_symbols):
         try:
-            await get_data(symbol, data)
+            await get_data(symbol, cursor, live_flow, start_date, end_date)
             
         except Exception as e:
             print(f"Error processing {symbol}: {e}")
+
+    con.close()
     
 if __name__ == "__main__":
     asyncio.run(main())
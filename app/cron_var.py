@@ -1,17 +1,51 @@
-import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 import numpy as np
 import ujson
 import asyncio
 import sqlite3
 import os
+import argparse
+import warnings
+from scipy.stats import norm
 from tqdm import tqdm
 
+START_DATE = "2015-01-01"
+CONFIDENCE_LEVEL = 0.95
+MIN_MONTH_ROWS = 19  # months with fewer bars are not rated
+MAX_MONTH_ROWS = 31
+BLOCK_SIZE = 500
+STATE_PATH = "json/var/cache/state.json"
+
+# Filtered historical simulation: EWMA (RiskMetrics) volatility and the
+# standardized returns of the last FHS_WINDOW days
+EWMA_LAMBDA = 0.94
+FHS_WINDOW = 500
+FHS_WARMUP_DAYS = 800
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compute the VaR history of all stocks, etfs and cryptos.')
+    parser.add_argument('--incremental', action='store_true', help='Only update symbols with new bars since the last run')
+    parser.add_argument('--filtered', action='store_true', help='Also compute filtered historical VaR/CVaR')
+    return parser.parse_args()
+
 async def save_json(symbol, data):
     os.makedirs("json/var", exist_ok=True)  # Ensure directory exists
     with open(f"json/var/{symbol}.json", 'w') as file:
         ujson.dump(data, file)
 
+def load_json(path):
+    try:
+        with open(path, 'r') as file:
+            return ujson.load(file)
+    except:
+        return None
+
+def save_state(state):
+    os.makedirs(os.path.dirname(STATE_PATH), exist_ok=True)
+    with open(STATE_PATH, 'w') as file:
+        ujson.dump(state, file)
+
 # Define risk rating scale
 def assign_risk_rating(var):
     if var >= 25: 
@@ -35,22 +69,133 @@ def assign_risk_rating(var):
     else:
         return 10
 
-def compute_var(df):
-    # Calculate daily returns
-    df['Returns'] = df['close'].pct_change()
-    df = df.dropna()
-    # Calculate VaR at 95% confidence level
-    confidence_level = 0.95
-    var = np.percentile(df['Returns'], 100 * (1 - confidence_level))
-    var_N_days = round(var * np.sqrt(len(df)) * 100, 2)  # N days: the length of df represents the N days
-
+def scale_var(var, n):
+    # N days: the number of returns in the month, positive value represents a loss
+    var_N_days = round(float(var) * np.sqrt(n) * 100, 2)
     if var_N_days <= -100:
         var_N_days = -99
+    return var_N_days
+
+def load_bars(cursor, symbol, start_date, end_date):
+    """Month id, close and completeness (all OHLCV fields present) of every bar"""
+    cursor.execute(f"""
+        SELECT date, close, (open IS NOT NULL AND high IS NOT NULL AND low IS NOT NULL AND close IS NOT NULL AND volume IS NOT NULL)
+        FROM "{symbol}" WHERE date BETWEEN ? AND ?
+    """, (start_date, end_date))
+    rows = cursor.fetchall()
+    dates = [row[0] for row in rows]
+    months = np.array([int(date[0:4]) * 12 + int(date[5:7]) - 1 for date in dates], dtype=np.int64)
+    close = np.array([row[1] for row in rows], dtype=float)
+    complete = np.array([bool(row[2]) for row in rows], dtype=bool)
+    return dates, months, close, complete
+
+def monthly_returns(months, close, complete):
+    """Returns inside each month, position of every bar in its month and the valid mask"""
+    new_month = np.ones(len(months), dtype=bool)
+    new_month[1:] = months[1:] != months[:-1]
+    starts = np.flatnonzero(new_month)
+    position = np.arange(len(months)) - np.repeat(starts, np.diff(np.append(starts, len(months))))
+    returns = np.full(len(close), np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns[1:] = close[1:] / close[:-1] - 1
+    valid = complete & ~new_month & ~np.isnan(returns)
+    return returns, position, valid
+
+def ewma_sigma(returns):
+    """
+    EWMA volatility of right aligned return columns (NaN padded): sigma used
+    for every day and the forecast for the next day.
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        current = np.nanvar(returns, axis=0)
+    sigma = np.empty_like(returns)
+    for t in range(returns.shape[0]):
+        r = returns[t]
+        sigma[t] = np.sqrt(current)
+        current = np.where(np.isnan(r), current, EWMA_LAMBDA * current + (1 - EWMA_LAMBDA) * r ** 2)
+    return sigma, np.sqrt(current)
+
+def compute_block(symbols, bars, recompute_from, filtered):
+    """
+    VaR of all months and latest VaR/CVaR figures for a block of symbols.
+    Returns {symbol: (history, latest)} for symbols with at least one rated month.
+    """
+    alpha = 100 * (1 - CONFIDENCE_LEVEL)
+    first_month = min(months[0] for _, months, _, _ in bars.values() if len(months))
+    last_month = max(months[-1] for _, months, _, _ in bars.values() if len(months))
+    n_months = last_month - first_month + 1
+
+    # months x bar in month x symbols, NaN where there is no valid return
+    matrix = np.full((n_months, MAX_MONTH_ROWS, len(symbols)), np.nan)
+    row_counts = np.zeros((n_months, len(symbols)), dtype=np.int64)
+    for j, symbol in enumerate(symbols):
+        _, months, close, complete = bars[symbol]
+        if not len(months):
+            continue
+        returns, position, valid = monthly_returns(months, close, complete)
+        valid &= position < MAX_MONTH_ROWS
+        np.add.at(row_counts, (months - first_month, j), 1)
+        matrix[months[valid] - first_month, position[valid], j] = returns[valid]
 
-    return var_N_days  # Positive value represents a loss
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        n = np.sum(~np.isnan(matrix), axis=1)
+        historical = np.nanpercentile(matrix, alpha, axis=1)
+        tail = np.where(matrix <= historical[:, None, :], matrix, np.nan)
+        historical_cvar = np.nanmean(tail, axis=1)
+        mean = np.nanmean(matrix, axis=1)
+        std = np.nanstd(matrix, axis=1, ddof=1)
+    z = norm.ppf(1 - CONFIDENCE_LEVEL)
+    parametric = mean + z * std
+    parametric_cvar = mean - std * norm.pdf(z) / (1 - CONFIDENCE_LEVEL)
 
-async def run():
-    start_date = "2015-01-01"
+    rated = (row_counts >= MIN_MONTH_ROWS) & (n > 0)
+
+    if filtered:
+        # Continuous daily returns, right aligned so every column ends on its last bar
+        length = max(len(close) for _, _, close, _ in bars.values())
+        daily = np.full((length, len(symbols)), np.nan)
+        for j, symbol in enumerate(symbols):
+            _, _, close, complete = bars[symbol]
+            if len(close) > 1:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    r = close[1:] / close[:-1] - 1
+                r[~complete[1:] | ~np.isfinite(r)] = np.nan
+                daily[length - len(r):, j] = r
+        sigma, sigma_next = ewma_sigma(daily)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            standardized = (daily / sigma)[-FHS_WINDOW:]
+            z_quantile = np.nanpercentile(standardized, alpha, axis=0)
+            z_tail = np.nanmean(np.where(standardized <= z_quantile, standardized, np.nan), axis=0)
+        filtered_var = z_quantile * sigma_next
+        filtered_cvar = z_tail * sigma_next
+
+    res = {}
+    for j, symbol in enumerate(symbols):
+        month_index = np.flatnonzero(rated[:, j] & (np.arange(n_months) + first_month >= recompute_from.get(symbol, 0)))
+        if not len(month_index):
+            continue
+        history = [
+            {'date': f"{(first_month + i) // 12}-{(first_month + i) % 12 + 1:02d}", 'var': scale_var(historical[i, j], n[i, j])}
+            for i in month_index
+        ]
+        last = month_index[-1]
+        latest = {
+            'date': history[-1]['date'],
+            'historicalVar': history[-1]['var'],
+            'historicalCVar': scale_var(historical_cvar[last, j], n[last, j]),
+            'parametricVar': scale_var(parametric[last, j], n[last, j]),
+            'parametricCVar': scale_var(parametric_cvar[last, j], n[last, j]),
+        }
+        if filtered and not np.isnan(filtered_var[j]):
+            latest['filteredVar'] = scale_var(filtered_var[j], n[last, j])
+            latest['filteredCVar'] = scale_var(filtered_cvar[j], n[last, j])
+        res[symbol] = (history, latest)
+    return res
+
+async def run(incremental=False, filtered=False):
     end_date = datetime.today().strftime("%Y-%m-%d")
 
     con = sqlite3.connect('stocks.db')
@@ -72,60 +217,79 @@ async def run():
     crypto_cursor.execute("SELECT DISTINCT symbol FROM cryptos")
     crypto_symbols = [row[0] for row in crypto_cursor.fetchall()]
 
-    total_symbols = stocks_symbols + etf_symbols + crypto_symbols
-
-    for symbol in tqdm(total_symbols):
-        try:
-            if symbol in etf_symbols:  
-                query_con = etf_con
-            elif symbol in crypto_symbols:  
-                query_con = crypto_con
-            elif symbol in stocks_symbols:  
-                query_con = con
-            else:
-                continue
-
-            query_template = """
-                    SELECT
-                        date, open, high, low, close, volume
-                    FROM
-                        "{symbol}"
-                    WHERE
-                        date BETWEEN ? AND ?
-                """
-            query = query_template.format(symbol=symbol)
-            df = pd.read_sql_query(query, query_con, params=(start_date, end_date))
-
-            # Convert date to datetime
-            df['date'] = pd.to_datetime(df['date'])
-
-            # Group by year and month
-            monthly_groups = df.groupby(df['date'].dt.to_period('M'))
-            history = []
-
-            for period, group in monthly_groups:
-                if len(group) >=19:  # Check if the month has at least 19 data points
-                    var_data = compute_var(group)
-                    history.append({'date': str(period), 'var': var_data})
-
-            risk_rating = assign_risk_rating(abs(history[-1]['var']))
-            outlook = 'Neutral'
-            if risk_rating < 5:
-                outlook = 'Risky'
-            elif risk_rating > 5:
-                outlook = 'Minimum Risk'
-            res = {'rating': risk_rating, 'history': history, 'outlook': outlook}
-
-            await save_json(symbol, res)
-
-        except Exception as e:
-            print(f"Error processing {symbol}: {e}")
+    # One cursor per symbol, etfs take precedence over cryptos and stocks as before
+    symbol_cursors = {symbol: cursor for symbol in stocks_symbols}
+    symbol_cursors.update({symbol: crypto_cursor for symbol in crypto_symbols})
+    symbol_cursors.update({symbol: etf_cursor for symbol in etf_symbols})
+    total_symbols = list(dict.fromkeys(stocks_symbols + etf_symbols + crypto_symbols))
+
+    state = (load_json(STATE_PATH) or {}) if incremental else {}
+    new_state = dict(state)
+    updated = 0
+
+    for i in tqdm(range(0, len(total_symbols), BLOCK_SIZE)):
+        block = []
+        bars = {}
+        recompute_from = {}
+        for symbol in total_symbols[i:i + BLOCK_SIZE]:
+            try:
+                start_date = START_DATE
+                last_date = state.get(symbol)
+                existing = load_json(f"json/var/{symbol}.json") if last_date else None
+                if existing and existing.get('history'):
+                    # Reload from the start of the last rated month, earlier months are final
+                    month_start = f"{min(last_date[0:7], existing['history'][-1]['date'])}-01"
+                    start_date = month_start
+                    if filtered:
+                        start_date = min(month_start, (datetime.strptime(month_start, "%Y-%m-%d") - timedelta(days=FHS_WARMUP_DAYS)).strftime("%Y-%m-%d"))
+                    recompute_from[symbol] = int(month_start[0:4]) * 12 + int(month_start[5:7]) - 1
+
+                dates, months, close, complete = load_bars(symbol_cursors[symbol], symbol, max(start_date, START_DATE), end_date)
+                if not dates or (existing and max(dates) == last_date):
+                    continue
+                new_state[symbol] = max(dates)
+                bars[symbol] = (existing, months, close, complete)
+                block.append(symbol)
+            except Exception as e:
+                print(f"Error processing {symbol}: {e}")
+
+        if not block:
+            continue
+
+        results = compute_block(block, bars, recompute_from, filtered)
+        for symbol in block:
+            try:
+                existing = bars[symbol][0]
+                if symbol not in results:
+                    raise ValueError("no month with enough data")
+                history, latest = results[symbol]
+                if existing:
+                    history = [item for item in existing['history'] if item['date'] < history[0]['date']] + history
+
+                risk_rating = assign_risk_rating(abs(history[-1]['var']))
+                outlook = 'Neutral'
+                if risk_rating < 5:
+                    outlook = 'Risky'
+                elif risk_rating > 5:
+                    outlook = 'Minimum Risk'
+                res = {'rating': risk_rating, 'history': history, 'outlook': outlook, 'latest': latest}
+
+                await save_json(symbol, res)
+                updated += 1
+            except Exception as e:
+                new_state.pop(symbol, None)
+                print(f"Error processing {symbol}: {e}")
+
+    save_state(new_state)
+    print(f"Updated VaR of {updated} of {len(total_symbols)} symbols")
 
     con.close()
     etf_con.close()
     crypto_con.close()
 
-try:
-    asyncio.run(run())
-except Exception as e:
-    print(e)
+if __name__ == '__main__':
+    args = parse_args()
+    try:
+        asyncio.run(run(incremental=args.incremental, filtered=args.filtered))
+    except Exception as e:
+        print(e)
@@ -0,0 +1,65 @@
+import os
+import argparse
+import ujson
+import aiohttp
+from aiohttp import web
+from urllib.parse import urlencode
+from dotenv import load_dotenv
+
+# Replays recorded FMP responses so crons can run offline:
+#   python3 fmp_stub_server.py --dir recordings/insider --record   (proxy FMP and save responses)
+#   python3 fmp_stub_server.py --dir recordings/insider            (serve the saved responses)
+#   FMP_BASE_URL=http://127.0.0.1:8765 python3 cron_insider_trading.py --incremental
+# A request without a recording gets an empty list, which ends every pagination loop.
+
+load_dotenv()
+api_key = os.getenv('FMP_API_KEY')
+FMP_URL = "https://financialmodelingprep.com"
+
+
+def recording_path(directory, request):
+    # apikey is never part of a recording
+    params = sorted((key, value) for key, value in request.query.items() if key != 'apikey')
+    return os.path.join(directory, request.path.strip('/'), f"{urlencode(params) or '_'}.json")
+
+
+def create_app(directory, record=False):
+    async def handle(request):
+        path = recording_path(directory, request)
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                recording = ujson.load(file)
+            return web.json_response(recording['body'], status=recording['status'])
+        if not record:
+            return web.json_response([])
+
+        params = {key: value for key, value in request.query.items() if key != 'apikey'}
+        async with request.app['session'].get(f"{FMP_URL}{request.path}", params={**params, 'apikey': api_key}) as response:
+            body = await response.json(content_type=None)
+            status = response.status
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            ujson.dump({'status': status, 'body': body}, file)
+        return web.json_response(body, status=status)
+
+    async def on_startup(app):
+        app['session'] = aiohttp.ClientSession()
+
+    async def on_cleanup(app):
+        await app['session'].close()
+
+    app = web.Application()
+    app.router.add_get('/{tail:.*}', handle)
+    if record:
+        app.on_startup.append(on_startup)
+        app.on_cleanup.append(on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve recorded FMP responses.')
+    parser.add_argument('--dir', default='recordings', help='Directory of the recorded responses')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--record', action='store_true', help='Proxy missing requests to FMP and record them')
+    args = parser.parse_args()
+    web.run_app(create_app(args.dir, args.record), host='127.0.0.1', port=args.port)
@@ -9,7 +9,6 @@ from benzinga import financial_data
 from typing import List, Dict, Set
 # Third-party library imports
 import numpy as np
-import pandas as pd
 import orjson
 import aiohttp
 import aiofiles
@@ -32,7 +31,7 @@ from fastapi.openapi.docs import get_swagger_ui_html
 from fastapi.openapi.utils import get_openapi
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.security.api_key import APIKeyHeader
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse
 
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
@@ -40,6 +39,16 @@ from slowapi.errors import RateLimitExceeded
 from functools import partial
 from datetime import datetime
 from utils.helper import load_latest_json
+from utils.intraday_store import load_store, bars_since
+from utils.price_segment_store import read_range
+from utils.metrics import MetricsMiddleware, InstrumentedRedis, instrument_module, timed_open, render_metrics, profiler
+from utils.sqlite_pool import ReadOnlyDatabase
+
+# Time the phases of every request: file reads, orjson and gzip calls land on
+# the route that made them (see utils/metrics.py)
+open = timed_open
+orjson = instrument_module(orjson, {'loads': 'parse', 'dumps': 'serialization'})
+gzip = instrument_module(gzip, {'compress': 'compression'})
 
 # DB constants & context manager
 
@@ -105,7 +114,7 @@ def db_connection(db_name):
     conn.close()
 
 ################# Redis #################
-redis_client = redis.Redis(host='localhost', port=6380, db=0)
+redis_client = InstrumentedRedis(redis.Redis(host='localhost', port=6380, db=0))
 redis_client.flushdb() # TECH DEBT
 caching_time = 3600*12 #Cache data for 12 hours
 
@@ -187,9 +196,10 @@ for item in searchbar_data:
 etf_set = set(etf_symbols)
 
 
-### TECH DEBT ###
-con = sqlite3.connect('stocks.db')
-etf_con = sqlite3.connect('etf.db')
+# Read-only, per-thread connections, queries run off the event loop
+stock_db = ReadOnlyDatabase(f'{STOCK_DB}.db')
+etf_db = ReadOnlyDatabase(f'{ETF_DB}.db')
+crypto_db = ReadOnlyDatabase(f'{CRYPTO_DB}.db')
 
 load_dotenv()
 
@@ -212,6 +222,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
 
 
 
@@ -255,6 +266,18 @@ async def get_api_key(api_key: str = Security(api_key_header)):
 async def get_documentation(username: str = Depends(get_current_username)):
     return get_swagger_ui_html(openapi_url="/openapi.json", title="docs")
 
+@app.get("/metrics")
+async def get_metrics(username: str = Depends(get_current_username)):
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profile")
+async def toggle_profiler(action: str = Query('stop'), interval_ms: float = Query(5), username: str = Depends(get_current_username)):
+    # Samples only the worker that serves this request, stop on the same worker (pid in the response)
+    if action == 'start':
+        started = profiler.start(interval=interval_ms / 1000)
+        return {'pid': os.getpid(), 'started': started}
+    return PlainTextResponse(f"# pid {os.getpid()}, {profiler.samples} samples\n" + profiler.stop())
+
 
 @app.get("/openapi.json")
 async def openapi(username: str = Depends(get_current_username)):
@@ -264,6 +287,10 @@ async def openapi(username: str = Depends(get_current_username)):
 class TickerData(BaseModel):
     ticker: str
 
+class OneDayPriceDelta(BaseModel):
+    ticker: str
+    since: str = ''
+
 class GeneralData(BaseModel):
     params: str
 
@@ -294,6 +321,12 @@ class HistoricalPrice(BaseModel):
     ticker: str
     timePeriod: str
 
+class ExportPriceData(BaseModel):
+    ticker: str
+    timePeriod: str
+    start: str = ''
+    end: str = ''
+
 class AnalystId(BaseModel):
     analystId: str
 
@@ -507,10 +540,10 @@ async def get_stock(data: HistoricalPrice, api_key: str = Security(get_api_key))
     )
     
 @app.post("/export-price-data")
-async def get_stock(data: HistoricalPrice, api_key: str = Security(get_api_key)):
+async def get_stock(data: ExportPriceData, api_key: str = Security(get_api_key)):
     ticker = data.ticker.upper()
     time_period = data.timePeriod
-    cache_key = f"export-price-data-{ticker}-{time_period}"
+    cache_key = f"export-price-data-{ticker}-{time_period}-{data.start}-{data.end}"
     cached_result = redis_client.get(cache_key)
     if cached_result:
         return StreamingResponse(
@@ -526,9 +559,9 @@ async def get_stock(data: HistoricalPrice, api_key: str = Security(get_api_key))
         except:
             res = []
     else:
+        # Intraday bars are stored per month, only the months of the range are read
         try:
-            with open(f"json/export/price/{time_period}/{ticker}.json", 'rb') as file:
-                res = orjson.loads(file.read())
+            res = read_range(time_period, ticker, data.start, data.end)
         except:
             res = []
 
@@ -574,6 +607,14 @@ async def get_stock(data: TickerData, api_key: str = Security(get_api_key)):
     )
 
 
+@app.post("/one-day-price-delta")
+async def get_one_day_price_delta(data: OneDayPriceDelta, api_key: str = Security(get_api_key)):
+    # Chart clients poll with the time of their newest bar and only get the bars from there on
+    ticker = data.ticker.upper()
+    date, bars = load_store(ticker)
+    return {'date': date, 'history': bars_since(date, bars, data.since)}
+
+
 @app.post("/hover-stock-chart")
 async def get_hover_stock_chart(data: TickerData, api_key: str = Security(get_api_key)):
     data = data.dict()
@@ -656,9 +697,7 @@ async def get_similar_etfs(data: TickerData, api_key: str = Security(get_api_key
             LIMIT 15
         """
 
-        etf_cursor = etf_con.cursor()
-        etf_cursor.execute(query, (ticker, ticker, ticker))
-        raw_data = etf_cursor.fetchall()
+        raw_data = await etf_db.fetchall(query, (ticker, ticker, ticker))
 
         result = [
             {"symbol": row[0], "name": row[1], "totalAssets": row[2], "numberOfHoldings": row[3]}
@@ -669,8 +708,6 @@ async def get_similar_etfs(data: TickerData, api_key: str = Security(get_api_key
             result = random.sample(result, k=5)
 
         result.sort(key=lambda x: x["totalAssets"], reverse=True)  # Sort the list in-place
-
-        etf_cursor.close()  # Close the cursor after executing the query
     except:
         result = []
 
@@ -890,9 +927,9 @@ async def history_employees(data: TickerData, api_key: str = Security(get_api_ke
         symbol = ?
     """
 
-    df = pd.read_sql_query(query_template,con, params=(ticker,))
+    row = await stock_db.fetchone(query_template, (ticker,))
     try:
-        history_employee_count = orjson.loads(df['history_employee_count'].iloc[0])
+        history_employee_count = orjson.loads(row[0])
         res = sorted([entry for entry in history_employee_count if entry["employeeCount"] != 0], key=lambda x: x["filingDate"])
     except:
         res = []
@@ -1627,10 +1664,9 @@ async def brownian_motion(data:TickerData, api_key: str = Security(get_api_key))
         symbol = ?
     """
 
-    df = pd.read_sql_query(query, etf_con if table_name == 'etfs' else con, params=(ticker,))
-    df_dict = df.to_dict()
+    row = await (etf_db if table_name == 'etfs' else stock_db).fetchone(query, (ticker,))
     try:
-        price_dict = orjson.loads(df_dict['pricePrediction'][0])
+        price_dict = orjson.loads(row[0])
     except:
         price_dict = {'1W': {'min': 0, 'mean': 0, 'max': 0}, '1M': {'min': 0, 'mean': 0, 'max': 0}, '3M': {'min': 0, 'mean': 0, 'max': 0}, '6M': {'min': 0, 'mean': 0, 'max': 0}}
 
@@ -1895,10 +1931,7 @@ async def revenue_segmentation(data: TickerData, api_key: str = Security(get_api
             symbol = ?
     """
 
-    query = query_template.format(ticker=ticker)
-    cur = con.cursor()
-    cur.execute(query, (ticker,))
-    result = cur.fetchone()  # Get the first row
+    result = await stock_db.fetchone(query_template, (ticker,))  # Get the first row
 
     if result is not None:
         product_list = orjson.loads(result[0])
@@ -1932,10 +1965,7 @@ async def get_crypto_profile(data: TickerData, api_key: str = Security(get_api_k
         WHERE
             symbol = ?
     """
-    query = query_template.format(ticker=ticker)
-    cur = crypto_con.cursor()
-    cur.execute(query, (ticker,))
-    result = cur.fetchone()  # Get the first row
+    result = await crypto_db.fetchone(query_template, (ticker,))  # Get the first row
     profile_list = []
 
     try:
@@ -2008,10 +2038,7 @@ async def get_data(data: TickerData, api_key: str = Security(get_api_key)):
         WHERE
             symbol = ?
     """
-    query = query_template.format(ticker=ticker)
-    cur = etf_con.cursor()
-    cur.execute(query, (ticker,))
-    result = cur.fetchone()  # Get the first row
+    result = await etf_db.fetchone(query_template, (ticker,))  # Get the first row
     res = []
 
     try:
@@ -2407,11 +2434,8 @@ async def etf_provider(api_key: str = Security(get_api_key)):
         return orjson.loads(cached_result)
 
     # Check if data is cached; if not, fetch and cache it
-    cursor = etf_con.cursor()
     query = "SELECT symbol, name, expenseRatio, totalAssets, numberOfHoldings, inceptionDate FROM etfs ORDER BY inceptionDate DESC LIMIT ?"
-    cursor.execute(query, (limit,))
-    raw_data = cursor.fetchall()
-    cursor.close()
+    raw_data = await etf_db.fetchall(query, (limit,))
 
     # Extract only relevant data and sort it
     res = [{'symbol': row[0], 'name': row[1], 'expenseRatio': row[2], 'totalAssets': row[3], 'numberOfHoldings': row[4], 'inceptionDate': row[5]} for row in raw_data]
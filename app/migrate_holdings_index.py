@@ -0,0 +1,19 @@
+import sqlite3
+import time
+from utils.holdings_index import migrate_institute_holdings, migrate_etf_holdings
+
+# One-off backfill of institute_holdings / etf_holdings from the existing JSON blobs.
+# New builds of institute.db and etf.db fill the tables themselves.
+
+if __name__ == '__main__':
+    for db_path, migrate in [('institute.db', migrate_institute_holdings), ('etf.db', migrate_etf_holdings)]:
+        start_time = time.time()
+        con = sqlite3.connect(db_path)
+        con.execute("PRAGMA journal_mode = wal")
+        try:
+            count = migrate(con)
+            print(f"Migrated holdings of {count} rows in {db_path} in {time.time() - start_time:.2f}s")
+        except Exception as e:
+            print(f"Failed to migrate {db_path}: {e}")
+        finally:
+            con.close()
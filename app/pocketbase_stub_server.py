@@ -0,0 +1,92 @@
+import json
+import argparse
+from aiohttp import web
+
+# Minimal PocketBase stand-in so crons can run against local records:
+#   python3 pocketbase_stub_server.py --data portfolios.json
+#   POCKETBASE_URL=http://127.0.0.1:8091 python3 cron_portfolio.py
+# The data file is {collection: [records]} and is written back on shutdown,
+# /stub/stats counts the requests. Auth always succeeds, list filters and
+# sorting are ignored.
+
+
+def create_app(path):
+    with open(path, 'r') as file:
+        collections = json.load(file)
+    stats = {'requests': 0, 'updates': 0, 'batches': 0}
+
+    async def save(app):
+        with open(path, 'w') as file:
+            json.dump(collections, file)
+
+    def update_record(collection, record_id, fields):
+        for record in collections.get(collection, []):
+            if record['id'] == record_id:
+                record.update(fields)
+                return record
+        return None
+
+    @web.middleware
+    async def count_requests(request, handler):
+        stats['requests'] += 1
+        return await handler(request)
+
+    async def auth(request):
+        return web.json_response({'token': 'stub', 'record': {'id': 'stub', 'email': 'stub@localhost'}})
+
+    async def list_records(request):
+        records = collections.get(request.match_info['collection'], [])
+        page = int(request.query.get('page', 1))
+        per_page = int(request.query.get('perPage', 30))
+        return web.json_response({
+            'page': page,
+            'perPage': per_page,
+            'totalItems': len(records),
+            'totalPages': (len(records) + per_page - 1) // per_page,
+            'items': records[(page - 1) * per_page:page * per_page],
+        })
+
+    async def patch_record(request):
+        record = update_record(request.match_info['collection'], request.match_info['id'], await request.json())
+        if record is None:
+            return web.json_response({'status': 404, 'message': 'Not found.'}, status=404)
+        stats['updates'] += 1
+        return web.json_response(record)
+
+    async def batch(request):
+        body = await request.json()
+        # The python client sends the requests json encoded under @jsonPayload
+        if '@jsonPayload' in body:
+            body = json.loads(body['@jsonPayload'])
+        requests = []
+        for item in body.get('requests', []):
+            _, _, collection, _, record_id = item['url'].strip('/').split('/')[:5]
+            ids = {record['id'] for record in collections.get(collection, [])}
+            # Like PocketBase the batch is all or nothing
+            if item['method'] != 'PATCH' or record_id not in ids:
+                return web.json_response({'status': 400, 'message': 'Batch transaction failed.'}, status=400)
+            requests.append((collection, record_id, item.get('body') or {}))
+        results = [{'status': 200, 'body': update_record(*args)} for args in requests]
+        stats['batches'] += 1
+        stats['updates'] += len(results)
+        return web.json_response(results)
+
+    async def get_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application(middlewares=[count_requests])
+    app.on_cleanup.append(save)
+    app.router.add_post('/api/collections/_superusers/auth-with-password', auth)
+    app.router.add_get('/api/collections/{collection}/records', list_records)
+    app.router.add_patch('/api/collections/{collection}/records/{id}', patch_record)
+    app.router.add_post('/api/batch', batch)
+    app.router.add_get('/stub/stats', get_stats)
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve PocketBase records from a json file.')
+    parser.add_argument('--data', required=True, help='Json file of {collection: [records]}')
+    parser.add_argument('--port', type=int, default=8091)
+    args = parser.parse_args()
+    web.run_app(create_app(args.data), host='127.0.0.1', port=args.port)
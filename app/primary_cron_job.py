@@ -105,7 +105,10 @@ def run_options_jobs():
 
 def run_cron_insider_trading():
     week = datetime.today().weekday()
-    if week <= 4:
+    if week <= 3:
+        run_command(["python3", "cron_insider_trading.py", "--incremental"])
+    elif week == 4:
+        # Weekly full pass picks up amended filings
         run_command(["python3", "cron_insider_trading.py"])
 
 def run_congress_trading():
@@ -126,7 +129,10 @@ def run_dividend_list():
 
 def run_cron_var():
     week = datetime.today().weekday()
-    if week <= 4:
+    if week <= 3:
+        run_command(["python3", "cron_var.py", "--incremental"])
+    elif week == 4:
+        # Full rebuild once a week picks up split/dividend adjusted history
         run_command(["python3", "cron_var.py"])
 
 def run_cron_sector():
@@ -1010,6 +1010,15 @@ async def get_stock_screener(con):
     return stock_screener_data
 
 
+def get_fundamentals_map(con):
+    """
+    Preload name, marketCap and eps of every stock in one query for the calendar builders.
+    """
+    cursor = con.cursor()
+    cursor.execute("SELECT symbol, name, marketCap, eps FROM stocks")
+    return {row[0]: {'name': row[1], 'marketCap': row[2], 'eps': row[3]} for row in cursor.fetchall()}
+
+
 async def get_dividends_calendar(con,symbols):
 
     berlin_tz = pytz.timezone('Europe/Berlin')
@@ -1026,24 +1035,15 @@ async def get_dividends_calendar(con,symbols):
     # Format dates as strings in 'YYYY-MM-DD' format
     start_date = start_date.strftime('%Y-%m-%d')
     end_date = end_date.strftime('%Y-%m-%d')
-        
-    async with aiohttp.ClientSession() as session:
 
-        #Database read 1y and 3y data
-        query_template = """
-            SELECT 
-                name, marketCap
-            FROM 
-                stocks 
-            WHERE
-                symbol = ?
-        """
-        
+    symbols = set(symbols)
+    fundamentals = get_fundamentals_map(con)
+
+    async with aiohttp.ClientSession() as session:
         url = f"https://financialmodelingprep.com/api/v3/stock_dividend_calendar?from={start_date}&to={end_date}&apikey={api_key}"
         async with session.get(url) as response:
             data = await response.json()
-            filtered_data = [{k: v for k, v in stock.items() if '.' not in stock['symbol'] and stock['symbol'] in symbols} for stock in data]
-            filtered_data = [entry for entry in filtered_data if entry]
+            filtered_data = [stock for stock in data if '.' not in stock['symbol'] and stock['symbol'] in symbols]
 
             for entry in filtered_data:
                 try:
@@ -1054,33 +1054,22 @@ async def get_dividends_calendar(con,symbols):
                     except:
                         entry['revenue'] = None
 
-                    data = pd.read_sql_query(query_template, con, params=(symbol,))
-                    entry['name'] = data['name'].iloc[0]
-                    entry['marketCap'] = int(data['marketCap'].iloc[0])
+                    entry['name'] = fundamentals[symbol]['name']
+                    entry['marketCap'] = int(fundamentals[symbol]['marketCap'])
                 except:
                     entry['name'] = 'n/a'
                     entry['marketCap'] = None
                     entry['revenue'] = None
 
-    filtered_data = [d for d in filtered_data if d['symbol'] in symbols]
-
     return filtered_data
 
 
 
 async def get_earnings_calendar(con, stock_symbols):
-    def remove_duplicates(elements):
-        seen = set()
-        unique_elements = []
-        for element in elements:
-            if element['symbol'] not in seen:
-                seen.add(element['symbol'])
-                unique_elements.append(element)
-        return unique_elements
-
     headers = {"accept": "application/json"}
     url = "https://api.benzinga.com/api/v2.1/calendar/earnings"
     importance_list = ["0", "1", "2", "3", "4", "5"]
+    page_size = 1000
     berlin_tz = pytz.timezone('Europe/Berlin')
 
     today = datetime.now(berlin_tz)
@@ -1092,91 +1081,86 @@ async def get_earnings_calendar(con, stock_symbols):
     end_date = today + timedelta(weeks=2)
     end_date += timedelta(days=(4 - end_date.weekday()))  # Set to Friday
 
-    res_list = []
-    async with aiohttp.ClientSession() as session:
-        query_template = """
-            SELECT name, marketCap FROM stocks WHERE symbol = ?
-        """
-        while start_date <= end_date:
-            date_str = start_date.strftime('%Y-%m-%d')  # Same date for start and end in API call
-            for importance in importance_list:
-                querystring = {
-                    "token": BENZINGA_API_KEY,
-                    "parameters[importance]": importance,
-                    "parameters[date_from]": date_str,
-                    "parameters[date_to]": date_str
-                }
-                try:
-                    async with session.get(url, params=querystring, headers=headers) as response:
-                        data = ujson.loads(await response.text())['earnings']
-                        res = [item for item in data if item['ticker'] in stock_symbols and '.' not in item['ticker'] and '-' not in item['ticker']]
-                        
-                        for item in res:
-                            try:
-                                symbol = item['ticker']
-                                eps_prior = float(item['eps_prior']) if item['eps_prior'] else None
-                                eps_est = float(item['eps_est']) if item['eps_est'] else None
-                                revenue_est = float(item['revenue_est']) if item['revenue_est'] else None
-                                revenue_prior = float(item['revenue_prior']) if item['revenue_prior'] else None
-                                
-                                # Time-based release type
-                                time = datetime.strptime(item['time'], "%H:%M:%S").time()
-                                if time < datetime.strptime("09:30:00", "%H:%M:%S").time():
-                                    release = "bmo"
-                                elif time > datetime.strptime("16:00:00", "%H:%M:%S").time():
-                                    release = "amc"
-                                else:
-                                    release = "during"
-                                
-                                # Only include valid data
-                                df = pd.read_sql_query(query_template, con, params=(symbol,))
-                                market_cap = float(df['marketCap'].iloc[0]) if df['marketCap'].iloc[0] else 0
-                                res_list.append({
-                                    'symbol': symbol,
-                                    'name': item['name'],
-                                    'date': item['date'],
-                                    'marketCap': market_cap,
-                                    'epsPrior': eps_prior,
-                                    'epsEst': eps_est,
-                                    'revenuePrior': revenue_prior,
-                                    'revenueEst': revenue_est,
-                                    'release': release
-                                })
-                            except Exception as e:
-                                print(f"Error processing item for symbol {symbol}: {e}")
-                                continue
-
-                    res_list = remove_duplicates(res_list)
-                    res_list.sort(key=lambda x: x['marketCap'], reverse=True)
+    stock_symbols = set(stock_symbols)
+    fundamentals = get_fundamentals_map(con)
+
+    async def fetch_importance(session, importance):
+        # One paginated request over the whole date range instead of one request per day
+        rows = []
+        for page in range(100):
+            querystring = {
+                "token": BENZINGA_API_KEY,
+                "parameters[importance]": importance,
+                "parameters[date_from]": start_date.strftime('%Y-%m-%d'),
+                "parameters[date_to]": end_date.strftime('%Y-%m-%d'),
+                "page": str(page),
+                "pagesize": str(page_size),
+            }
+            try:
+                async with session.get(url, params=querystring, headers=headers) as response:
+                    data = ujson.loads(await response.text())['earnings']
+            except:
+                break
+            rows += data
+            if len(data) < page_size:
+                break
+        return rows
 
-                except:
-                    #print(f"Error fetching data from API: {e}")
-                    continue
+    async with aiohttp.ClientSession() as session:
+        responses = await asyncio.gather(*[fetch_importance(session, importance) for importance in importance_list])
 
-            start_date += timedelta(days=1)  # Increment date by one day
+    # Keep the order of the previous day-by-day fetch: date first, then importance level
+    ordered = [
+        (item.get('date', ''), rank, position, item)
+        for rank, data in enumerate(responses)
+        for position, item in enumerate(data)
+    ]
+    ordered.sort(key=lambda x: x[:3])
 
+    res_list = []
     seen_symbols = set()
-    unique_data = []
+    release_start = datetime.strptime("09:30:00", "%H:%M:%S").time()
+    release_end = datetime.strptime("16:00:00", "%H:%M:%S").time()
 
-    for item in res_list:
-        symbol = item.get('symbol')
+    for _, _, _, item in ordered:
+        symbol = item.get('ticker')
+        if symbol not in stock_symbols or '.' in symbol or '-' in symbol or symbol in seen_symbols:
+            continue
         try:
-            with open(f"json/quote/{symbol}.json", 'r') as file:
-                quote = ujson.load(file)
-                try:
-                    earnings_date = datetime.strptime(quote['earningsAnnouncement'].split('T')[0], '%Y-%m-%d').strftime('%Y-%m-%d')
-                except:
-                    earnings_date = '-'
-        except Exception as e:
-            earnings_date = '-'
-            print(e)
-
-        if symbol is None or symbol not in seen_symbols:
-            #bug in fmp endpoint. Double check that earnings date is the same as in quote endpoint
-            if item['date'] == earnings_date:
-                #print(symbol, item['date'], earnings_date)
-                unique_data.append(item)
+            eps_prior = float(item['eps_prior']) if item['eps_prior'] else None
+            eps_est = float(item['eps_est']) if item['eps_est'] else None
+            revenue_est = float(item['revenue_est']) if item['revenue_est'] else None
+            revenue_prior = float(item['revenue_prior']) if item['revenue_prior'] else None
+
+            # Time-based release type
+            time = datetime.strptime(item['time'], "%H:%M:%S").time()
+            if time < release_start:
+                release = "bmo"
+            elif time > release_end:
+                release = "amc"
+            else:
+                release = "during"
+
+            market_cap = fundamentals[symbol]['marketCap']
+            market_cap = float(market_cap) if market_cap else 0
+            res_list.append({
+                'symbol': symbol,
+                'name': item['name'],
+                'date': item['date'],
+                'marketCap': market_cap,
+                'epsPrior': eps_prior,
+                'epsEst': eps_est,
+                'revenuePrior': revenue_prior,
+                'revenueEst': revenue_est,
+                'release': release
+            })
             seen_symbols.add(symbol)
+        except Exception as e:
+            print(f"Error processing item for symbol {symbol}: {e}")
+            continue
+
+    # Dedup and sort once at the end
+    res_list.sort(key=lambda x: x['marketCap'], reverse=True)
 
     return res_list
 
@@ -1197,40 +1181,27 @@ async def get_stock_splits_calendar(con,symbols):
     # Format dates as strings in 'YYYY-MM-DD' format
     start_date = start_date.strftime('%Y-%m-%d')
     end_date = end_date.strftime('%Y-%m-%d')
-        
-    async with aiohttp.ClientSession() as session:
 
-        #Database read 1y and 3y data
-        query_template = """
-            SELECT 
-                name, marketCap,eps
-            FROM 
-                stocks 
-            WHERE
-                symbol = ?
-        """
-        
+    symbols = set(symbols)
+    fundamentals = get_fundamentals_map(con)
+
+    async with aiohttp.ClientSession() as session:
         url = f"https://financialmodelingprep.com/api/v3/stock_split_calendar?from={start_date}&to={end_date}&apikey={api_key}"
         async with session.get(url) as response:
             data = await response.json()
-            filtered_data = [{k: v for k, v in stock.items() if stock['symbol'] in symbols} for stock in data]
-            filtered_data = [entry for entry in filtered_data if entry]
+            filtered_data = [stock for stock in data if stock['symbol'] in symbols]
 
             for entry in filtered_data:
                 try:
                     symbol = entry['symbol']
-
-                    data = pd.read_sql_query(query_template, con, params=(symbol,))
-                    entry['name'] = data['name'].iloc[0]
-                    entry['marketCap'] = int(data['marketCap'].iloc[0])
-                    entry['eps'] = float(data['eps'].iloc[0])
+                    entry['name'] = fundamentals[symbol]['name']
+                    entry['marketCap'] = int(fundamentals[symbol]['marketCap'])
+                    entry['eps'] = float(fundamentals[symbol]['eps'])
                 except:
                     entry['name'] = 'n/a'
                     entry['marketCap'] = None
                     entry['eps'] = None
 
-    filtered_data = [d for d in filtered_data if d['symbol'] in symbols]
-
     return filtered_data
 
 
@@ -0,0 +1,270 @@
+import os
+import orjson
+import numpy as np
+import pandas as pd
+from datetime import datetime
+
+# Columnar training matrices for the ML crons. Every feature set in FEATURE_SETS
+# gets its own versioned directory, bumping `version` makes the next run rebuild
+# all matrices from scratch. Daily bars are shared between feature sets and only
+# the bars after the last stored date are downloaded.
+
+STORE_DIR = "ml_models/training_data/feature-store"
+BARS_DIR = f"{STORE_DIR}/bars"
+PRICE_START_DATE = "1995-10-10"
+META_KEY = '__meta__'
+
+FEATURE_SETS = {
+    'ai-score': {
+        'version': 1,
+        'statements': [
+            'ratios', 'key-metrics', 'income-statement-growth',
+            'balance-sheet-statement-growth', 'cash-flow-statement-growth',
+        ],
+        'ignore_keys': ["symbol", "reportedCurrency", "calendarYear", "fillingDate", "acceptedDate", "period", "cik", "link", "finalLink", "pbRatio", "ptbRatio"],
+        'min_year': 2000,
+        'min_quarters': 50,
+        'price_column': 'close',
+        'price_features': True,
+        'max_lag_days': 10,
+        'replace_inf': True,
+        'round': 2,
+    },
+    'fundamental-predictor': {
+        'version': 1,
+        'statements': [
+            'income-statement', 'income-statement-growth', 'balance-sheet-statement',
+            'balance-sheet-statement-growth', 'cash-flow-statement', 'cash-flow-statement-growth', 'ratios',
+        ],
+        'ignore_keys': ["symbol", "reportedCurrency", "calendarYear", "fillingDate", "acceptedDate", "period", "cik", "link", "finalLink"],
+        'min_year': 2000,
+        'min_quarters': 0,
+        'price_column': 'adjClose',
+        'price_features': False,
+        'max_lag_days': 9,
+        'replace_inf': False,
+        'round': None,
+    },
+}
+
+
+def feature_set_path(name, ticker):
+    return f"{STORE_DIR}/{name}/v{FEATURE_SETS[name]['version']}/{ticker}.npz"
+
+
+def save_frame(path, df, meta):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    arrays = {column: df[column].to_numpy() for column in df.columns}
+    arrays['date'] = df['date'].to_numpy(dtype=str)
+    arrays[META_KEY] = np.array(orjson.dumps({**meta, 'columns': list(df.columns)}).decode())
+    with open(f"{path}.tmp", 'wb') as file:
+        np.savez(file, **arrays)
+    os.replace(f"{path}.tmp", path)
+
+
+def load_frame(path):
+    """(DataFrame, meta) of a stored matrix or (None, {}) if there is none."""
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = orjson.loads(str(data[META_KEY]))
+            df = pd.DataFrame({column: data[column] for column in meta['columns']})
+        return df, meta
+    except Exception:
+        return None, {}
+
+
+async def fetch_bars(session, ticker, api_key, start_date=PRICE_START_DATE):
+    url = f"https://financialmodelingprep.com/api/v3/historical-price-full/{ticker}?from={start_date}&apikey={api_key}"
+    async with session.get(url) as response:
+        if response.status != 200:
+            raise Exception(f"Error fetching data: {response.status} {response.reason}")
+        data = await response.json()
+    df = pd.DataFrame(data.get('historical', []))
+    if df.empty:
+        return df
+    df = df.drop(columns=['label'], errors='ignore')
+    for column in df.columns:
+        if column != 'date':
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df.sort_values(by='date', ascending=True).reset_index(drop=True)
+
+
+async def update_bars(session, ticker, api_key):
+    """
+    Daily bars of `ticker` since PRICE_START_DATE, downloading only the bars after
+    the last stored date. If the last stored bar changed (split or dividend
+    adjustment) the whole history is downloaded again. Returns (bars, history)
+    where `history` identifies the last full download, rows derived from bars of
+    a different history are on another price basis.
+    """
+    path = f"{BARS_DIR}/{ticker}.npz"
+    bars, meta = load_frame(path)
+    today = datetime.today().strftime("%Y-%m-%d")
+    # Stores written before histories were tracked count as one history
+    history = meta.get('history', meta.get('fetched'))
+    if bars is not None and meta.get('fetched') == today:
+        return bars, history
+
+    if bars is not None and len(bars):
+        last_date = bars['date'].iloc[-1]
+        new_bars = await fetch_bars(session, ticker, api_key, start_date=last_date)
+        if len(new_bars):
+            overlap = new_bars[new_bars['date'] == last_date]
+            compare = [column for column in ('close', 'adjClose') if column in bars.columns]
+            adjusted = list(new_bars.columns) != list(bars.columns) or (len(overlap) > 0 and not np.allclose(
+                overlap[compare].to_numpy(dtype=float),
+                bars[compare].iloc[[-1]].to_numpy(dtype=float),
+                rtol=1e-6, equal_nan=True,
+            ))
+            if adjusted:
+                bars = await fetch_bars(session, ticker, api_key)
+                history = datetime.now().isoformat(timespec='seconds')
+            else:
+                bars = pd.concat([bars, new_bars[new_bars['date'] > last_date]], ignore_index=True)
+    else:
+        bars = await fetch_bars(session, ticker, api_key)
+        history = datetime.now().isoformat(timespec='seconds')
+
+    if len(bars):
+        save_frame(path, bars, {'fetched': today, 'history': history})
+    return bars, history
+
+
+def load_quarters(ticker, feature_set):
+    """
+    Quarterly statements of the feature set merged by date, oldest first. Like
+    the old dict merge, the first statement providing a field wins and the
+    statements are cut to the length of the shortest one. Returns (quarters,
+    number of rows of the first statement before any filtering), the count
+    `min_quarters` applies to as in the old len(ratios) check.
+    """
+    statements = []
+    available = None
+    for statement in feature_set['statements']:
+        with open(f"json/financial-statements/{statement}/quarter/{ticker}.json", 'rb') as file:
+            data = orjson.loads(file.read())
+        if available is None:
+            available = len(data)
+        statements.append([item for item in data if int(item['date'][:4]) >= feature_set['min_year']])
+    length = min(len(data) for data in statements)
+
+    combined = None
+    for data in statements:
+        df = pd.DataFrame(data[:length])
+        if df.empty:
+            continue
+        df = df.drop(columns=feature_set['ignore_keys'], errors='ignore').drop_duplicates('date').set_index('date')
+        if combined is None:
+            combined = df
+        else:
+            columns = list(combined.columns) + [column for column in df.columns if column not in combined.columns]
+            combined = combined.combine_first(df)[columns]
+    if combined is None:
+        return pd.DataFrame(columns=['date']), available
+
+    combined = combined.apply(pd.to_numeric, errors='coerce')
+    return combined.sort_index().reset_index(), available
+
+
+def price_features(bars, feature_set):
+    """Bars plus the technical and statistical indicators of the feature set."""
+    if not feature_set['price_features']:
+        return bars, []
+    from utils.feature_engineering import generate_ta_features, generate_statistical_features
+
+    df_stats = generate_statistical_features(bars)
+    df_ta = generate_ta_features(bars)
+    df_stats = df_stats.drop(columns=bars.columns.intersection(df_stats.columns), errors='ignore')
+    df_ta = df_ta.drop(columns=bars.columns.intersection(df_ta.columns), errors='ignore')
+    columns = df_ta.columns.tolist() + df_stats.columns.tolist()
+    return pd.concat([bars, df_ta, df_stats], axis=1), columns
+
+
+def as_of_join(quarters, features, feature_set, columns):
+    """
+    Attach the last bar on or up to `max_lag_days` before each statement date.
+    Quarters without a bar in that window get NaN and are dropped later.
+    """
+    left = quarters.assign(_date=pd.to_datetime(quarters['date']))
+    # copy() consolidates the frame the indicator functions built column by column
+    right = features[[feature_set['price_column']] + columns].copy()
+    right['_date'] = pd.to_datetime(features['date'])
+    joined = pd.merge_asof(
+        left.sort_values('_date'), right.sort_values('_date'), on='_date',
+        direction='backward', tolerance=pd.Timedelta(days=feature_set['max_lag_days'])
+    )
+    price = joined[feature_set['price_column']].round(2).rename('price')
+    return pd.concat([joined[list(quarters.columns)], price, joined[columns]], axis=1)
+
+
+def clean_rows(df, feature_set):
+    df = df.dropna()
+    if feature_set['replace_inf']:
+        df = df.replace([np.inf, -np.inf], 0).dropna()
+    if feature_set['round'] is not None:
+        float_columns = df.select_dtypes(include='float').columns
+        df[float_columns] = df[float_columns].round(feature_set['round'])
+    return df.reset_index(drop=True)
+
+
+def add_target(df):
+    # 1 if the price of the next quarter is higher than the current one
+    df = df.copy()
+    df['Target'] = ((df['price'].shift(-1) - df['price']) / df['price'] > 0).astype(int)
+    return df
+
+
+def load_matrix(name, ticker):
+    """Stored matrix of `ticker` with the Target column or None."""
+    df, _ = load_frame(feature_set_path(name, ticker))
+    if df is None or df.empty:
+        return None
+    return add_target(df)
+
+
+async def update_matrix(session, name, ticker, api_key, rebuild=False):
+    """
+    Bring the matrix of `ticker` up to date and return it with the Target column.
+    Only quarters after the last stored one are joined and appended. Rows that
+    are already stored keep their values. If a statement adds new fields or the
+    bars were downloaded again since the stored rows were built (split or
+    dividend adjustment), the whole matrix is rebuilt. Returns None if the
+    ticker lacks data.
+    """
+    feature_set = FEATURE_SETS[name]
+    path = feature_set_path(name, ticker)
+    stored, meta = (None, {}) if rebuild else load_frame(path)
+
+    quarters, available = load_quarters(ticker, feature_set)
+    if available < feature_set['min_quarters'] or quarters.empty:
+        print(f'Not enough data points for {ticker}')
+        return None
+
+    last_quarter = meta.get('last_quarter')
+    if stored is not None and last_quarter and list(quarters.columns) == meta.get('quarter_columns'):
+        new_quarters = quarters[quarters['date'] > last_quarter]
+        if new_quarters.empty:
+            return add_target(stored) if len(stored) else None
+    else:
+        stored = None
+        new_quarters = quarters
+
+    bars, history = await update_bars(session, ticker, api_key)
+    if bars.empty:
+        return None
+    if stored is not None and meta.get('bars_history') != history:
+        # Stored prices are on the old basis, the Target at the boundary would compare two bases
+        stored = None
+        new_quarters = quarters
+    features, columns = price_features(bars, feature_set)
+    rows = clean_rows(as_of_join(new_quarters, features, feature_set, columns), feature_set)
+
+    if stored is not None:
+        rows = pd.concat([stored, rows], ignore_index=True)
+    save_frame(path, rows, {
+        'version': feature_set['version'],
+        'last_quarter': quarters['date'].iloc[-1],
+        'quarter_columns': list(quarters.columns),
+        'bars_history': history,
+    })
+    return add_target(rows) if len(rows) else None
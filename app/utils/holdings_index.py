@@ -0,0 +1,135 @@
+import orjson
+
+# Normalized copies of the holdings blobs (institutes.holdings in institute.db and
+# etfs.holding in etf.db). Every position is one row, `position` keeps the order of
+# the blob so readers can rebuild the legacy lists. The (symbol, weight) index is the
+# inverted symbol -> holders index.
+
+INSTITUTE_HOLDING_FIELDS = (
+    'symbol', 'date', 'type', 'securityName', 'putCallShare', 'weight',
+    'sharesNumber', 'marketValue', 'avgPricePaid', 'changeInSharesNumberPercentage',
+)
+ETF_HOLDING_FIELDS = ('asset', 'updated', 'name', 'weightPercentage', 'sharesNumber', 'marketValue')
+
+
+def create_institute_holdings_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS institute_holdings (
+        cik TEXT,
+        position INTEGER,
+        symbol TEXT,
+        date TEXT,
+        type TEXT,
+        securityName TEXT,
+        putCallShare TEXT,
+        weight NUMERIC,
+        sharesNumber NUMERIC,
+        marketValue NUMERIC,
+        avgPricePaid NUMERIC,
+        changeInSharesNumberPercentage NUMERIC,
+        PRIMARY KEY (cik, position)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_institute_holdings_key ON institute_holdings (cik, symbol, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_institute_holdings_symbol ON institute_holdings (symbol, weight DESC)")
+
+
+def create_etf_holdings_table(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS etf_holdings (
+        etf TEXT,
+        position INTEGER,
+        symbol TEXT,
+        date TEXT,
+        name TEXT,
+        weightPercentage NUMERIC,
+        sharesNumber NUMERIC,
+        marketValue NUMERIC,
+        PRIMARY KEY (etf, position)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_etf_holdings_key ON etf_holdings (etf, symbol, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_etf_holdings_symbol ON etf_holdings (symbol, weightPercentage DESC)")
+
+
+def replace_institute_holdings(cursor, cik, holdings):
+    """Swap the rows of one institution for `holdings` (the list stored in institutes.holdings)."""
+    cursor.execute("DELETE FROM institute_holdings WHERE cik = ?", (cik,))
+    cursor.executemany(
+        f"INSERT INTO institute_holdings (cik, position, {', '.join(INSTITUTE_HOLDING_FIELDS)}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in INSTITUTE_HOLDING_FIELDS)})",
+        [(cik, position, *[item.get(field) for field in INSTITUTE_HOLDING_FIELDS])
+         for position, item in enumerate(holdings or [])]
+    )
+
+
+def replace_etf_holdings(cursor, etf, holdings):
+    """Swap the rows of one ETF for `holdings` (the list stored in etfs.holding)."""
+    cursor.execute("DELETE FROM etf_holdings WHERE etf = ?", (etf,))
+    cursor.executemany(
+        "INSERT INTO etf_holdings (etf, position, symbol, date, name, weightPercentage, sharesNumber, marketValue) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(etf, position, *[item.get(field) for field in ETF_HOLDING_FIELDS])
+         for position, item in enumerate(holdings or [])]
+    )
+
+
+def get_institute_holdings(cursor, cik, where='', params=()):
+    """Holdings of one institution in blob order, `where` adds extra SQL filters."""
+    cursor.execute(
+        f"SELECT {', '.join(INSTITUTE_HOLDING_FIELDS)} FROM institute_holdings "
+        f"WHERE cik = ? {where} ORDER BY position",
+        (cik, *params)
+    )
+    return [dict(zip(INSTITUTE_HOLDING_FIELDS, row)) for row in cursor.fetchall()]
+
+
+def get_etf_holders(cursor, symbol, limit=None):
+    """
+    ETFs holding `symbol` with their weight, largest weight first. An ETF listing
+    the asset twice counts with its first position like the old blob scan did.
+    Only ETFs with totalAssets > 0 are returned.
+    """
+    cursor.execute(
+        """
+        SELECT h.etf, e.name, e.totalAssets, h.weightPercentage, MIN(h.position)
+        FROM etf_holdings h JOIN etfs e ON e.symbol = h.etf
+        WHERE h.symbol = ? AND e.totalAssets > 0
+        GROUP BY h.etf
+        ORDER BY h.weightPercentage DESC
+        LIMIT ?
+        """,
+        (symbol, -1 if limit is None else limit)
+    )
+    return [{'symbol': row[0], 'name': row[1], 'totalAssets': int(row[2]), 'weightPercentage': row[3]}
+            for row in cursor.fetchall()]
+
+
+def migrate_institute_holdings(con):
+    """Populate institute_holdings from the institutes.holdings blobs."""
+    cursor = con.cursor()
+    create_institute_holdings_table(cursor)
+    cursor.execute("SELECT cik, holdings FROM institutes WHERE holdings IS NOT NULL")
+    rows = cursor.fetchall()
+    for cik, holdings in rows:
+        try:
+            replace_institute_holdings(cursor, cik, orjson.loads(holdings))
+        except Exception as e:
+            print(f"Skipping holdings of {cik}: {e}")
+    con.commit()
+    return len(rows)
+
+
+def migrate_etf_holdings(con):
+    """Populate etf_holdings from the etfs.holding blobs."""
+    cursor = con.cursor()
+    create_etf_holdings_table(cursor)
+    cursor.execute("SELECT symbol, holding FROM etfs WHERE holding IS NOT NULL")
+    rows = cursor.fetchall()
+    for etf, holding in rows:
+        try:
+            replace_etf_holdings(cursor, etf, orjson.loads(holding))
+        except Exception as e:
+            print(f"Skipping holdings of {etf}: {e}")
+    con.commit()
+    return len(rows)
@@ -0,0 +1,123 @@
+import os
+import numpy as np
+
+# One trading session = 390 one-minute bars (09:30 - 15:59 ET)
+SLOTS = 390
+FIELDS = ('open', 'high', 'low', 'close')
+SESSION_OPEN = 9 * 60 + 30
+STORE_DIR = "json/one-day-price/store"
+
+# File layout: 10 byte ISO date header followed by a SLOTS x FIELDS float32 block.
+# Empty slots are NaN, so the whole file is a fixed 6250 bytes per symbol.
+HEADER_SIZE = 10
+
+
+def empty_bars():
+    return np.full((SLOTS, len(FIELDS)), np.nan, dtype=np.float32)
+
+
+def slot_for(time_str):
+    # "YYYY-MM-DD HH:MM:SS" -> minute offset from the open
+    hour, minute = int(time_str[11:13]), int(time_str[14:16])
+    return hour * 60 + minute - SESSION_OPEN
+
+
+def time_for(date, slot):
+    minutes = SESSION_OPEN + slot
+    return f"{date} {minutes // 60:02d}:{minutes % 60:02d}:00"
+
+
+def last_slot(bars):
+    """Index of the newest filled slot or -1 if nothing is stored yet."""
+    filled = np.flatnonzero(~np.isnan(bars[:, 3]))
+    return int(filled[-1]) if len(filled) else -1
+
+
+def load_store(symbol, directory=STORE_DIR):
+    try:
+        with open(f"{directory}/{symbol}.bin", 'rb') as file:
+            raw = file.read()
+        date = raw[:HEADER_SIZE].decode()
+        bars = np.frombuffer(raw, dtype='<f4', offset=HEADER_SIZE).reshape(SLOTS, len(FIELDS)).copy()
+        return date, bars
+    except Exception:
+        return None, empty_bars()
+
+
+def save_store(symbol, date, bars, directory=STORE_DIR):
+    os.makedirs(directory, exist_ok=True)
+    path = f"{directory}/{symbol}.bin"
+    # Write to a temp file first so readers in the API never see a half-written store
+    with open(f"{path}.tmp", 'wb') as file:
+        file.write(date.encode()[:HEADER_SIZE])
+        file.write(bars.astype('<f4').tobytes())
+    os.replace(f"{path}.tmp", path)
+
+
+def append_bars(bars, rows, date):
+    """
+    Write FMP 1min rows (newest first) into the slot array.
+    Only rows at or after the last stored minute are applied, the last stored
+    minute itself is rewritten since FMP keeps updating the running bar.
+    Returns the number of slots that changed.
+    """
+    cursor = max(last_slot(bars), 0)
+    changed = 0
+    for row in rows:
+        time_str = row.get('date', '')
+        if not time_str.startswith(date):
+            continue
+        slot = slot_for(time_str)
+        if slot < cursor:
+            # rows are sorted newest first, everything after this is already stored
+            break
+        if slot >= SLOTS:
+            continue
+        values = [round(float(row[field]), 2) for field in FIELDS]
+        if not np.array_equal(bars[slot], np.asarray(values, dtype=np.float32)):
+            bars[slot] = values
+            changed += 1
+    return changed
+
+
+def _bar_to_record(date, slot, values):
+    record = {'time': time_for(date, slot)}
+    for field, value in zip(FIELDS, values):
+        record[field] = None if np.isnan(value) else round(float(value), 2)
+    return record
+
+
+def to_records(date, bars, pad=True):
+    """
+    Export the store in the legacy json/one-day-price layout: filled bars in
+    order, optionally followed by empty rows up to and including 16:00.
+    """
+    if date is None:
+        return []
+    last = last_slot(bars)
+    filled = np.flatnonzero(~np.isnan(bars[:last + 1, 3]))
+    res = [_bar_to_record(date, int(slot), bars[slot]) for slot in filled]
+    if pad and last >= 0:
+        res += [{'time': time_for(date, slot), 'open': None, 'high': None, 'low': None, 'close': None}
+                for slot in range(last + 1, SLOTS + 1)]
+    return res
+
+
+def bars_since(date, bars, since=''):
+    """
+    Filled bars at or after `since` ("YYYY-MM-DD HH:MM:SS"), for chart polling.
+    The `since` bar itself is included because the running minute keeps changing.
+    """
+    if date is None:
+        return []
+    start = 0
+    if since and since.startswith(date):
+        try:
+            start = slot_for(since)
+        except ValueError:
+            # Only the date or a malformed time, same as no cursor
+            start = 0
+    # A cursor from a previous session means the client needs the whole day
+    start = min(max(start, 0), SLOTS)
+    filled = np.flatnonzero(~np.isnan(bars[start:, 3])) + start
+    return [_bar_to_record(date, int(slot), bars[slot]) for slot in filled]
@@ -0,0 +1,290 @@
+import sys
+import time
+import types
+import builtins
+import threading
+import contextvars
+from collections import Counter
+
+# Request metrics of the FastAPI app in the Prometheus text format. Every worker
+# keeps its own numbers, a scrape of /metrics shows the worker that served it.
+#
+# Phases are timed by wrapping what the endpoints already call (redis get, open,
+# orjson, gzip), the time lands on the route of the request that is running.
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+# Distinct cache key prefixes, keys with free text parameters fall into 'other'
+MAX_CACHE_PREFIXES = 200
+
+# Phase durations of the current request, None outside of a request
+_phases = contextvars.ContextVar('metrics_phases', default=None)
+
+
+def _format_labels(names, values):
+    return ','.join(f'{name}="{value}"' for name, value in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # labels -> [bucket counts..., count, sum]
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.series.items()]
+        for labels, series in items:
+            label_str = _format_labels(self.label_names, labels)
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{label_str},le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{label_str},le="+Inf"}} {series[-2]}')
+            lines.append(f"{self.name}_count{{{label_str}}} {series[-2]}")
+            lines.append(f"{self.name}_sum{{{label_str}}} {series[-1]}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.series = Counter()
+        self.lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self.lock:
+            self.series[labels] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = list(self.series.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{{{_format_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram('api_request_duration_seconds', 'Total request time.', ('route', 'method', 'status'), LATENCY_BUCKETS)
+PHASE_SECONDS = Histogram('api_request_phase_seconds', 'Time per request spent in a phase.', ('route', 'phase'), LATENCY_BUCKETS)
+RESPONSE_BYTES = Histogram('api_response_size_bytes', 'Response body size as sent.', ('route',), SIZE_BUCKETS)
+CACHE_REQUESTS = CounterMetric('api_cache_requests_total', 'Redis lookups by key prefix.', ('route', 'prefix', 'result'))
+DB_QUERY_SECONDS = Histogram('api_db_query_seconds', 'SQLite query time, executor wait and execution.', ('database', 'stage'), LATENCY_BUCKETS)
+METRICS = (REQUEST_SECONDS, PHASE_SECONDS, RESPONSE_BYTES, CACHE_REQUESTS, DB_QUERY_SECONDS)
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+def add_phase(phase, seconds):
+    phases = _phases.get()
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def timed(phase, func):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            add_phase(phase, time.perf_counter() - start)
+    return wrapper
+
+
+def instrument_module(module, phases):
+    """
+    Copy of `module` whose functions in `phases` ({name: phase}) are timed,
+    e.g. instrument_module(gzip, {'compress': 'compression'}).
+    """
+    instrumented = types.ModuleType(module.__name__)
+    instrumented.__dict__.update(module.__dict__)
+    for name, phase in phases.items():
+        setattr(instrumented, name, timed(phase, getattr(module, name)))
+    return instrumented
+
+
+class TimedFile:
+    # File object whose reads count as file_read
+    def __init__(self, file):
+        self._file = file
+
+    def __enter__(self):
+        self._file.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        return self._file.__exit__(*args)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def read(self, *args):
+        start = time.perf_counter()
+        try:
+            return self._file.read(*args)
+        finally:
+            add_phase('file_read', time.perf_counter() - start)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+def timed_open(*args, **kwargs):
+    start = time.perf_counter()
+    file = builtins.open(*args, **kwargs)
+    add_phase('file_read', time.perf_counter() - start)
+    return TimedFile(file)
+
+
+_cache_prefixes = set()
+
+def cache_key_prefix(key):
+    # "historical-price-AAPL-1Y" -> "historical-price", "json/quote/AAPL.json" -> "json/quote"
+    if isinstance(key, bytes):
+        key = key.decode(errors='ignore')
+    key = str(key)
+    if '/' in key:
+        prefix = key.rsplit('/', 1)[0]
+    else:
+        parts = []
+        for part in key.split('-'):
+            if not (part.isalpha() and part.islower()):
+                break
+            parts.append(part)
+        prefix = '-'.join(parts) or 'other'
+    if prefix not in _cache_prefixes:
+        if len(_cache_prefixes) >= MAX_CACHE_PREFIXES:
+            return 'other'
+        _cache_prefixes.add(prefix)
+    return prefix
+
+
+class InstrumentedRedis:
+    # Redis client whose get is timed as cache_lookup and counted as hit or miss
+    def __init__(self, client):
+        self._client = client
+
+    def get(self, key):
+        start = time.perf_counter()
+        value = self._client.get(key)
+        add_phase('cache_lookup', time.perf_counter() - start)
+        lookup = (cache_key_prefix(key), 'hit' if value else 'miss')
+        phases = _phases.get()
+        if phases is None:
+            CACHE_REQUESTS.inc(('none',) + lookup)
+        else:
+            # Counted by the middleware once the route is known
+            phases.setdefault('_cache', []).append(lookup)
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _route_of(scope):
+    route = scope.get('route')
+    return getattr(route, 'path', None) or 'unmatched'
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording total time, phases and response size per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        phases = {}
+        token = _phases.set(phases)
+        start = time.perf_counter()
+        response = {'status': 500, 'size': 0}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['size'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _phases.reset(token)
+            route = _route_of(scope)
+            REQUEST_SECONDS.observe((route, scope['method'], str(response['status'])), time.perf_counter() - start)
+            RESPONSE_BYTES.observe((route,), response['size'])
+            for lookup in phases.pop('_cache', []):
+                CACHE_REQUESTS.inc((route,) + lookup)
+            for phase, seconds in phases.items():
+                PHASE_SECONDS.observe((route, phase), seconds)
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of one thread (by default the one calling start, i.e.
+    the event loop when started from an endpoint) every `interval` seconds and
+    counts collapsed stacks ("a.py:f;b.py:g N", flamegraph.pl input). Runs in
+    the worker that received the start request only.
+    """
+
+    def __init__(self):
+        self.thread = None
+        self.running = False
+        self.stacks = Counter()
+        self.samples = 0
+
+    def start(self, interval=0.005, thread_id=None):
+        if self.running:
+            return False
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = True
+        target = thread_id or threading.get_ident()
+        self.thread = threading.Thread(target=self._sample, args=(target, interval), daemon=True)
+        self.thread.start()
+        return True
+
+    def _sample(self, target, interval):
+        while self.running:
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(interval)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        return '\n'.join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,82 @@
+import orjson
+import sqlite3
+from collections import defaultdict
+
+# Historical options flow in SQLite, partitioned by trading date. A partition is
+# one json/options-historical-data/flow-data/{date}.json file and is always
+# replaced as a whole, flow_partitions records which dates are loaded. Readers go
+# through the (ticker, cost_basis, date) index so a symbol only touches its own
+# rows and the min premium filter is applied by SQLite.
+
+FLOW_DB = 'options_flow.db'
+
+
+def create_flow_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS flow (
+        id TEXT PRIMARY KEY,
+        date TEXT,
+        position INTEGER,
+        ticker TEXT,
+        cost_basis REAL,
+        data BLOB
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_flow_ticker ON flow (ticker, cost_basis, date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_flow_date ON flow (date)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS flow_partitions (
+        date TEXT PRIMARY KEY,
+        rows INTEGER
+    )
+    """)
+
+
+def connect(path=FLOW_DB):
+    con = sqlite3.connect(path)
+    cursor = con.cursor()
+    cursor.execute("PRAGMA journal_mode = wal")
+    create_flow_tables(cursor)
+    con.commit()
+    return con
+
+
+def get_partitions(cursor):
+    cursor.execute("SELECT date FROM flow_partitions")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def replace_partition(con, date, items):
+    """
+    Swap the rows of `date` for `items` (the list of the flow-data file). Items
+    without an id are skipped, an id seen on an earlier date moves to `date`.
+    """
+    cursor = con.cursor()
+    cursor.execute("DELETE FROM flow WHERE date = ?", (date,))
+    rows = [
+        (item['id'], date, position, item.get('ticker'), item.get('cost_basis'), orjson.dumps(item))
+        for position, item in enumerate(items) if 'id' in item
+    ]
+    cursor.executemany("INSERT OR REPLACE INTO flow (id, date, position, ticker, cost_basis, data) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    cursor.execute("INSERT OR REPLACE INTO flow_partitions (date, rows) VALUES (?, ?)", (date, len(rows)))
+    con.commit()
+    return len(rows)
+
+
+def get_ticker_flow(cursor, ticker, start_date, end_date, min_cost_basis=0):
+    """Flow items of `ticker` with start_date <= date < end_date, in file order per date."""
+    cursor.execute(
+        "SELECT data FROM flow WHERE ticker = ? AND cost_basis >= ? AND date >= ? AND date < ? ORDER BY date, position",
+        (ticker, min_cost_basis, start_date, end_date)
+    )
+    return [orjson.loads(row[0]) for row in cursor.fetchall()]
+
+
+def group_by_ticker(items, min_cost_basis=None):
+    """One pass over a flow list (e.g. the live feed) -> {ticker: [items]} in list order."""
+    res = defaultdict(list)
+    for item in items:
+        if min_cost_basis is not None and item['cost_basis'] < min_cost_basis:
+            continue
+        res[item.get('ticker')].append(item)
+    return res
@@ -0,0 +1,108 @@
+import os
+import orjson
+
+# Intraday export bars (1hour, 30min) with one segment per symbol and month:
+# json/export/price/{interval}/{symbol}/{YYYY-MM}.json, each a list of FMP bars
+# sorted by date. Segments are append only, an update writes just the months its
+# new bars fall into (normally the newest one) and readers open only the months
+# of the range they need.
+
+STORE_DIR = "json/export/price"
+
+
+def segment_key(date_str):
+    # "YYYY-MM-DD HH:MM:SS" -> "YYYY-MM"
+    return date_str[:7]
+
+
+def segment_dir(interval, symbol, directory=STORE_DIR):
+    return f"{directory}/{interval}/{symbol}"
+
+
+def list_segments(interval, symbol, directory=STORE_DIR):
+    """Sorted month keys stored for the symbol."""
+    try:
+        filenames = os.listdir(segment_dir(interval, symbol, directory))
+    except FileNotFoundError:
+        return []
+    return sorted(filename[:-5] for filename in filenames if filename.endswith('.json'))
+
+
+def read_segment(interval, symbol, key, directory=STORE_DIR):
+    try:
+        with open(f"{segment_dir(interval, symbol, directory)}/{key}.json", 'rb') as file:
+            return orjson.loads(file.read())
+    except FileNotFoundError:
+        return []
+
+
+def write_segment(interval, symbol, key, bars, directory=STORE_DIR):
+    path = f"{segment_dir(interval, symbol, directory)}/{key}.json"
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so readers in the API never see a half-written segment
+    with open(f"{path}.tmp", 'wb') as file:
+        file.write(orjson.dumps(bars))
+    os.replace(f"{path}.tmp", path)
+
+
+def last_bar_date(interval, symbol, directory=STORE_DIR):
+    """Date of the newest stored bar or None if nothing is stored yet."""
+    for key in reversed(list_segments(interval, symbol, directory)):
+        bars = read_segment(interval, symbol, key, directory)
+        if bars:
+            return bars[-1]['date']
+    return None
+
+
+def append_bars(interval, symbol, bars, directory=STORE_DIR):
+    """
+    Append FMP bars (any order) after the newest stored bar. Bars at or before
+    it are ignored, a date is stored once. Returns the number of bars appended.
+    """
+    last_date = last_bar_date(interval, symbol, directory) or ''
+    new_bars = {}
+    for bar in bars:
+        if bar.get('date', '') > last_date:
+            new_bars[bar['date']] = bar
+    if not new_bars:
+        return 0
+
+    segments = {}
+    for date in sorted(new_bars):
+        segments.setdefault(segment_key(date), []).append(new_bars[date])
+    for key, segment_bars in segments.items():
+        write_segment(interval, symbol, key, read_segment(interval, symbol, key, directory) + segment_bars, directory)
+    return len(new_bars)
+
+
+def read_range(interval, symbol, start='', end='', directory=STORE_DIR):
+    """
+    Bars with start <= date <= end, both optional "YYYY-MM-DD[ HH:MM:SS]"
+    prefixes (an end date includes its whole day). Only the segments of the
+    months in the range are read.
+    """
+    res = []
+    for key in list_segments(interval, symbol, directory):
+        if (start and key < segment_key(start)) or (end and key > segment_key(end)):
+            continue
+        for bar in read_segment(interval, symbol, key, directory):
+            date = bar['date']
+            if (start and date < start) or (end and date[:len(end)] > end):
+                continue
+            res.append(bar)
+    return res
+
+
+def migrate_flat_file(interval, symbol, directory=STORE_DIR):
+    """
+    Move a legacy json/export/price/{interval}/{symbol}.json file into
+    segments. Returns the number of bars moved.
+    """
+    path = f"{directory}/{interval}/{symbol}.json"
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'rb') as file:
+        bars = orjson.loads(file.read())
+    count = append_bars(interval, symbol, bars, directory)
+    os.remove(path)
+    return count
@@ -0,0 +1,313 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from dateutil.relativedelta import relativedelta
+from scipy.stats import norm
+
+# Vectorized versions of the QuantStats metrics stats.py publishes.
+# Returns of a block of symbols live in one dates x symbols matrix aligned to the
+# benchmark dates, NaN where a symbol has no return on a benchmark day. Every
+# symbol gets its own copy of the benchmark masked to the same days, so one
+# column-wise pass computes the ticker and the benchmark side of every symbol.
+# Aggregates ("M", "A", "Q") are calendar month, year and quarter.
+
+PERIODS = 252
+CONFIDENCE = 0.95
+VAR_Z = norm.ppf(1 - CONFIDENCE)
+ES_FACTOR = norm.pdf(norm.ppf(1 - CONFIDENCE)) / (1 - CONFIDENCE)
+
+# Output order of the quantStats dict
+METRIC_KEYS = [
+    'Expected Daily %', 'Expected Monthly %', 'Expected Yearly %', 'Cumulative Return %', 'CAGR %',
+    'Sharpe', 'Sortino', 'Volatility (ann.) %', 'Calmar', 'Skew', 'Kurtosis', 'Kelly Criterion %',
+    'Risk of Ruin %', 'Daily Value-at-Risk %', 'Expected Shortfall (cVaR) %', 'Max Consecutive Wins',
+    'Max Consecutive Losses', 'Gain/Pain Ratio', 'Gain/Pain (1M)', 'Payoff Ratio', 'Profit Factor',
+    'Common Sense Ratio', 'CPC Index', 'Tail Ratio', 'Outlier Win Ratio', 'Outlier Loss Ratio',
+    'Monthly Return', 'MTD %', '3M %', '6M %', 'YTD %', '1Y %', '3Y (ann.) %', '5Y (ann.) %',
+    '10Y (ann.) %', 'All-time (ann.) %', 'Best Day %', 'Worst Day %', 'Best Month %', 'Worst Month %',
+    'Best Year %', 'Worst Year %', 'Max Drawdown', 'Avg. Drawdown', 'Longest DD Days',
+    'Avg. Drawdown Days', 'Worst 10 Drawdowns', 'Recovery Factor', 'Ulcer Index', 'Serenity Index',
+    'Avg. Up Month %', 'Avg. Down Month %', 'Win Days %', 'Win Month %', 'Win Quarter %', 'Win Year %',
+    'Beta', 'Alpha', 'Correlation', 'Treynor Ratio', 'R^2', 'Start Period', 'End Period',
+]
+RELATIVE_KEYS = ['Beta', 'Alpha', 'Correlation', 'Treynor Ratio', 'R^2']
+
+
+def load_returns(cursor, ticker, start_date, end_date):
+    """Dates and daily returns of one symbol table, like pct_change on the close column"""
+    cursor.execute(f'SELECT date, close FROM "{ticker}" WHERE date BETWEEN ? AND ?', (start_date, end_date))
+    rows = cursor.fetchall()
+    dates = np.array([row[0][:10] for row in rows], dtype='datetime64[D]')
+    close = np.array([row[1] for row in rows], dtype=float)
+    returns = np.full(len(close), np.nan)
+    if len(close) > 1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[1:] = close[1:] / close[:-1] - 1
+    returns[np.isinf(returns)] = np.nan
+    return dates, returns
+
+
+def align_returns(benchmark_dates, dates, returns):
+    """Place a symbol's returns on the benchmark dates, days the benchmark doesn't have are dropped"""
+    aligned = np.full(len(benchmark_dates), np.nan)
+    positions = np.searchsorted(benchmark_dates, dates)
+    inside = positions < len(benchmark_dates)
+    matched = np.zeros(len(dates), dtype=bool)
+    matched[inside] = benchmark_dates[positions[inside]] == dates[inside]
+    aligned[positions[matched]] = returns[matched]
+    return aligned
+
+
+def _divide(numerator, denominator):
+    # Zero denominators give NaN like the Series.replace(0, nan) guards in QuantStats
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return numerator / np.where(denominator == 0, np.nan, denominator)
+
+
+def _max_streak(hit, valid):
+    # Longest run of `hit` over valid rows, invalid rows neither extend nor break a run
+    hits = np.cumsum(hit & valid, axis=0)
+    reset = np.maximum.accumulate(np.where(valid & ~hit, hits, 0), axis=0)
+    return (hits - reset).max(axis=0)
+
+
+def _win_rate(frame):
+    wins = (frame > 0).sum().to_numpy()
+    non_zero = (frame.notna() & (frame != 0)).sum().to_numpy()
+    return np.where(non_zero > 0, wins / np.maximum(non_zero, 1), 0.0)
+
+
+def _compounded(frame, keys):
+    # Compounded return per calendar group, NaN for groups without observations
+    return (frame + 1).groupby(keys).prod(min_count=1) - 1
+
+
+def _expected_return(frame):
+    return np.power((frame + 1).prod().to_numpy(), 1 / frame.count().to_numpy()) - 1
+
+
+def _cagr(total, count):
+    wealth = total + 1.0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(wealth < 0, np.nan, np.abs(wealth) ** (1.0 / (count / PERIODS)) - 1)
+
+
+def _parametric_es(mean, std):
+    return np.where((std == 0) | np.isnan(std), mean, mean - std * ES_FACTOR)
+
+
+def _drawdown_details(dates, dd):
+    """
+    Drawdown periods of one column, deepest first, as (start, end, max drawdown %, days).
+    A period is a run of non-zero drawdown. Like QuantStats nothing is reported
+    when no drawdown starts after the first day.
+    """
+    edges = np.diff(np.concatenate([[False], dd != 0, [False]]).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    if not (starts > 0).any():
+        return []
+    lows = np.minimum.reduceat(dd, starts) * 100
+    days = (dates[ends] - dates[starts]).astype(int) + 1
+    return [(str(dates[starts[i]]), str(dates[ends[i]]), float(lows[i]), int(days[i]))
+            for i in np.argsort(lows, kind='stable')]
+
+
+def _trailing_windows(last_days):
+    """Start day of every trailing window for each distinct last day"""
+    windows = {key: np.empty(len(last_days), dtype='datetime64[D]')
+               for key in ['MTD', '3M', '6M', 'YTD', '1Y', '3Y', '5Y', '10Y']}
+    deltas = {'3M': relativedelta(months=3), '6M': relativedelta(months=6), '1Y': relativedelta(years=1),
+              '3Y': relativedelta(months=35), '5Y': relativedelta(months=59), '10Y': relativedelta(years=10)}
+    for day in np.unique(last_days):
+        columns = last_days == day
+        today = pd.Timestamp(day)
+        windows['MTD'][columns] = np.datetime64(datetime(today.year, today.month, 1), 'D')
+        windows['YTD'][columns] = np.datetime64(datetime(today.year, 1, 1), 'D')
+        for key, delta in deltas.items():
+            windows[key][columns] = np.datetime64((today - delta).date(), 'D')
+    return windows
+
+
+def compute_stats(dates, benchmark, returns, tickers, benchmark_name='SPY'):
+    """
+    quantStats dicts for a block of tickers.
+
+    dates: datetime64[D] (n), benchmark: returns (n), returns: (n, len(tickers)) aligned
+    with align_returns. Returns {ticker: {ticker: metrics, benchmark_name: metrics}}.
+    Tickers without a common day with the benchmark or without any drawdown are left out.
+    """
+    valid = ~np.isnan(returns) & ~np.isnan(benchmark)[:, None]
+    has_data = valid.any(axis=0)
+    tickers = [ticker for ticker, keep in zip(tickers, has_data) if keep]
+    m = len(tickers)
+    if m == 0:
+        return {}
+
+    rows = valid[:, has_data].any(axis=1)
+    dates = dates[rows]
+    valid = valid[rows][:, has_data]
+    ticker_returns = np.where(valid, returns[rows][:, has_data], np.nan)
+    benchmark_returns = np.where(valid, benchmark[rows][:, None], np.nan)
+
+    # Column j is ticker j, column m + j the benchmark over ticker j's days
+    matrix = np.hstack([ticker_returns, benchmark_returns])
+    mask = np.hstack([valid, valid])
+    index = pd.DatetimeIndex(dates)
+    frame = pd.DataFrame(matrix, index=index)
+    count = mask.sum(axis=0)
+
+    # Shared intermediates, each computed once for all columns
+    mean = frame.mean().to_numpy()
+    std = frame.std().to_numpy()
+    gain = frame.sum().to_numpy()
+    total = (frame + 1).prod().to_numpy() - 1
+    cagr = _cagr(total, count)
+    win_rate = _win_rate(frame)
+    quantiles = frame.quantile([0.01, 0.05, 0.95, 0.99])
+    avg_win = frame.where(frame > 0).mean().to_numpy()
+    avg_loss = frame.where(frame < 0).mean().to_numpy()
+    losses = np.abs(frame.where(frame < 0).sum().to_numpy())
+
+    growth = 1 + (np.cumprod(np.where(mask, matrix + 1, 1.0), axis=0) - 1)
+    drawdown = np.where(mask, growth / np.maximum(np.maximum.accumulate(growth, axis=0), 1.0) - 1.0, np.nan)
+    drawdown[drawdown == 0] = 0
+    max_dd = np.abs(np.minimum(np.nanmin(drawdown, axis=0), 0))
+    dd_frame = pd.DataFrame(drawdown)
+    ulcer = np.sqrt(np.nansum(drawdown ** 2, axis=0) / (count - 1))
+    pitfall = _divide(-_parametric_es(dd_frame.mean().to_numpy(), dd_frame.std().to_numpy()), std)
+
+    years, months = index.year, index.month
+    monthly = _compounded(frame, [years, months])
+    quarterly = _compounded(frame, [years, index.quarter])
+    yearly = _compounded(frame, years)
+    monthly_sum = frame.groupby([years, months]).sum()
+    monthly_losses = np.abs(monthly_sum.where(monthly_sum < 0).sum().to_numpy())
+
+    payoff = _divide(avg_win, np.abs(avg_loss))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        profit_factor = frame.where(frame >= 0).sum().to_numpy() / losses
+        calmar = cagr / max_dd
+    profit_factor[np.isinf(profit_factor)] = 0
+    tail_ratio = np.abs(_divide(quantiles.loc[0.95].to_numpy(), quantiles.loc[0.05].to_numpy()))
+    downside = np.sqrt(np.nansum(np.where(matrix < 0, matrix ** 2, 0), axis=0) / count)
+    kelly_ratio = np.where(payoff == 0, np.nan, payoff)
+
+    last_row = len(dates) - 1 - np.argmax(valid[::-1], axis=0)
+    first_row = np.argmax(valid, axis=0)
+    windows = _trailing_windows(np.tile(dates[last_row], 2))
+
+    def window(key):
+        inside = mask & (dates[:, None] >= windows[key][None, :])
+        return np.prod(np.where(inside, matrix + 1, 1.0), axis=0) - 1, inside.sum(axis=0)
+
+    columns = {
+        'Expected Daily %': np.round(_expected_return(frame) * 100, 2),
+        'Expected Monthly %': np.round(_expected_return(monthly) * 100, 2),
+        'Expected Yearly %': np.round(_expected_return(yearly) * 100, 2),
+        'Cumulative Return %': np.round(total * 100, 2),
+        'CAGR %': np.round(cagr * 100, 2),
+        'Sharpe': mean / std * np.sqrt(PERIODS),
+        'Sortino': _divide(mean, downside) * np.sqrt(PERIODS),
+        'Volatility (ann.) %': np.round(std * np.sqrt(PERIODS) * 100, 2),
+        'Calmar': np.round(calmar, 2),
+        'Skew': frame.skew().to_numpy(),
+        'Kurtosis': frame.kurt().to_numpy(),
+        'Kelly Criterion %': np.round((kelly_ratio * win_rate - (1 - win_rate)) / kelly_ratio * 100, 2),
+        'Risk of Ruin %': np.round(((1 - win_rate) / (1 + win_rate)) ** count, 2),
+        'Daily Value-at-Risk %': -np.abs((mean + std * VAR_Z) * 100),
+        'Expected Shortfall (cVaR) %': -np.abs(_parametric_es(mean, std) * 100),
+        'Max Consecutive Wins': _max_streak(matrix > 0, mask),
+        'Max Consecutive Losses': _max_streak(matrix < 0, mask),
+        'Gain/Pain Ratio': _divide(gain, losses),
+        'Gain/Pain (1M)': _divide(gain, monthly_losses),
+        'Payoff Ratio': payoff,
+        'Profit Factor': profit_factor,
+        'Common Sense Ratio': profit_factor * tail_ratio,
+        'CPC Index': profit_factor * win_rate * payoff,
+        'Tail Ratio': tail_ratio,
+        'Outlier Win Ratio': _divide(quantiles.loc[0.99].to_numpy(), frame.where(frame >= 0).mean().to_numpy()),
+        'Outlier Loss Ratio': _divide(quantiles.loc[0.01].to_numpy(), avg_loss),
+        'MTD %': np.round(window('MTD')[0] * 100, 2),
+        '3M %': window('3M')[0] * 100,
+        '6M %': window('6M')[0] * 100,
+        'YTD %': window('YTD')[0] * 100,
+        '1Y %': window('1Y')[0] * 100,
+        '3Y (ann.) %': _cagr(*window('3Y')) * 100,
+        '5Y (ann.) %': _cagr(*window('5Y')) * 100,
+        '10Y (ann.) %': _cagr(*window('10Y')) * 100,
+        'All-time (ann.) %': cagr * 100,
+        'Best Day %': frame.max().to_numpy() * 100,
+        'Worst Day %': frame.min().to_numpy() * 100,
+        'Best Month %': monthly.max().to_numpy() * 100,
+        'Worst Month %': monthly.min().to_numpy() * 100,
+        'Best Year %': yearly.max().to_numpy() * 100,
+        'Worst Year %': yearly.min().to_numpy() * 100,
+        'Recovery Factor': _divide(np.abs(gain), max_dd),
+        'Ulcer Index': ulcer,
+        'Serenity Index': _divide(gain, ulcer * pitfall),
+        'Avg. Up Month %': monthly.where(monthly > 0).mean().to_numpy() * 100,
+        'Avg. Down Month %': monthly.where(monthly < 0).mean().to_numpy() * 100,
+        'Win Days %': win_rate * 100,
+        'Win Month %': _win_rate(monthly) * 100,
+        'Win Quarter %': _win_rate(quarterly) * 100,
+        'Win Year %': _win_rate(yearly) * 100,
+    }
+    columns = {key: value.tolist() for key, value in columns.items()}
+
+    # Monthly return tables: years x 12 months x columns, months without data count as 0
+    year_list = yearly.index.to_numpy()
+    month_grid = np.full((len(year_list), 12, 2 * m), np.nan)
+    month_grid[np.searchsorted(year_list, monthly.index.get_level_values(0)), monthly.index.get_level_values(1) - 1] = monthly.to_numpy()
+    month_table = np.round(np.concatenate([np.nan_to_num(month_grid, nan=0.0), yearly.to_numpy()[:, None, :]], axis=1) * 100, 2)
+    has_year = yearly.notna().to_numpy()
+
+    # Benchmark relative figures, only reported on the ticker side
+    n = count[:m]
+    x_centered = ticker_returns - mean[:m]
+    b_centered = benchmark_returns - mean[m:]
+    covariance = np.nansum(x_centered * b_centered, axis=0) / (n - 1)
+    benchmark_var = np.nansum(b_centered ** 2, axis=0) / (n - 1)
+    ticker_var = np.nansum(x_centered ** 2, axis=0) / (n - 1)
+    beta = np.nan_to_num(_divide(covariance, benchmark_var), nan=0.0)
+    alpha = np.nan_to_num((mean[:m] - beta * mean[m:]) * PERIODS, nan=0.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        correlation = covariance / np.sqrt(ticker_var * benchmark_var)
+    relative = {
+        'Beta': np.round(beta, 2).tolist(),
+        'Alpha': np.round(alpha, 2).tolist(),
+        'Correlation': np.round(correlation * 100, 2).tolist(),
+        'Treynor Ratio': np.round(np.where(beta == 0, 0, _divide(total[:m], beta)) * 100, 2).tolist(),
+        'R^2': np.round(np.clip(correlation, -1, 1) ** 2, 2).tolist(),
+    }
+
+    res = {}
+    for j, ticker in enumerate(tickers):
+        try:
+            dates_j = dates[valid[:, j]]
+            sides = {}
+            for side, column in [(ticker, j), (benchmark_name, m + j)]:
+                details = _drawdown_details(dates_j, drawdown[valid[:, j], column])
+                lows = np.array([item[2] for item in details])
+                days = np.array([item[3] for item in details])
+                values = {key: value[column] for key, value in columns.items()}
+                values.update({
+                    'Monthly Return': {str(year): month_table[y, :, column].tolist()
+                                       for y, year in enumerate(year_list) if has_year[y, column]},
+                    'Max Drawdown': round(float(lows.min()), 2),
+                    'Avg. Drawdown': round(float(lows.mean()), 2),
+                    'Longest DD Days': int(days.max()),
+                    'Avg. Drawdown Days': round(float(days.mean())),
+                    'Worst 10 Drawdowns': [
+                        {'Started': start, 'Recovered': end, 'Drawdown': low, 'Days': length}
+                        for start, end, low, length in details[:10]
+                    ] if column == j else '-',
+                    'Start Period': str(dates[first_row[j]]),
+                    'End Period': str(dates[last_row[j]]),
+                })
+                values.update({key: relative[key][j] if column == j else '-' for key in RELATIVE_KEYS})
+                sides[side] = {key: values[key] for key in METRIC_KEYS}
+            res[ticker] = sides
+        except Exception as e:
+            print(f"Failed create quantStats for {ticker}: {e}")
+    return res
@@ -0,0 +1,21 @@
+import asyncio
+
+# Request pacing for the crons that fetch many small windows concurrently. Unlike
+# the count-and-sleep limiters in the older crons, which burst `rate_limit`
+# requests and then pause, this one spaces the requests evenly over the window,
+# so the concurrent fetchers never stall all at once.
+
+
+class RateLimiter:
+    def __init__(self, max_requests, time_window=60):
+        self.interval = time_window / max_requests
+        self.next_time = 0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = asyncio.get_running_loop().time()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
@@ -0,0 +1,72 @@
+import os
+import time
+import sqlite3
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils.metrics import add_phase, DB_QUERY_SECONDS
+
+# Read-only SQLite access for the API process. Queries run in one bounded
+# executor shared by all databases, every executor thread lazily opens its own
+# connection per database (file:...?mode=ro, so the API can never write).
+# sqlite3 keeps a prepared statement cache per connection, the endpoints use
+# fixed query texts with parameters so each one is prepared once per thread.
+# The crons write in WAL mode, readers never block them and each query sees a
+# consistent snapshot.
+
+SQLITE_WORKERS = int(os.getenv('SQLITE_WORKERS', 8))
+CACHED_STATEMENTS = 256
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=SQLITE_WORKERS, thread_name_prefix='sqlite')
+    return _executor
+
+
+class ReadOnlyDatabase:
+    def __init__(self, path, name=None):
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.local = threading.local()
+
+    def connection(self):
+        con = getattr(self.local, 'con', None)
+        if con is None:
+            con = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, cached_statements=CACHED_STATEMENTS)
+            con.execute("PRAGMA query_only = ON")
+            journal_mode = con.execute("PRAGMA journal_mode").fetchone()[0]
+            if journal_mode != 'wal':
+                print(f"{self.path} is in {journal_mode} mode, readers can block the crons writing to it")
+            self.local.con = con
+        return con
+
+    def _run(self, method, query, params, queued_at):
+        started = time.perf_counter()
+        cursor = self.connection().execute(query, params)
+        try:
+            result = cursor.fetchone() if method == 'one' else cursor.fetchall()
+        finally:
+            cursor.close()
+        finished = time.perf_counter()
+        return result, started - queued_at, finished - started
+
+    async def _submit(self, method, query, params):
+        loop = asyncio.get_running_loop()
+        result, wait_time, execute_time = await loop.run_in_executor(
+            get_executor(), self._run, method, query, params, time.perf_counter()
+        )
+        # Recorded here, the executor threads do not see the request context
+        add_phase('db_query', wait_time + execute_time)
+        DB_QUERY_SECONDS.observe((self.name, 'wait'), wait_time)
+        DB_QUERY_SECONDS.observe((self.name, 'execute'), execute_time)
+        return result
+
+    async def fetchone(self, query, params=()):
+        return await self._submit('one', query, params)
+
+    async def fetchall(self, query, params=()):
+        return await self._submit('all', query, params)